@@ -0,0 +1,32 @@
+"""add rolling_summary_watermark to sessions
+
+Revision ID: 11_rolling_summary_watermark
+Revises: 10_fk_messages_session_id
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '11_rolling_summary_watermark'
+down_revision = '10_fk_messages_session_id'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    existing_cols = {col['name'] for col in inspector.get_columns('sessions')}
+    if 'rolling_summary_watermark' not in existing_cols:
+        op.add_column('sessions', sa.Column('rolling_summary_watermark', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    existing_cols = {col['name'] for col in inspector.get_columns('sessions')}
+    if 'rolling_summary_watermark' in existing_cols:
+        op.drop_column('sessions', 'rolling_summary_watermark')
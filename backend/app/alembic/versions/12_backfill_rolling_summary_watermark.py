@@ -0,0 +1,41 @@
+"""backfill rolling_summary_watermark for sessions that already have a rolling_summary
+
+Revision ID: 12_backfill_summary_watermark
+Revises: 11_rolling_summary_watermark
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '12_backfill_summary_watermark'
+down_revision = '11_rolling_summary_watermark'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # 已有摘要的会话水位为空时，后台首次运行会把全部历史重新并入摘要；
+    # 这里把水位补到会话最新一条消息（与 list_messages_after_watermark 相同的 (create_time, message_id) 全序）
+    op.execute(sa.text(
+        """
+        UPDATE sessions
+        SET rolling_summary_watermark = (
+            SELECT CAST(m.message_id AS VARCHAR(64))
+            FROM messages m
+            WHERE m.session_id = sessions.session_id
+            ORDER BY m.create_time DESC, m.message_id DESC
+            LIMIT 1
+        )
+        WHERE rolling_summary IS NOT NULL
+          AND rolling_summary <> ''
+          AND rolling_summary_watermark IS NULL
+        """
+    ))
+
+
+def downgrade() -> None:
+    # 数据回填不可区分于运行期写入的水位，降级时保持不变
+    pass
@@ -102,6 +102,13 @@ app.include_router(session_rt.router, prefix="/api/sessions", tags=["Sessions"])
 app.include_router(config_rt.router, prefix="/api/config", tags=["Config"])
 
 
+@app.on_event("shutdown")
+async def close_pooled_clients():
+    # 关闭 LLM 共享 HTTP 连接池
+    from service.core.rag.llm.http_pool import llm_http_pool
+    await llm_http_pool.aclose()
+
+
 if __name__=='__main__':
     import uvicorn
     # 在本地开发时，为了让日志配置生效，需要在这里进行配置
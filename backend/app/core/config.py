@@ -64,6 +64,8 @@ class Settings(BaseSettings):
     SM_EMBEDDER_TYPE: Literal["local", "dashscope"] = "local"
     SM_RERANKER_TYPE: Literal["local", "dashscope"] = "local"
     SM_LLM_TYPE: Literal["local", "dashscope", "openai"] = "local"
+    SM_VECTOR_STORE_TYPE: Literal["elasticsearch", "local_mmap"] = "elasticsearch"
+    SM_DOC_STORE_TYPE: Literal["elasticsearch", "sqlite"] = "elasticsearch"  # RAG 检索链路（Dealer/ESVectoreStore/ESIndexer）的文档存储
 
     # RAG 策略与特性开关（T2.2）
     SM_RETRIEVAL_STRATEGY: Literal["basic", "multi_query", "hyde"] = "basic"  # 检索策略
@@ -72,7 +74,17 @@ class Settings(BaseSettings):
     SM_STREAMING_ENABLED: bool = True                                            # SSE 流式开关
     SM_DEFAULT_LANGUAGE: Literal["zh", "en"] = "zh"                           # 默认语言
     SM_MULTI_QUERY_NUM: int = 4                                                  # Multi-Query 子查询数
+    SM_MULTI_QUERY_CONCURRENCY: int = 4                                          # Multi-Query 子查询并发检索数
+    # 跨论文对比：single=整体检索+一次生成；map_reduce=逐文档并行检索/抽取后汇总；auto=文档数达到阈值时用 map_reduce
+    SM_COMPARE_MODE: Literal["single", "map_reduce", "auto"] = "single"          # auto：文档数达到下一项时改用 map_reduce（N+1 次 LLM 调用）
+    SM_COMPARE_MAP_REDUCE_MIN_DOCS: int = 8
+    SM_COMPARE_PER_DOC_TOP_K: int = 6                                            # 每篇文档检索片段数
+    SM_COMPARE_PER_DOC_TOKENS: int = 3000                                        # 每篇文档上下文 token 预算
+    SM_COMPARE_MAP_MAX_TOKENS: int = 512                                         # 单篇要点抽取的最大输出
+    SM_COMPARE_RETRIEVAL_CONCURRENCY: int = 4
+    SM_COMPARE_LLM_CONCURRENCY: int = 4
     SM_HYDE_ENABLED: bool = False                                                # 便捷开关（与 strategy=hyde 二选一）
+    SM_MSEARCH_ZERO_HIT_PREFETCH: bool = False                                   # 主查询与放宽重试查询合并为一次 _msearch（每次检索约多一倍 ES 开销，仅零命中常见时开启）
     # 索引增强开关（默认开启，便于灰度）
     SM_SEMANTIC_CHUNKING_ENABLED: bool = True                                    # 语义感知分块
     SM_MULTIMODAL_PARSE_ENABLED: bool = True                                     # 多模态（表格/图表Caption）抽取
@@ -88,13 +100,109 @@ class Settings(BaseSettings):
     SM_HISTORY_HEADROOM: int = 4096  # 预留给检索上下文/系统提示/答案空间
     HISTORY_RECENT_TURNS: int = 4
     ENABLE_ROLLING_SUMMARY: bool = True
+    # 历史超出预算时，滚动摘要在回答完成后后台生成（本轮使用 摘要+近期原文）；关闭则在回答前同步摘要
+    SM_ROLLING_SUMMARY_BACKGROUND: bool = True
+    SM_ROLLING_SUMMARY_WORKERS: int = 2
+    # 增量合并：每次只并入水位之后的新轮次；摘要大小有上限
+    SM_ROLLING_SUMMARY_MAX_TOKENS: int = 512
+    SM_ROLLING_SUMMARY_MAX_POINTS: int = 12
+    SM_ROLLING_SUMMARY_TURN_CHARS: int = 2000
+    SM_ROLLING_SUMMARY_MAX_DELTA_TURNS: int = 10
+
+    # 查询向量缓存（进程内 LRU+TTL，可选 Redis 二级缓存）
+    SM_EMBED_CACHE_ENABLED: bool = True
+    SM_EMBED_CACHE_MAX_ENTRIES: int = 2048
+    SM_EMBED_CACHE_TTL_SECONDS: int = 3600
+    SM_EMBED_CACHE_REDIS_ENABLED: bool = False
+    SM_EMBED_CACHE_REDIS_TTL_SECONDS: int = 86400
+    # 查询向量跨请求微批（ESVectoreStore.search / Dealer.get_vector 的缓存未命中部分）
+    SM_QUERY_EMBED_BATCH_ENABLED: bool = True
+    SM_QUERY_EMBED_BATCH_MAX_WAIT_MS: float = 5
+    SM_QUERY_EMBED_BATCH_MAX_SIZE: int = 32
+    SM_QUERY_EMBED_BATCH_MAX_IN_FLIGHT: int = 4                   # 同时在途的批次数上限
+    SM_QUERY_EMBED_BATCH_TIMEOUT_SECONDS: float = 3.0              # 等待批次结果的上限，超时后本请求直连生成
+    # 检索结果缓存（按索引/知识库代数失效；Redis 仅用于跨 worker 共享代数）
+    SM_RETRIEVAL_CACHE_ENABLED: bool = True
+    SM_RETRIEVAL_CACHE_MAX_ENTRIES: int = 1024
+    SM_RETRIEVAL_CACHE_TTL_SECONDS: int = 600
+    SM_RETRIEVAL_CACHE_SETTLE_SECONDS: float = 2.0  # 写入后等待 ES refresh 的窗口，期间结果不入缓存
+    SM_RETRIEVAL_CACHE_REDIS_ENABLED: bool = False
+    # 同键并发合并：相同检索 / 相同非流式 LLM prompt 的并发调用共享一次执行
+    SM_SINGLEFLIGHT_ENABLED: bool = True
+    SM_LLM_RESULT_CACHE_TTL_SECONDS: float = 0  # >0 时非流式 LLM 结果短时缓存（秒）
+    SM_LLM_RESULT_CACHE_MAX_ENTRIES: int = 256
+    # 会话索引（sm_sess_*）进程内检索层（平铺向量矩阵，ES 仍为数据源）
+    SM_SESSION_ANN_ENABLED: bool = False           # 本地打分仅近似 ES（BM25 统计/分词有差异），对齐评估前默认关闭
+    SM_SESSION_ANN_MAX_SESSIONS: int = 64
+    SM_SESSION_ANN_MAX_CHUNKS: int = 4000          # 单会话上限，超过则该会话始终走 ES
+    SM_SESSION_ANN_MAX_TOTAL_CHUNKS: int = 20000   # 进程内总量上限（1024 维约 80MB）
+
+    # 向量索引存储（仅影响新建索引；已有索引需经 run_reindex_quantized.py 迁移）
+    SM_VECTOR_INDEX_TYPE: Literal["auto", "hnsw", "int8_hnsw", "int4_hnsw", "bbq_hnsw"] = "auto"  # auto=沿用 ES 动态映射；int8 需 ES 8.12+，int4 8.15+，bbq 8.16+
+    SM_VECTOR_DIMS: int = 1024
+    SM_VECTOR_HNSW_M: int = 16
+    SM_VECTOR_HNSW_EF_CONSTRUCTION: int = 100
+    SM_VECTOR_RESCORE_OVERSAMPLE: float = 0.0  # >0 时对量化候选用 float 向量重打分（需 ES 8.18+）
+
+    # 本地向量存储（SM_VECTOR_STORE_TYPE=local_mmap）
+    SM_LOCAL_VECTOR_STORE_DIR: Optional[str] = None        # 默认 service/core/storage/vector_store
+    SM_LOCAL_VECTOR_STORE_DTYPE: Literal["float32", "int8"] = "float32"
+    SM_LOCAL_VECTOR_STORE_MAX_SEGMENTS: int = 16           # 段数超过即触发后台压缩
+    SM_LOCAL_VECTOR_STORE_IVF_MIN_ROWS: int = 50000        # 压缩后行数达到该值才构建 IVF，否则暴力检索
+    SM_LOCAL_VECTOR_STORE_IVF_NPROBE: int = 8
+
+    # 流式问答 SSE 帧合并（会话 defaults 的 streamFlushBytes/streamFlushMs 可覆盖）
+    SM_SSE_FLUSH_BYTES: int = 64
+    SM_SSE_FLUSH_MS: int = 30
+
+    # LLM HTTP 连接池（rag/llm/http_pool.py）：按 provider 共享 keep-alive 长连接
+    SM_LLM_HTTP_MAX_CONNECTIONS: int = 32
+    SM_LLM_HTTP_MAX_KEEPALIVE: int = 16
+    SM_LLM_HTTP_KEEPALIVE_EXPIRY: float = 60.0     # 空闲连接保留秒数
+    SM_LLM_HTTP2: bool = True                      # 需安装 h2；未安装时自动退回 HTTP/1.1
+    SM_LLM_HTTP_CONNECT_TIMEOUT: float = 5.0
+    SM_LLM_HTTP_READ_TIMEOUT: float = 60.0         # 流式响应相邻数据块的最大间隔
+    SM_LLM_HTTP_WRITE_TIMEOUT: float = 10.0
+    SM_LLM_HTTP_POOL_TIMEOUT: float = 10.0         # 等待空闲连接的最长时间
+
+    # LLM 请求重试与对冲（rag/llm/resilience.py）
+    SM_LLM_RETRY_BACKOFF_BASE: float = 0.5         # 指数退避基数（秒），实际等待为 [0, base*2^n] 内随机
+    SM_LLM_RETRY_BACKOFF_MAX: float = 8.0
+    SM_LLM_HEDGE_ENABLED: bool = False             # 流式请求首 token 超时后发送对冲请求
+    SM_LLM_HEDGE_DEFAULT_DELAY: float = 2.0        # TTFT 样本不足时的对冲延迟（秒）
+    SM_LLM_HEDGE_MIN_DELAY: float = 0.3
+    SM_LLM_HEDGE_MIN_SAMPLES: int = 20
+
+    # SQLite 文档存储（SM_DOC_STORE_TYPE=sqlite）：FTS5 全文 + BLOB 向量，适用于单机部署与 CI
+    SM_SQLITE_DOC_STORE_PATH: Optional[str] = None          # 默认 service/core/storage/doc_store.sqlite3
 
     # 本地模型路径与设备
     LOCAL_EMBEDDER_PATH: str = "/models/bge-large-zh-v1.5"
     LOCAL_RERANKER_PATH: str = "/models/bge-reranker-large"
     LOCAL_LLM_PATH: str = "/models/Qwen1.5-14B-Chat"
     SM_LOCAL_EMBEDDER_DEVICE: str = "cpu"
-    SM_LOCAL_EMBEDDER_BATCH_SIZE: int = 32
+    SM_LOCAL_EMBEDDER_BATCH_SIZE: int = 32                  # 本地编码的长度桶大小（单次前向的条数）
+    # RAG 链路（generate_embedding）的本地 CPU 嵌入引擎：SM_EMBEDDER_TYPE=local 且开启时生效。
+    # 注意与索引中已有向量的模型保持一致，切换模型需重建索引。
+    SM_LOCAL_EMBEDDING_ENGINE_ENABLED: bool = False
+    SM_LOCAL_EMBEDDER_BACKEND: Literal["sentence_transformers", "onnx"] = "sentence_transformers"
+    SM_LOCAL_EMBEDDER_ONNX_FILE: str = "onnx/model.onnx"    # 相对 LOCAL_EMBEDDER_PATH
+    SM_LOCAL_EMBEDDER_POOLING: Literal["cls", "mean"] = "cls"  # ONNX 后端的池化方式（BGE 为 cls）
+    SM_LOCAL_EMBEDDER_THREADS: int = 0                      # ONNX intra-op 线程数，0=默认
+    SM_LOCAL_EMBEDDER_MAX_LENGTH: int = 512
+    SM_LOCAL_EMBEDDER_MAX_BATCH: int = 128                  # 动态合批：单批最多条数
+    SM_LOCAL_EMBEDDER_MAX_WAIT_MS: float = 5                # 动态合批：最早请求的最长等待
+    # 嵌入 API 批量调用（generate_embedding / 导入）：多批并发在途，429 时自适应降并发，逐批重试
+    SM_EMBED_BULK_BATCH_SIZE: int = 10                      # DashScope text-embedding-v3 单次上限 10 条
+    SM_EMBED_BULK_CONCURRENCY: int = 4                      # 最大在途批次数
+    SM_EMBED_BULK_MIN_CONCURRENCY: int = 1
+    SM_EMBED_BULK_RETRIES: int = 3
+    SM_EMBED_QUERY_CONCURRENCY: int = 8                     # 查询向量独立通道的最大在途请求数（不与导入批次共享）
+    # 导入向量的磁盘缓存（SQLite，内容寻址）：重新解析/重传/任务重试时复用已计算的向量
+    SM_EMBED_DISK_CACHE_ENABLED: bool = True
+    SM_EMBED_DISK_CACHE_PATH: Optional[str] = None          # 默认 service/core/storage/embedding_cache.sqlite3
+    SM_EMBED_DISK_CACHE_DTYPE: Literal["float16", "float32"] = "float16"
+    SM_EMBED_DISK_CACHE_MAX_MB: float = 512                 # 超出后按最近访问时间淘汰
     SM_LOCAL_RERANKER_DEVICE: str = "cpu"
 
     # 其他
@@ -35,4 +35,6 @@ class Session(Base):
     # 会话级默认参数（JSON 字符串），用于保存检索/生成等默认设置
     defaults_json = Column(Text, nullable=True)
     # 滚动摘要，保存多轮历史的压缩表示（可选）
-    rolling_summary = Column(Text, nullable=True)
\ No newline at end of file
+    rolling_summary = Column(Text, nullable=True)
+    # 滚动摘要水位：已并入摘要的最后一条消息（messages.message_id），之后的消息增量合并
+    rolling_summary_watermark = Column(String(64), nullable=True)
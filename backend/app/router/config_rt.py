@@ -41,6 +41,38 @@ def get_feature_flags():
     }
 
 
+@router.get("/runtime-stats")
+def get_runtime_stats() -> Dict[str, Any]:
+    """进程内缓存/连接等运行时计数（仅反映当前 worker）。"""
+    from service.core.rag.nlp.embedding_cache import query_embedding_batcher, query_embedding_cache
+    from service.core.rag.retrieval.result_cache import retrieval_result_cache, retrieval_singleflight
+    from service.core.rag.retrieval.session_index import session_index_tier
+    from service.core.rag.llm.http_pool import llm_http_pool
+    from service.core.rag.llm.resilience import llm_resilience_stats
+    from service.core.rag.utils.token_counter import token_counter
+    from service.core.rag.history_summary import rolling_summary_scheduler
+    from service.core.rag.llm.client import llm_result_cache, llm_singleflight
+    from service.core.rag.nlp.local_embedding import local_embedding_stats
+    from service.core.rag.nlp.batch_embedder import batch_embedder
+    from service.core.ingestion.persistent_embedding_cache import get_persistent_embedding_cache
+    embedding_disk_cache = get_persistent_embedding_cache()
+    return {
+        "queryEmbeddingCache": query_embedding_cache.stats(),
+        "queryEmbeddingBatcher": query_embedding_batcher.stats(),
+        "retrievalResultCache": retrieval_result_cache.stats(),
+        "sessionIndexTier": session_index_tier.stats(),
+        "llmHttpPool": llm_http_pool.stats(),
+        "llmResilience": llm_resilience_stats.stats(),
+        "tokenCounter": token_counter.stats(),
+        "rollingSummary": rolling_summary_scheduler.stats(),
+        "singleflight": {"llm": llm_singleflight.stats(), "retrieval": retrieval_singleflight.stats()},
+        "llmResultCache": llm_result_cache.stats(),
+        "localEmbedding": local_embedding_stats(),
+        "batchEmbedder": batch_embedder.stats(),
+        "embeddingDiskCache": (embedding_disk_cache.stats() if embedding_disk_cache is not None else {"enabled": False}),
+    }
+
+
 @router.get("/parsing-health")
 def parsing_health() -> Dict[str, Any]:
     """轻量自检：解析链路关键依赖可用性。
@@ -1,5 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File, Query, Body, Request
 from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from anyio import CancelScope
+import asyncio
 from sqlalchemy.orm import Session
 from schemas.session import CreateSessionRequest, CreateSessionResponse, SessionDefaults, SessionDetail, CompareRequest, CompareResponse
 from schemas.knowledge_base import KnowledgeBaseCreate
@@ -26,6 +29,7 @@ import os
 from core.config import settings
 from utils.ask_logger import AskEventLogger
 from utils.experiments import assign_variant
+from utils.stream_coalescer import coalesce_text_stream
 from service import document_service as _doc_svc
 
 router = APIRouter()
@@ -336,9 +340,26 @@ def delete_session(
     return {"deleted": True}
 
 
+def _persist_message(db: Session, *, session_id: str, question: str, answer: str, retrieval_content: str) -> None:
+    """持久化一轮问答；失败时回滚，不影响已经推送给客户端的流。"""
+    try:
+        db.add(
+            Message(
+                session_id=session_id,
+                user_question=question,
+                model_answer=answer,
+                retrieval_content=retrieval_content,
+            )
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+
+
 @router.post("/{session_id}/ask", summary="RAG 基础问答（流式/非流式）")
 def ask(
     session_id: str,
+    request: Request,
     payload: dict = Body(..., description="{ question: string, stream?: boolean, focusDocIds?: number[], topK?: number, temperature?: number, maxTokens?: number, compressHistory?: boolean }"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
@@ -377,6 +398,8 @@ def ask(
     top_k = payload.get("topK") if isinstance(payload.get("topK"), int) else None
     temperature = payload.get("temperature") if isinstance(payload.get("temperature"), (int, float)) else None
     max_tokens = payload.get("maxTokens") if isinstance(payload.get("maxTokens"), int) else None
+    flush_bytes = None
+    flush_ms = None
 
     if s.defaults_json:
         try:
@@ -387,10 +410,16 @@ def ask(
                 temperature = d.get("temperature")
             if max_tokens is None and isinstance(d.get("maxTokens"), int):
                 max_tokens = d.get("maxTokens")
+            if isinstance(d.get("streamFlushBytes"), int):
+                flush_bytes = d.get("streamFlushBytes")
+            if isinstance(d.get("streamFlushMs"), int):
+                flush_ms = d.get("streamFlushMs")
         except Exception:
             pass
 
     top_k = top_k if isinstance(top_k, int) and 1 <= top_k <= 50 else settings.SM_RAG_TOPK
+    flush_bytes = flush_bytes if flush_bytes is not None else int(getattr(settings, "SM_SSE_FLUSH_BYTES", 64) or 0)
+    flush_ms = flush_ms if flush_ms is not None else int(getattr(settings, "SM_SSE_FLUSH_MS", 30) or 0)
     temperature = temperature if isinstance(temperature, (int, float)) else settings.SM_TEMPERATURE
     max_tokens = max_tokens if isinstance(max_tokens, int) else settings.SM_MAX_TOKENS
 
@@ -399,24 +428,56 @@ def ask(
     variant = assign_variant(user_id=current_user.id, session_id=session_id, key="ask_mq_rrf", buckets=("A","B"))
 
     if stream:
-        def gen():
+        # 异步生成器：ES 检索走 AsyncElasticsearch，LLM 走异步 HTTP 流，数据库读写按步借用线程池，
+        # 单 worker 可同时承载大量流式连接。客户端断开时立即关闭上游 LLM 流，并把已生成的部分答案标记为 aborted 落库。
+        answer_accum: list[str] = []
+        chunks_box: list = []
+        persisted: list = []
+
+        async def persist_aborted(reason: str):
+            import json as _json
+            if persisted:
+                return
+            persisted.append(True)
+            try:
+                logger.info(f"ASK aborted user={current_user.id} session={session_id} reason={reason} partial_chars={sum(len(p) for p in answer_accum)}")
+            except Exception:
+                pass
+            # 断开时所在任务可能已被取消，落库需屏蔽取消
+            with CancelScope(shield=True):
+                await run_in_threadpool(
+                    _persist_message,
+                    db,
+                    session_id=session_id,
+                    question=question,
+                    answer="".join(answer_accum),
+                    retrieval_content=_json.dumps({
+                        "aborted": True,
+                        "abort_reason": reason,
+                        "citations": rag.build_citations(chunks_box[0]) if chunks_box else [],
+                        "retrieval": rag.get_last_retrieval_debug() or {},
+                    }, ensure_ascii=False),
+                )
+
+        async def gen():
             try:
                 idx_override = f"sm_sess_{session_id}"
                 # 先检索，立即告知客户端检索完成，减少“无响应”体感
-                chunks0 = rag.retrieve(
+                chunks0 = await rag.aretrieve(
                     query=question,
                     kb_id=int(s.knowledge_base_id),
                     top_k=top_k,
                     focus_doc_ids=focus_ids,
                     index_override=idx_override,
                 )
+                chunks_box.append(chunks0)
                 import json as _json
                 progress_debug = rag.get_last_retrieval_debug() or {}
                 yield f"event: progress\ndata: {_json.dumps({'stage':'retrieved','hits':len(chunks0),'index':idx_override,'variant':variant,'retrieval':progress_debug})}\n\n"
 
                 # 读取最近会话历史（用户/助手成对），用于多轮对话
-                hist_msgs_all = (
-                    db.query(Message)
+                hist_msgs_all = await run_in_threadpool(
+                    lambda: db.query(Message)
                     .filter(Message.session_id == session_id)
                     .order_by(Message.create_time.desc())
                     .all()
@@ -431,10 +492,30 @@ def ask(
                 hb = rag.get_last_history_debug() or {}
                 history_usage = {"total_turns": len(hist_msgs_all), "estTokens": hb.get("estTokens"), "budgetTokens": hb.get("budgetTokens")}
 
-                answer_accum: list[str] = []
-                for part in rag.generate(question=question, chunks=chunks0, stream=True, history=history_list, compress_history=compress_history, rolling_summary=s.rolling_summary):
-                    answer_accum.append(part)
-                    yield f"data: {part}\n\n"
+                if await request.is_disconnected():
+                    await persist_aborted("client_disconnected")
+                    return
+                # 细碎 delta 按字节/时间阈值合并成较大的 SSE 帧，减少写入与代理开销
+                parts = coalesce_text_stream(
+                    rag.agenerate_stream(question=question, chunks=chunks0, temperature=temperature, max_tokens=max_tokens, history=history_list, compress_history=compress_history, rolling_summary=s.rolling_summary),
+                    max_bytes=flush_bytes,
+                    max_delay_ms=flush_ms,
+                )
+                disconnected = False
+                try:
+                    async for part in parts:
+                        if await request.is_disconnected():
+                            disconnected = True
+                            break
+                        answer_accum.append(part)
+                        yield f"data: {part}\n\n"
+                finally:
+                    # 关闭异步生成器 -> 退出 httpx 流上下文 -> 断开上游连接
+                    with CancelScope(shield=True):
+                        await parts.aclose()
+                if disconnected:
+                    await persist_aborted("client_disconnected")
+                    return
                 # stream tail: attach citations/usage/debug
                 # 对 citations 进行一次轻量去重：按 (document_id,page,chunk_id)
                 raw_cits = rag.build_citations(chunks0)
@@ -456,51 +537,54 @@ def ask(
                     _summary = rag.get_last_history_summary()
                     if _summary and settings.ENABLE_ROLLING_SUMMARY:
                         from service.session_service import SessionService as _SS
-                        _SS(db).update_rolling_summary(session_id=session_id, rolling_summary=_summary)
+                        # 同步摘要已覆盖本轮之前的全部历史，水位推进到其中最新一条，避免后台任务重复合并
+                        _wm = str(hist_msgs[0].message_id) if hist_msgs else None
+                        await run_in_threadpool(_SS(db).update_rolling_summary, session_id=session_id, rolling_summary=_summary, watermark=_wm)
                 except Exception:
                     pass
                 tail = _json.dumps({"citations": citations_tail, "usage": usage_tail, "debug": debug_tail, "variant": variant}, ensure_ascii=False)
                 # 持久化本轮问答（聚合后的答案）
+                await run_in_threadpool(
+                    _persist_message,
+                    db,
+                    session_id=session_id,
+                    question=question,
+                    answer="".join(answer_accum),
+                    retrieval_content=_json.dumps({
+                        "citations": citations_tail,
+                        "retrieval": rag.get_last_retrieval_debug() or {},
+                    }, ensure_ascii=False),
+                )
+                persisted.append(True)
+                # 历史超出预算时，滚动摘要在回答完成后后台生成，供下一轮使用
                 try:
-                    full_answer = "".join(answer_accum)
-                    db.add(
-                        Message(
-                            session_id=session_id,
-                            user_question=question,
-                            model_answer=full_answer,
-                            retrieval_content=_json.dumps({
-                                "citations": citations_tail,
-                                "retrieval": rag.get_last_retrieval_debug() or {},
-                            }, ensure_ascii=False),
-                        )
-                    )
-                    db.commit()
+                    rag.schedule_history_compaction(session_id=session_id)
                 except Exception:
-                    db.rollback()
+                    pass
                 yield f"event: completion\ndata: {tail}\n\n"
+            except (asyncio.CancelledError, GeneratorExit):
+                # 服务端检测到断开后取消了响应任务（或关闭了生成器）
+                await persist_aborted("cancelled")
+                raise
             except Exception as e:
                 try:
                     logger.error(f"ASK stream error user={current_user.id} session={session_id}: {e}")
                 except Exception:
                     pass
                 # 记录流式异常（便于排障）
-                try:
-                    import json as _json
-                    db.add(
-                        Message(
-                            session_id=session_id,
-                            user_question=question,
-                            model_answer="",
-                            retrieval_content=_json.dumps({
-                                "stream_error": True,
-                                "error": str(e),
-                                "retrieval": rag.get_last_retrieval_debug() or {},
-                            }, ensure_ascii=False),
-                        )
-                    )
-                    db.commit()
-                except Exception:
-                    db.rollback()
+                import json as _json
+                await run_in_threadpool(
+                    _persist_message,
+                    db,
+                    session_id=session_id,
+                    question=question,
+                    answer="",
+                    retrieval_content=_json.dumps({
+                        "stream_error": True,
+                        "error": str(e),
+                        "retrieval": rag.get_last_retrieval_debug() or {},
+                    }, ensure_ascii=False),
+                )
                 yield f"event: error\ndata: [Stream Error]\n\n"
         return StreamingResponse(gen(), media_type="text/event-stream; charset=utf-8")
 
@@ -577,7 +661,9 @@ def ask(
     try:
         _summary = rag.get_last_history_summary()
         if _summary and settings.ENABLE_ROLLING_SUMMARY:
-            SessionService(db).update_rolling_summary(session_id=session_id, rolling_summary=_summary)
+            # 同步摘要已覆盖本轮之前的全部历史，水位推进到其中最新一条，避免后台任务重复合并
+            _wm = str(hist_msgs[0].message_id) if hist_msgs else None
+            SessionService(db).update_rolling_summary(session_id=session_id, rolling_summary=_summary, watermark=_wm)
     except Exception:
         pass
     # 持久化本轮问答
@@ -596,6 +682,11 @@ def ask(
         db.commit()
     except Exception:
         db.rollback()
+    # 历史超出预算时，滚动摘要在回答完成后后台生成，供下一轮使用
+    try:
+        rag.schedule_history_compaction(session_id=session_id)
+    except Exception:
+        pass
     return JSONResponse(content={"answer": content, "chunks": chunks, "citations": citations, "usage": usage, "debug": debug})
 
 
@@ -644,6 +735,7 @@ def compare_documents(
             dimensions=payload.dimensions,
             top_k=top_k,
             index_override=idx_override,
+            mode=payload.mode,
         )
         content = result.get("answer")
         chunks = result.get("chunks") or []
@@ -667,6 +759,7 @@ def compare_documents(
         "docIds": payload.docIds,
         "dimensions": dims,
         "retrieval": rag.get_last_retrieval_debug() or {},
+        "compare": result.get("debug") or {},
     }
 
     # 记录一条对比事件日志（与 ask 同结构，便于后续统一分析）
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+向量索引量化迁移与评估脚本
+
+用法：
+    # 1) 以量化映射新建目标索引并 reindex（源索引保持不变）
+    python run_reindex_quantized.py reindex --source scholarmind_default --target scholarmind_default_q8 --index-type int8_hnsw
+
+    # 2) 对比源/目标索引的 recall@k 与延迟（可附加 float 重打分）
+    python run_reindex_quantized.py bench --source scholarmind_default --target scholarmind_default_q8 --k 10 --queries 200 --oversample 3
+
+    # 3) 确认效果后切换：别名 scholarmind_default 原子地指向目标索引（无停机，失败时源索引原样保留）
+    python run_reindex_quantized.py swap --source scholarmind_default --target scholarmind_default_q8
+
+版本要求：int8_hnsw 需 ES 8.12+，int4_hnsw 需 8.15+，bbq_hnsw 需 8.16+；float 重打分（--oversample，
+即 knn.rescore_vector）需 8.18+。仓库 docker-compose 固定的 8.11.3 只支持 hnsw，脚本启动时检查版本并给出提示。
+
+recall 以源索引上的精确余弦相似度（script_score 暴力计算）为基准。查询向量取自源索引中随机抽样的 chunk 向量，
+基准与各变体的检索都排除该 chunk 自身（否则 top-1 恒为自身，recall 偏高）。
+
+swap 之后源名称变为别名：源是实体索引时，与"删除源索引"在同一次 _aliases 请求中原子完成；
+源已是别名（再次迁移）时只切换别名，旧索引默认保留以便回滚（--delete-old 删除）。
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from core.config import settings
+from service.core.rag.utils.es_conn import ESConnection, build_index_body
+
+
+# 各 index_options 类型所需的最低 ES 版本
+_MIN_VERSION = {"hnsw": (8, 0), "int8_hnsw": (8, 12), "int4_hnsw": (8, 15), "bbq_hnsw": (8, 16)}
+_RESCORE_MIN_VERSION = (8, 18)
+
+
+def _es_version(es):
+    number = str(es.info()["version"]["number"])
+    parts = []
+    for x in number.split("-")[0].split(".")[:2]:
+        parts.append(int(x) if x.isdigit() else 0)
+    return tuple(parts), number
+
+
+def _require_version(es, need, what):
+    have, number = _es_version(es)
+    if have < need:
+        print(f"错误: {what} 需要 Elasticsearch {need[0]}.{need[1]}+，当前集群版本为 {number}")
+        sys.exit(1)
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    vs = sorted(values)
+    idx = min(len(vs) - 1, max(0, int(round(p / 100.0 * (len(vs) - 1)))))
+    return float(vs[idx])
+
+
+def _create_target(es, index_name, index_type, dims):
+    if index_type in _MIN_VERSION:
+        _require_version(es, _MIN_VERSION[index_type], f"index_options.type={index_type}")
+    if es.indices.exists(index=index_name):
+        print(f"错误: 目标索引 {index_name} 已存在")
+        sys.exit(1)
+    body = build_index_body(ESConnection().mapping, index_type=index_type, dims=dims)
+    es.indices.create(index=index_name, body=body)
+    print(f"已创建索引 {index_name}（vector index_options={index_type}, dims={dims}）")
+
+
+def _reindex(es, source, target):
+    print(f"开始 reindex: {source} -> {target} ...")
+    t0 = time.time()
+    res = es.reindex(body={"source": {"index": source}, "dest": {"index": target}},
+                     wait_for_completion=True, refresh=True, request_timeout=24 * 3600)
+    failures = res.get("failures") or []
+    print(f"reindex 完成: total={res.get('total')} created={res.get('created')} "
+          f"failures={len(failures)} took={time.time() - t0:.1f}s")
+    if failures:
+        print(json.dumps(failures[:5], ensure_ascii=False, indent=2))
+        sys.exit(1)
+
+
+def _count(es, index_name):
+    es.indices.refresh(index=index_name)
+    return int(es.count(index=index_name)["count"])
+
+
+def cmd_reindex(args):
+    es = ESConnection().es
+    _create_target(es, args.target, args.index_type, args.dims)
+    _reindex(es, args.source, args.target)
+    src_n, dst_n = _count(es, args.source), _count(es, args.target)
+    print(f"文档数: source={src_n} target={dst_n}")
+    if src_n != dst_n:
+        print("警告: 文档数不一致，请检查后再执行 swap")
+
+
+def _sample_queries(es, index_name, n):
+    res = es.search(index=index_name, body={
+        "size": n,
+        "_source": ["vector", "kb_id"],
+        "query": {"function_score": {"query": {"exists": {"field": "vector"}}, "random_score": {"seed": 42, "field": "_seq_no"}}},
+    })
+    out = []
+    for h in res["hits"]["hits"]:
+        src = h.get("_source") or {}
+        if src.get("vector"):
+            out.append((src["vector"], src.get("kb_id"), h["_id"]))
+    return out
+
+
+def _kb_filter(kb_id):
+    return [{"term": {"kb_id": kb_id}}] if kb_id is not None else []
+
+
+def _query_filter(kb_id, exclude_id):
+    # 排除作为查询来源的 chunk 本身
+    return {"bool": {"filter": _kb_filter(kb_id), "must_not": [{"ids": {"values": [exclude_id]}}]}}
+
+
+def _exact_topk(es, index_name, qv, kb_id, exclude_id, k):
+    res = es.search(index=index_name, body={
+        "size": k,
+        "_source": False,
+        "query": {"script_score": {
+            "query": _query_filter(kb_id, exclude_id),
+            "script": {"source": "cosineSimilarity(params.qv, 'vector') + 1.0", "params": {"qv": qv}},
+        }},
+    })
+    return [h["_id"] for h in res["hits"]["hits"]]
+
+
+def _knn_topk(es, index_name, qv, kb_id, exclude_id, k, oversample):
+    knn = {"field": "vector", "query_vector": qv, "k": k, "num_candidates": max(k * 2, 100),
+           "filter": _query_filter(kb_id, exclude_id)}
+    if oversample > 0:
+        knn["rescore_vector"] = {"oversample": oversample}
+    t0 = time.time()
+    res = es.search(index=index_name, body={"size": k, "_source": False, "knn": knn})
+    wall_ms = (time.time() - t0) * 1000
+    return [h["_id"] for h in res["hits"]["hits"]], float(res.get("took", 0)), wall_ms
+
+
+def _store_bytes(es, index_name):
+    try:
+        st = es.indices.stats(index=index_name, metric="store")
+        return int(st["_all"]["primaries"]["store"]["size_in_bytes"])
+    except Exception:
+        return 0
+
+
+def cmd_bench(args):
+    es = ESConnection().es
+    if args.target and args.oversample > 0:
+        have, number = _es_version(es)
+        if have < _RESCORE_MIN_VERSION:
+            print(f"错误: --oversample（knn.rescore_vector）需要 Elasticsearch 8.18+，当前集群版本为 {number}；可用 --oversample 0 跳过重打分评估")
+            sys.exit(1)
+    queries = _sample_queries(es, args.source, args.queries)
+    if not queries:
+        print("错误: 源索引中没有可用的向量")
+        sys.exit(1)
+    print(f"抽样查询 {len(queries)} 条，k={args.k}，计算精确 top-k 基准 ...")
+    truth = [_exact_topk(es, args.source, qv, kb, qid, args.k) for qv, kb, qid in queries]
+
+    variants = [(args.source, 0.0)]
+    if args.target:
+        variants.append((args.target, 0.0))
+        if args.oversample > 0:
+            variants.append((args.target, args.oversample))
+
+    rows = []
+    for index_name, oversample in variants:
+        # 预热一轮，避免首次加载 HNSW 图的开销计入延迟
+        for qv, kb, qid in queries[: min(10, len(queries))]:
+            _knn_topk(es, index_name, qv, kb, qid, args.k, oversample)
+        recalls, took, wall = [], [], []
+        for (qv, kb, qid), gt in zip(queries, truth):
+            ids, t_ms, w_ms = _knn_topk(es, index_name, qv, kb, qid, args.k, oversample)
+            if gt:
+                recalls.append(len(set(ids) & set(gt)) / float(len(gt)))
+            took.append(t_ms)
+            wall.append(w_ms)
+        rows.append({
+            "index": index_name,
+            "rescoreOversample": oversample,
+            "recallAtK": round(sum(recalls) / max(len(recalls), 1), 4),
+            "tookP50Ms": _percentile(took, 50),
+            "tookP95Ms": _percentile(took, 95),
+            "wallP50Ms": round(_percentile(wall, 50), 1),
+            "wallP95Ms": round(_percentile(wall, 95), 1),
+            "storeBytes": _store_bytes(es, index_name),
+        })
+
+    print(f"\n{'index':<40}{'oversample':>11}{'recall@k':>10}{'p50(ms)':>9}{'p95(ms)':>9}{'store(MB)':>11}")
+    for r in rows:
+        print(f"{r['index']:<40}{r['rescoreOversample']:>11.1f}{r['recallAtK']:>10.4f}"
+              f"{r['tookP50Ms']:>9.1f}{r['tookP95Ms']:>9.1f}{r['storeBytes'] / 1048576:>11.1f}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "queries": len(queries), "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已写入 {args.report}")
+
+
+def cmd_swap(args):
+    es = ESConnection().es
+    if not es.indices.exists(index=args.target):
+        print(f"错误: 临时索引 {args.target} 不存在，请先执行 reindex")
+        sys.exit(1)
+    src_n, dst_n = _count(es, args.source), _count(es, args.target)
+    if src_n != dst_n:
+        print(f"错误: 文档数不一致 source={src_n} target={dst_n}，放弃替换")
+        sys.exit(1)
+    if es.indices.exists_alias(name=args.source):
+        # 源已是别名：原子地把别名从旧索引切到目标索引
+        old = [i for i in es.indices.get_alias(name=args.source).keys() if i != args.target]
+        actions = [{"remove": {"index": i, "alias": args.source}} for i in old]
+        actions.append({"add": {"index": args.target, "alias": args.source, "is_write_index": True}})
+        es.indices.update_aliases(body={"actions": actions})
+        print(f"别名 {args.source} 已切换: {old} -> {args.target}")
+        if args.delete_old:
+            for i in old:
+                es.indices.delete(index=i)
+            print(f"已删除旧索引 {old}")
+        else:
+            print(f"旧索引 {old} 保留以便回滚（确认后可加 --delete-old 再执行，或手动删除）")
+        return
+    # 源是实体索引：删除源索引与添加同名别名在同一次请求中原子完成，检索不中断；请求失败时源索引不受影响
+    print(f"将 {args.source} 替换为指向 {args.target} 的别名 ...")
+    es.indices.update_aliases(body={"actions": [
+        {"remove_index": {"index": args.source}},
+        {"add": {"index": args.target, "alias": args.source, "is_write_index": True}},
+    ]})
+    print(f"替换完成: {args.source} -> {args.target}（别名）。{args.target} 即为线上索引，请勿删除")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量索引量化迁移与 recall/延迟评估")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("reindex", help="以量化映射新建目标索引并 reindex")
+    p.add_argument("--source", default=settings.ES_DEFAULT_INDEX)
+    p.add_argument("--target", required=True)
+    p.add_argument("--index-type", default="int8_hnsw", choices=["hnsw", "int8_hnsw", "int4_hnsw", "bbq_hnsw"],
+                   help="int8_hnsw 需 ES 8.12+，int4_hnsw 8.15+，bbq_hnsw 8.16+")
+    p.add_argument("--dims", type=int, default=settings.SM_VECTOR_DIMS)
+    p.set_defaults(func=cmd_reindex)
+
+    p = sub.add_parser("bench", help="对比 recall@k 与延迟")
+    p.add_argument("--source", default=settings.ES_DEFAULT_INDEX)
+    p.add_argument("--target", default=None)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--oversample", type=float, default=3.0, help="目标索引额外评估 float 重打分（需 ES 8.18+，0 关闭）")
+    p.add_argument("--report", default=None, help="JSON 报告输出路径")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("swap", help="把源名称原子地切换为指向目标索引的别名")
+    p.add_argument("--source", default=settings.ES_DEFAULT_INDEX)
+    p.add_argument("--target", required=True)
+    p.add_argument("--delete-old", action="store_true", help="源已是别名时，切换后删除原先指向的旧索引")
+    p.set_defaults(func=cmd_swap)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
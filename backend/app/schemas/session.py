@@ -10,6 +10,9 @@ class SessionDefaults(BaseModel):
     topK: int = Field(5, ge=1, le=50)
     language: Literal["zh", "en"] = Field("zh")
     streaming: bool = Field(True)
+    # 流式输出合并：累计字节数或等待时间任一达到阈值即输出一帧（0 表示关闭该条件）；缺省使用服务端配置
+    streamFlushBytes: Optional[int] = Field(None, ge=0, le=65536)
+    streamFlushMs: Optional[int] = Field(None, ge=0, le=1000)
 
 
 class CreateSessionRequest(BaseModel):
@@ -43,6 +46,7 @@ class CompareRequest(BaseModel):
     """
     docIds: List[int] = Field(..., min_items=2, description="待对比的 document_id 列表（至少2篇）")
     dimensions: List[str] = Field(..., min_items=1, description="对比维度列表")
+    mode: Optional[Literal["single", "map_reduce", "auto"]] = Field(None, description="执行模式；缺省取 SM_COMPARE_MODE")
 
 
 class CompareResponse(BaseModel):
@@ -14,6 +14,7 @@ from service.core.implementations.llms.local import LocalLlm
 from service.core.implementations.llms.dashscope import DashScopeLlm
 from service.core.implementations.llms.openai import OpenAiLlm
 from service.core.implementations.vector_stores.elasticsearch import ElasticsearchVectorStore
+from service.core.implementations.vector_stores.local_mmap import LocalMmapVectorStore
 
 # 这是一个简单的“注册表”模式，用于缓存已创建的组件实例（单例）
 _embedder_instance = None
@@ -67,11 +68,14 @@ def get_llm() -> BaseLLM:
 
 def get_vector_store() -> BaseVectorStore:
     """
-    组件工厂函数：返回一个 BaseVectorStore 的单例。
-    （目前我们只计划一种实现，但工厂模式提供了未来的扩展性）
+    组件工厂函数：根据配置返回一个 BaseVectorStore 的单例。
     """
     global _vector_store_instance
     if _vector_store_instance is None:
-        # 在这里填入 ElasticsearchVectorStore 或其他实现
-        _vector_store_instance = ElasticsearchVectorStore()
+        if settings.SM_VECTOR_STORE_TYPE == "elasticsearch":
+            _vector_store_instance = ElasticsearchVectorStore()
+        elif settings.SM_VECTOR_STORE_TYPE == "local_mmap":
+            _vector_store_instance = LocalMmapVectorStore()
+        else:
+            raise ModelNotFoundError(model_name=settings.SM_VECTOR_STORE_TYPE, message="Unknown vector store type configured.")
     return _vector_store_instance
@@ -0,0 +1,427 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from schemas.rag import Chunk
+from service.core.abstractions.vector_store import BaseVectorStore
+from service.core.api.utils.file_utils import get_project_base_directory
+from core.config import settings
+from utils.get_logger import log
+from exceptions.base import VectorStoreError
+
+
+class _Segment:
+    """一个只追加、写入后不再修改的向量段：segment_{n}.npy（float32 或 int8 + 每行缩放系数）。"""
+
+    def __init__(self, seg_id: int, path: str, dtype: str) -> None:
+        self.seg_id = seg_id
+        self.path = path
+        self.dtype = dtype
+        self.vectors = np.load(path, mmap_mode="r")
+        self.scales = np.load(path[:-4] + ".scale.npy") if dtype == "int8" else None
+        self.assign: Optional[np.ndarray] = None  # IVF 聚类归属（仅压缩后的段有）
+        assign_path = path[:-4] + ".ivf.npy"
+        if os.path.exists(assign_path):
+            assign = np.load(assign_path)
+            # 压缩中断可能留下与本段不匹配的旧归属文件：长度不符时忽略，退化为全量扫描
+            if assign.shape[0] == self.vectors.shape[0]:
+                self.assign = assign
+            else:
+                log.warning(f"LocalMmapVectorStore: ignore stale IVF assignment {assign_path} ({assign.shape[0]} != {self.vectors.shape[0]})")
+        self.alive = np.ones(self.vectors.shape[0], dtype=bool)
+
+    def __len__(self) -> int:
+        return int(self.vectors.shape[0])
+
+    def scores(self, q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        vecs = self.vectors if rows is None else self.vectors[rows]
+        s = np.asarray(vecs, dtype=np.float32) @ q
+        if self.scales is not None:
+            s = s * (self.scales if rows is None else self.scales[rows])
+        return s
+
+
+class _LocalIndex:
+    """
+    单个索引（知识库）的本地存储：
+    - 向量：若干只追加的内存映射段，写入时已归一化（余弦相似度 = 内积）
+    - 元数据：wal.jsonl 预写日志（seg/add/delete_doc），启动时重放得到 chunk 元数据与墓碑
+    - 删除：按文档写墓碑，不修改段文件；后台压缩时物理清除并合并小段、重建 IVF
+    """
+
+    def __init__(self, root: str, dims: int, dtype: str) -> None:
+        self.root = root
+        self.dims = dims
+        self.dtype = dtype
+        self.lock = threading.RLock()
+        self.segments: Dict[int, _Segment] = {}
+        self.meta: Dict[Tuple[int, int], Dict] = {}
+        self.chunk_loc: Dict[str, Tuple[int, int]] = {}
+        self.doc_rows: Dict[str, List[Tuple[int, int]]] = {}
+        self.centroids: Optional[np.ndarray] = None
+        self.next_seg = 0
+        self.compacting = False
+        os.makedirs(root, exist_ok=True)
+        self._replay()
+
+    # --- 持久化 ---
+    @property
+    def wal_path(self) -> str:
+        return os.path.join(self.root, "wal.jsonl")
+
+    def _seg_path(self, seg_id: int) -> str:
+        return os.path.join(self.root, f"segment_{seg_id:06d}.npy")
+
+    def _replay(self) -> None:
+        cent_path = os.path.join(self.root, "ivf_centroids.npy")
+        if os.path.exists(cent_path):
+            self.centroids = np.load(cent_path)
+        if not os.path.exists(self.wal_path):
+            return
+        with open(self.wal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    # 末尾半行（写入中断）直接忽略
+                    continue
+                self._apply(rec)
+        self._drop_orphans()
+
+    def _drop_orphans(self) -> None:
+        """没有元数据的行（写段后、写 WAL 前中断，或被覆盖/删除）一律视为墓碑。"""
+        for seg in self.segments.values():
+            for row in np.flatnonzero(seg.alive):
+                if (seg.seg_id, int(row)) not in self.meta:
+                    seg.alive[row] = False
+
+    def _apply(self, rec: Dict) -> None:
+        op = rec.get("op")
+        if op == "seg":
+            seg_id = int(rec["seg"])
+            path = self._seg_path(seg_id)
+            if os.path.exists(path):
+                self.segments[seg_id] = _Segment(seg_id, path, rec.get("dtype", "float32"))
+            self.next_seg = max(self.next_seg, seg_id + 1)
+        elif op == "add":
+            loc = (int(rec["seg"]), int(rec["row"]))
+            seg = self.segments.get(loc[0])
+            if seg is None:
+                return
+            old = self.chunk_loc.get(rec["chunk_id"])
+            if old is not None:
+                self._kill(old)
+            self.meta[loc] = {"chunk_id": rec["chunk_id"], "document_id": rec.get("document_id"),
+                              "content": rec.get("content", ""), "metadata": rec.get("metadata") or {}}
+            self.chunk_loc[rec["chunk_id"]] = loc
+            self.doc_rows.setdefault(str(rec.get("document_id")), []).append(loc)
+        elif op == "delete_doc":
+            for loc in self.doc_rows.pop(str(rec.get("document_id")), []):
+                self._kill(loc)
+
+    def _kill(self, loc: Tuple[int, int]) -> None:
+        seg = self.segments.get(loc[0])
+        if seg is not None and loc[1] < len(seg):
+            seg.alive[loc[1]] = False
+        m = self.meta.pop(loc, None)
+        if m is not None and self.chunk_loc.get(m["chunk_id"]) == loc:
+            self.chunk_loc.pop(m["chunk_id"], None)
+
+    def _append_wal(self, recs: List[Dict]) -> None:
+        with open(self.wal_path, "a", encoding="utf-8") as f:
+            for r in recs:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_segment(self, seg_id: int, vecs: np.ndarray) -> None:
+        """先写临时文件再原子改名，保证段文件要么完整要么不存在。"""
+        path = self._seg_path(seg_id)
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vecs).max(axis=1), 1e-12) / 127.0
+            q = np.clip(np.round(vecs / scales[:, None]), -127, 127).astype(np.int8)
+            with open(path[:-4] + ".scale.tmp", "wb") as f:
+                np.save(f, scales.astype(np.float32))
+            os.replace(path[:-4] + ".scale.tmp", path[:-4] + ".scale.npy")
+            data = q
+        else:
+            data = vecs.astype(np.float32)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, data)
+        os.replace(path + ".tmp", path)
+
+    # --- 写入/删除 ---
+    def add(self, chunks: List[Chunk]) -> List[str]:
+        rows = [c for c in chunks if c.embedding is not None and len(c.embedding) == self.dims]
+        if not rows:
+            return []
+        vecs = np.asarray([c.embedding for c in rows], dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vecs = vecs / norms
+        with self.lock:
+            seg_id = self.next_seg
+            self.next_seg += 1
+            self._write_segment(seg_id, vecs)
+            recs = [{"op": "seg", "seg": seg_id, "rows": len(rows), "dtype": self.dtype}]
+            recs += [{"op": "add", "seg": seg_id, "row": i, "chunk_id": c.chunk_id, "document_id": c.document_id,
+                      "content": c.content, "metadata": c.metadata} for i, c in enumerate(rows)]
+            self._append_wal(recs)
+            for r in recs:
+                self._apply(r)
+        return [c.chunk_id for c in rows]
+
+    def delete_document(self, document_id: str) -> None:
+        with self.lock:
+            if str(document_id) not in self.doc_rows:
+                return
+            rec = {"op": "delete_doc", "document_id": str(document_id)}
+            self._append_wal([rec])
+            self._apply(rec)
+
+    # --- 检索 ---
+    def search(self, query: List[float], top_k: int) -> List[Tuple[Chunk, float]]:
+        q = np.asarray(query, dtype=np.float32)
+        qn = float(np.linalg.norm(q))
+        if qn == 0 or len(q) != self.dims:
+            return []
+        q = q / qn
+        with self.lock:
+            segments = list(self.segments.values())
+            centroids = self.centroids
+        probes = None
+        if centroids is not None:
+            nprobe = int(getattr(settings, "SM_LOCAL_VECTOR_STORE_IVF_NPROBE", 8) or 8)
+            probes = np.argsort(-(centroids @ q))[:nprobe]
+        cand_scores: List[np.ndarray] = []
+        cand_locs: List[Tuple[int, np.ndarray]] = []
+        for seg in segments:
+            if probes is not None and seg.assign is not None:
+                rows = np.flatnonzero(np.isin(seg.assign, probes) & seg.alive)
+            else:
+                rows = np.flatnonzero(seg.alive)
+            if rows.size == 0:
+                continue
+            cand_scores.append(seg.scores(q, rows))
+            cand_locs.append((seg.seg_id, rows))
+        if not cand_scores:
+            return []
+        scores = np.concatenate(cand_scores)
+        seg_ids = np.concatenate([np.full(rows.size, sid) for sid, rows in cand_locs])
+        row_ids = np.concatenate([rows for _, rows in cand_locs])
+        k = min(top_k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        out: List[Tuple[Chunk, float]] = []
+        with self.lock:
+            for i in top:
+                m = self.meta.get((int(seg_ids[i]), int(row_ids[i])))
+                if m is None:
+                    continue
+                out.append((Chunk(chunk_id=m["chunk_id"], document_id=str(m["document_id"]),
+                                  content=m["content"], metadata=m["metadata"]), float(scores[i])))
+        return out
+
+    # --- 压缩 ---
+    def needs_compaction(self) -> bool:
+        max_segments = int(getattr(settings, "SM_LOCAL_VECTOR_STORE_MAX_SEGMENTS", 16) or 16)
+        with self.lock:
+            total = sum(len(s) for s in self.segments.values())
+            alive = sum(int(s.alive.sum()) for s in self.segments.values())
+            return len(self.segments) > max_segments or (total > 0 and (total - alive) / total > 0.2)
+
+    def compact(self) -> None:
+        """
+        合并所有存活行为一个新段，重写 WAL 快照；行数达到阈值时重建 IVF。
+        压缩期间的新写入追加到 next_seg 之后的段，并在切换时一并保留。
+        """
+        with self.lock:
+            snapshot = {sid: (seg, seg.alive.copy()) for sid, seg in self.segments.items()}
+            new_id = self.next_seg
+            self.next_seg += 1
+        locs, parts = [], []
+        for sid, (seg, alive) in sorted(snapshot.items()):
+            rows = np.flatnonzero(alive)
+            if rows.size == 0:
+                continue
+            v = np.asarray(seg.vectors[rows], dtype=np.float32)
+            if seg.scales is not None:
+                v = v * seg.scales[rows][:, None]
+            parts.append(v)
+            locs.extend((sid, int(r)) for r in rows)
+        merged = np.vstack(parts) if parts else np.zeros((0, self.dims), dtype=np.float32)
+        if merged.shape[0]:
+            self._write_segment(new_id, merged)
+
+        centroids, assign = None, None
+        ivf_min = int(getattr(settings, "SM_LOCAL_VECTOR_STORE_IVF_MIN_ROWS", 50000) or 50000)
+        if merged.shape[0] >= ivf_min:
+            centroids, assign = _kmeans(merged, int(np.sqrt(merged.shape[0])))
+        # IVF 文件先写临时文件，WAL 切换成功后再改名，避免中断时留下与段不匹配的归属/质心
+        assign_path = self._seg_path(new_id)[:-4] + ".ivf.npy"
+        cent_path = os.path.join(self.root, "ivf_centroids.npy")
+        if assign is not None:
+            with open(assign_path + ".tmp", "wb") as f:
+                np.save(f, assign.astype(np.int32))
+            with open(cent_path + ".tmp", "wb") as f:
+                np.save(f, centroids.astype(np.float32))
+        elif os.path.exists(assign_path):
+            os.remove(assign_path)
+
+        with self.lock:
+            # 压缩期间被删除的行：在新段中同样标记为墓碑
+            recs = []
+            if merged.shape[0]:
+                recs.append({"op": "seg", "seg": new_id, "rows": int(merged.shape[0]), "dtype": self.dtype})
+            for new_row, loc in enumerate(locs):
+                m = self.meta.get(loc)
+                if m is None:
+                    continue
+                recs.append({"op": "add", "seg": new_id, "row": new_row, "chunk_id": m["chunk_id"],
+                             "document_id": m["document_id"], "content": m["content"], "metadata": m["metadata"]})
+            # 压缩开始后新写入的段原样保留
+            for sid in sorted(self.segments):
+                if sid in snapshot:
+                    continue
+                seg = self.segments[sid]
+                recs.append({"op": "seg", "seg": sid, "rows": len(seg), "dtype": seg.dtype})
+                for row in np.flatnonzero(seg.alive):
+                    m = self.meta.get((sid, int(row)))
+                    if m is not None:
+                        recs.append({"op": "add", "seg": sid, "row": int(row), "chunk_id": m["chunk_id"],
+                                     "document_id": m["document_id"], "content": m["content"], "metadata": m["metadata"]})
+            tmp = self.wal_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for r in recs:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.wal_path)
+            # 先质心后归属：中间中断时新段没有归属，检索退化为全量扫描而不会用错质心
+            if centroids is not None:
+                os.replace(cent_path + ".tmp", cent_path)
+                os.replace(assign_path + ".tmp", assign_path)
+            elif os.path.exists(cent_path):
+                os.remove(cent_path)
+
+            old_ids = list(snapshot.keys())
+            self.segments, self.meta, self.chunk_loc, self.doc_rows = {}, {}, {}, {}
+            self.centroids = centroids
+            for r in recs:
+                self._apply(r)
+            self._drop_orphans()
+        for sid in old_ids:
+            for suffix in (".npy", ".scale.npy", ".ivf.npy"):
+                p = self._seg_path(sid)[:-4] + suffix
+                try:
+                    if os.path.exists(p):
+                        os.remove(p)
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict:
+        with self.lock:
+            total = sum(len(s) for s in self.segments.values())
+            alive = sum(int(s.alive.sum()) for s in self.segments.values())
+            return {"segments": len(self.segments), "rows": total, "alive": alive, "ivf": self.centroids is not None}
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 10, sample: int = 20000) -> Tuple[np.ndarray, np.ndarray]:
+    """球面 k-means（内积距离），在抽样上训练，再对全部行分配簇。"""
+    rng = np.random.default_rng(42)
+    train = x[rng.choice(x.shape[0], size=min(sample, x.shape[0]), replace=False)]
+    k = max(1, min(k, train.shape[0]))
+    cent = train[rng.choice(train.shape[0], size=k, replace=False)].copy()
+    for _ in range(iters):
+        a = np.argmax(train @ cent.T, axis=1)
+        for j in range(k):
+            members = train[a == j]
+            if members.shape[0]:
+                c = members.mean(axis=0)
+                n = np.linalg.norm(c)
+                cent[j] = c / n if n > 0 else c
+    assign = np.empty(x.shape[0], dtype=np.int32)
+    for start in range(0, x.shape[0], 8192):
+        assign[start:start + 8192] = np.argmax(x[start:start + 8192] @ cent.T, axis=1)
+    return cent, assign
+
+
+class LocalMmapVectorStore(BaseVectorStore):
+    """
+    无需 Elasticsearch 的本地向量存储：每个索引（知识库）一个目录，
+    向量按只追加的内存映射 NumPy 段保存（float32 或 int8），元数据写入 WAL。
+    适用于边缘/开发环境，或小知识库绕开集群开销的快速路径。
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.SM_LOCAL_VECTOR_STORE_DIR or get_project_base_directory("storage", "vector_store")
+        self.default_index = settings.ES_DEFAULT_INDEX
+        self.dims = int(getattr(settings, "SM_VECTOR_DIMS", 1024) or 1024)
+        self.dtype = getattr(settings, "SM_LOCAL_VECTOR_STORE_DTYPE", "float32")
+        self._indexes: Dict[str, _LocalIndex] = {}
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        log.info(f"LocalMmapVectorStore initialized at {self.root} (dtype={self.dtype}, dims={self.dims})")
+
+    def _index(self, index_name: Optional[str]) -> _LocalIndex:
+        name = index_name or self.default_index
+        with self._lock:
+            idx = self._indexes.get(name)
+            if idx is None:
+                idx = _LocalIndex(os.path.join(self.root, name), self.dims, self.dtype)
+                self._indexes[name] = idx
+            return idx
+
+    def _maybe_compact(self, idx: _LocalIndex) -> None:
+        """后台压缩：同一索引同时只运行一个压缩线程。"""
+        if idx.compacting or not idx.needs_compaction():
+            return
+        with self._compaction_lock:
+            if idx.compacting:
+                return
+            idx.compacting = True
+
+        def _run():
+            try:
+                idx.compact()
+                log.info(f"LocalMmapVectorStore: compacted {idx.root} -> {idx.stats()}")
+            except Exception as e:
+                log.error(f"LocalMmapVectorStore: compaction failed for {idx.root}: {e}", exc_info=True)
+            finally:
+                idx.compacting = False
+
+        threading.Thread(target=_run, name="vs-compact", daemon=True).start()
+
+    async def add_chunks(self, chunks: List[Chunk], index_name: str = None) -> List[str]:
+        idx = self._index(index_name)
+        try:
+            ids = await asyncio.to_thread(idx.add, chunks)
+        except Exception as e:
+            log.error(f"LocalMmapVectorStore add_chunks failed: {e}", exc_info=True)
+            raise VectorStoreError(operation="add_chunks")
+        self._maybe_compact(idx)
+        return ids
+
+    async def search(self, query_embedding: List[float], top_k: int, index_name: str = None) -> List[Tuple[Chunk, float]]:
+        idx = self._index(index_name)
+        try:
+            return await asyncio.to_thread(idx.search, query_embedding, top_k)
+        except Exception as e:
+            log.error(f"LocalMmapVectorStore search failed: {e}", exc_info=True)
+            raise VectorStoreError(operation="search")
+
+    async def delete_by_document_id(self, document_id: str, index_name: str = None) -> None:
+        idx = self._index(index_name)
+        try:
+            await asyncio.to_thread(idx.delete_document, document_id)
+        except Exception as e:
+            log.error(f"LocalMmapVectorStore delete_by_document_id failed: {e}", exc_info=True)
+            raise VectorStoreError(operation="delete_by_document_id")
+        self._maybe_compact(idx)
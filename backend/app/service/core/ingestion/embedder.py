@@ -2,7 +2,8 @@ from __future__ import annotations
 
 from typing import Dict, Iterable, List
 from service.core.ingestion.interfaces import ParsedBlock, Embedder
-from service.core.rag.nlp.model import generate_embedding
+from service.core.ingestion.persistent_embedding_cache import get_persistent_embedding_cache
+from service.core.rag.nlp.model import embedding_model_id, generate_embeddings_detailed
 import logging
 
 
@@ -33,8 +34,15 @@ class SimpleAPIEmbedder(Embedder):
     作为第一版可用实现，后续可替换为本地/云端更高性能的实现。
     """
 
+    MODEL_NAME = "text-embedding-v3"
+    DIMENSIONS = 1024
+
     def __init__(self, batch_size: int = 10) -> None:
         self.batch_size = batch_size
+        # 最近一次 embed 中嵌入失败（以零向量占位）的 chunk 下标
+        self.last_failed_indices: List[int] = []
+        # 最近一次 embed 的磁盘向量缓存命中情况（写入任务 resultDetails）
+        self.last_cache_stats: Dict[str, object] = {}
 
     def embed(self, *, chunks: Iterable[ParsedBlock]) -> List[Dict[str, object]]:
         logger = logging.getLogger("ingestion.embedder")
@@ -56,22 +64,54 @@ class SimpleAPIEmbedder(Embedder):
 
         embeddings: List[List[float] | None] = [None] * len(chunk_list)
         # 批量嵌入缺失部分
+        self.last_failed_indices = []
+        self.last_cache_stats = {}
         if missing_indices:
-            texts_missing = [(chunk_list[i].text or "") for i in missing_indices]
-            try:
-                gen = generate_embedding(texts_missing) or []
-            except Exception as e:
-                logger.error(f"SimpleAPIEmbedder: generate_embedding failed: {e}")
-                gen = []
-            for k, i in enumerate(missing_indices):
-                embeddings[i] = gen[k] if k < len(gen) else None
+            # 先查磁盘向量缓存（内容寻址：sha256(文本)+模型+维度），只对未命中的文本请求 API
+            cache = get_persistent_embedding_cache()
+            model_id = embedding_model_id(self.MODEL_NAME)
+            if cache is not None:
+                try:
+                    cached = cache.get_many([(chunk_list[i].text or "") for i in missing_indices], model=model_id, dim=self.DIMENSIONS)
+                except Exception as e:
+                    logger.warning(f"SimpleAPIEmbedder: embedding cache read failed: {e}")
+                    cached = [None] * len(missing_indices)
+                for i, v in zip(missing_indices, cached):
+                    embeddings[i] = v
+                hits = sum(1 for v in cached if v is not None)
+                self.last_cache_stats = {
+                    "hits": hits,
+                    "misses": len(missing_indices) - hits,
+                    "hitRate": round(hits / len(missing_indices), 4),
+                }
+            to_embed = [i for i in missing_indices if embeddings[i] is None]
+            if to_embed:
+                texts_missing = [(chunk_list[i].text or "") for i in to_embed]
+                try:
+                    res = generate_embeddings_detailed(texts_missing, model_name=self.MODEL_NAME, dimensions=self.DIMENSIONS, max_batch_size=self.batch_size)
+                    gen = res.vectors
+                    failed = [to_embed[k] for k in res.failed]
+                except Exception as e:
+                    logger.error(f"SimpleAPIEmbedder: generate_embedding failed: {e}")
+                    gen = []
+                    failed = list(to_embed)
+                for k, i in enumerate(to_embed):
+                    embeddings[i] = gen[k] if k < len(gen) else None
+                if cache is not None:
+                    try:
+                        cache.put_many(texts_missing, [embeddings[i] for i in to_embed], model=model_id, dim=self.DIMENSIONS)
+                    except Exception as e:
+                        logger.warning(f"SimpleAPIEmbedder: embedding cache write failed: {e}")
+                self.last_failed_indices = failed
+                if failed:
+                    logger.error(f"SimpleAPIEmbedder: {len(failed)}/{len(chunk_list)} chunks failed to embed, indices={failed[:50]}")
 
         # 合并预嵌入
         for i in range(len(chunk_list)):
             if pre_vecs[i] is not None:
                 embeddings[i] = pre_vecs[i]
 
-        logger.info(f"SimpleAPIEmbedder: chunks={len(chunk_list)} embeddings_miss={len(missing_indices)}")
+        logger.info(f"SimpleAPIEmbedder: chunks={len(chunk_list)} embeddings_miss={len(missing_indices)} cache={self.last_cache_stats or 'off'}")
         # 兜底：若返回不足，填充空向量
         dim = 1024
         for v in embeddings:
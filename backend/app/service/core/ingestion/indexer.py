@@ -1,7 +1,8 @@
 from __future__ import annotations
 
-from typing import Dict, Iterable, Optional
-from service.core.rag.utils.es_conn import ESConnection
+from typing import Dict, Iterable, List, Optional
+from service.core.rag.utils.doc_store import get_doc_store_conn
+from service.core.rag.retrieval.result_cache import retrieval_generations
 from core.config import settings
 import hashlib
 import logging
@@ -10,9 +11,9 @@ import logging
 class ESIndexer:
     def __init__(self, index_name: str | None = None) -> None:
         self.index_name = index_name or settings.ES_DEFAULT_INDEX
-        self.es = ESConnection()
+        self.es = get_doc_store_conn()
 
-    def index(self, *, records: Iterable[Dict], kb_id: int, document_id: int, session_index: Optional[str] = None) -> None:
+    def index(self, *, records: Iterable[Dict], kb_id: int, document_id: int, session_index: Optional[str] = None) -> List[Dict]:
         docs = []
         for i, r in enumerate(records):
             meta = dict(r.get("metadata", {}))
@@ -32,7 +33,7 @@ class ESIndexer:
                 "vector": r.get("vector", []),
                 **meta,
             })
-        # 交给 ESConnection 批量写入（空列表则跳过）
+        # 交给文档存储（ESConnection / SQLiteConnection）批量写入（空列表则跳过）
         if docs:
             target_index = session_index or self.index_name
             # 可观测性：记录写入的索引名
@@ -41,11 +42,14 @@ class ESIndexer:
             except Exception:
                 pass
             _ = self.es.insert(docs, target_index)
+            retrieval_generations.bump(index_name=target_index, kb_id=kb_id)
+            return docs
         else:
             try:
                 import logging
                 logging.getLogger('ragflow.es_conn').info(f"Indexing skipped: 0 chunks for kb_id={kb_id}, document_id={document_id}, index='{self.index_name}'")
             except Exception:
                 pass
+        return []
 
 
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from core.config import settings
+from service.core.api.utils.file_utils import get_project_base_directory
+
+logger = logging.getLogger("ingestion.embedding_cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    text_hash BLOB NOT NULL,
+    model TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    dtype TEXT NOT NULL,
+    vec BLOB NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (text_hash, model, dim)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_embeddings_last_access ON embeddings(last_access);
+"""
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256((text or "").encode("utf-8", errors="ignore")).digest()
+
+
+class PersistentEmbeddingCache:
+    """
+    磁盘持久化的内容寻址向量缓存（SQLite）：
+    - 键 = (sha256(文本), 模型, 维度)；同一段文本在重新解析、换知识库重传、任务重试时直接复用向量
+    - 向量按 SM_EMBED_DISK_CACHE_DTYPE（float16/float32）压缩为字节存储
+    - 总大小超过 SM_EMBED_DISK_CACHE_MAX_MB 时按 last_access 淘汰最久未用的条目（降到上限的 90%）
+    - 每线程一个连接，WAL 模式；写入由锁串行化。多进程共享同一文件时依赖 SQLite 的 busy timeout
+    """
+
+    _ROW_OVERHEAD = 64  # 每行键/索引的估算开销（字节）
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or getattr(settings, "SM_EMBED_DISK_CACHE_PATH", None) or get_project_base_directory("storage", "embedding_cache.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.dtype = "float16" if getattr(settings, "SM_EMBED_DISK_CACHE_DTYPE", "float16") == "float16" else "float32"
+        self.max_bytes = int(float(getattr(settings, "SM_EMBED_DISK_CACHE_MAX_MB", 512) or 512) * 1024 * 1024)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.executescript(_SCHEMA)
+        self._bytes = self._measure()
+        logger.info(f"PersistentEmbeddingCache: opened {self.path} size={self._bytes / 1048576:.1f}MB dtype={self.dtype}")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _measure(self) -> int:
+        row = self._conn().execute("SELECT COALESCE(SUM(LENGTH(vec)), 0), COUNT(*) FROM embeddings").fetchone()
+        return int(row[0]) + int(row[1]) * self._ROW_OVERHEAD
+
+    @staticmethod
+    def _decode(blob: bytes, dtype: str) -> List[float]:
+        return np.frombuffer(blob, dtype=np.float16 if dtype == "float16" else np.float32).astype(np.float32).tolist()
+
+    def get_many(self, texts: Sequence[str], *, model: str, dim: int) -> List[Optional[List[float]]]:
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        if not texts:
+            return out
+        hashes = [text_hash(t) for t in texts]
+        pos: Dict[bytes, List[int]] = {}
+        for i, h in enumerate(hashes):
+            pos.setdefault(h, []).append(i)
+        conn = self._conn()
+        keys = list(pos.keys())
+        found: List[bytes] = []
+        # SQLite 默认最多 999 个绑定参数
+        for s in range(0, len(keys), 900):
+            part = keys[s:s + 900]
+            rows = conn.execute(
+                f"SELECT text_hash, dtype, vec FROM embeddings WHERE model = ? AND dim = ? AND text_hash IN ({','.join('?' * len(part))})",
+                [model, int(dim), *part],
+            ).fetchall()
+            for h, dtype, blob in rows:
+                vec = self._decode(blob, dtype)
+                for i in pos.get(bytes(h), []):
+                    out[i] = vec
+                found.append(bytes(h))
+        if found:
+            now = time.time()
+            try:
+                with self._write_lock, conn:
+                    conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE text_hash = ? AND model = ? AND dim = ?",
+                        [(now, h, model, int(dim)) for h in found],
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"PersistentEmbeddingCache: touch failed: {e}")
+        hit = sum(1 for v in out if v is not None)
+        with self._stats_lock:
+            self.hits += hit
+            self.misses += len(out) - hit
+        return out
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Optional[List[float]]], *, model: str, dim: int) -> None:
+        np_dtype = np.float16 if self.dtype == "float16" else np.float32
+        now = time.time()
+        rows = []
+        for t, v in zip(texts, vectors):
+            if not v:
+                continue
+            rows.append((text_hash(t), model, int(dim), self.dtype, np.asarray(v, dtype=np_dtype).tobytes(), now))
+        if not rows:
+            return
+        conn = self._conn()
+        with self._write_lock:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (text_hash, model, dim, dtype, vec, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            self._bytes += sum(len(r[4]) + self._ROW_OVERHEAD for r in rows)
+            if self._bytes > self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # 调用方持有 _write_lock；按 last_access 从旧到新删除，直到降到上限的 90%
+        self._bytes = self._measure()
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            rows = conn.execute(
+                "SELECT text_hash, model, dim, LENGTH(vec) FROM embeddings ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            freed = 0
+            batch = []
+            for h, m, d, n in rows:
+                batch.append((h, m, d))
+                freed += int(n) + self._ROW_OVERHEAD
+                if self._bytes - freed <= target:
+                    break
+            with conn:
+                conn.executemany("DELETE FROM embeddings WHERE text_hash = ? AND model = ? AND dim = ?", batch)
+            self._bytes -= freed
+            with self._stats_lock:
+                self.evicted += len(batch)
+        logger.info(f"PersistentEmbeddingCache: evicted to {self._bytes / 1048576:.1f}MB (max {self.max_bytes / 1048576:.0f}MB)")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "dtype": self.dtype,
+                "sizeMB": round(self._bytes / 1048576, 2),
+                "maxMB": round(self.max_bytes / 1048576, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "hitRate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_cache: Optional[PersistentEmbeddingCache] = None
+_cache_failed = False
+_cache_lock = threading.Lock()
+
+
+def get_persistent_embedding_cache() -> Optional[PersistentEmbeddingCache]:
+    """开启 SM_EMBED_DISK_CACHE_ENABLED 时返回进程级单例；打开失败时返回 None（退化为不缓存）。"""
+    global _cache, _cache_failed
+    if not getattr(settings, "SM_EMBED_DISK_CACHE_ENABLED", True) or _cache_failed:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None and not _cache_failed:
+                try:
+                    _cache = PersistentEmbeddingCache()
+                except Exception as e:
+                    _cache_failed = True
+                    logger.warning(f"PersistentEmbeddingCache unavailable: {e}")
+    return _cache
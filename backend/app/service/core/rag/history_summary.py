@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from core.config import settings
+from service.core.rag.utils.token_counter import token_counter
+
+logger = logging.getLogger("rag.history_summary")
+
+
+def summarize_history(llm, history: List[Dict[str, str]], language: str = "zh") -> str:
+    """把对话历史压缩为要点式摘要（最多读取最近 20 条）；失败返回空串。"""
+    try:
+        # 压缩为简洁要点，保留关键信息与用户约束
+        lines = []
+        for m in history:
+            role = m.get("role", "user")
+            content = str(m.get("content", ""))
+            lines.append(f"{role}: {content}")
+        body = "\n".join(lines[-20:])  # 限制输入规模
+        msgs = [
+            {"role": "system", "content": (
+                "请将以下对话历史压缩为6-10条要点，务必保留：用户目标/约束、偏好、拒答规则、安全要求、已达成结论与未决问题，以及与当前问题相关的关键信息。不要虚构。"
+                if language == "zh"
+                else "Summarize the conversation into 6-10 bullet points. MUST preserve: user goals/constraints, preferences, refusal/safety rules, reached conclusions and open questions, and key facts relevant to the current query. Do not fabricate."
+            )},
+            {"role": "user", "content": body},
+        ]
+        # 超时与重试保护
+        summary = llm.generate(msgs, temperature=0.2, max_tokens=256, stream=False)
+        if not summary:
+            summary = llm.generate(msgs, temperature=0.2, max_tokens=256, stream=False)
+        return summary or ""
+    except Exception:
+        return ""
+
+
+def _clip(text: str, limit: int) -> str:
+    text = str(text or "")
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def bound_summary(summary: str, max_tokens: int) -> tuple[str, bool]:
+    """
+    硬性上限：超出 max_tokens 时按行保留开头部分（合并提示要求把目标/约束放在前面）。
+    返回 (摘要, 是否被截断)。
+    """
+    summary = (summary or "").strip()
+    if token_counter.count(summary) <= max_tokens:
+        return summary, False
+    inc = token_counter.incremental(sep="\n")
+    kept: List[str] = []
+    for line in summary.splitlines():
+        if inc.preview(line) > max_tokens:
+            break
+        inc.append(line)
+        kept.append(line)
+    return "\n".join(kept), True
+
+
+def merge_summary(llm, summary: Optional[str], turns: List[Dict[str, str]], language: str = "zh", *, max_tokens: int = 512, max_points: int = 12) -> str:
+    """
+    增量合并：只把新增轮次并入已有摘要，输入规模与会话总长度无关。
+    要求模型把结果控制在 max_points 条要点内（超出时合并/舍弃较旧的细节）；失败返回空串。
+    """
+    try:
+        body = "\n".join(f"{m.get('role', 'user')}: {m.get('content', '')}" for m in turns)
+        if language == "zh":
+            system = (
+                f"你负责维护一段对话的滚动摘要。请把“新增对话”合并进“已有摘要”，输出更新后的完整摘要，最多{max_points}条要点。"
+                "务必保留：用户目标/约束、偏好、拒答规则、安全要求、已达成结论与未决问题；目标与约束放在最前面。"
+                "条目超出上限时，合并相近要点或舍弃较旧且已不相关的细节。不要虚构。"
+            )
+            user = f"已有摘要：\n{summary or '（无）'}\n\n新增对话：\n{body}"
+        else:
+            system = (
+                f"You maintain a rolling summary of a conversation. Merge the NEW TURNS into the EXISTING SUMMARY and output the full updated summary in at most {max_points} bullet points. "
+                "MUST preserve: user goals/constraints, preferences, refusal/safety rules, reached conclusions and open questions; put goals and constraints first. "
+                "When over the limit, merge related points or drop older details that are no longer relevant. Do not fabricate."
+            )
+            user = f"EXISTING SUMMARY:\n{summary or '(none)'}\n\nNEW TURNS:\n{body}"
+        msgs = [{"role": "system", "content": system}, {"role": "user", "content": user}]
+        out = llm.generate(msgs, temperature=0.2, max_tokens=max_tokens, stream=False)
+        return (out or "").strip()
+    except Exception:
+        return ""
+
+
+class RollingSummaryScheduler:
+    """
+    会话滚动摘要的后台增量生成：回答落库后提交，在线程池中读取水位（sessions.rolling_summary_watermark）
+    之后的新消息，与已有摘要合并为新摘要，再经 SessionService.update_rolling_summary 同时写回摘要与水位。
+    每轮只读取新增轮次（通常 1 轮），长会话的摘要成本与会话长度无关。
+    合并策略有上限：要点条数与 token 数受 SM_ROLLING_SUMMARY_MAX_POINTS / SM_ROLLING_SUMMARY_MAX_TOKENS 约束，
+    单轮消息按 SM_ROLLING_SUMMARY_TURN_CHARS 截断，一次最多并入 SM_ROLLING_SUMMARY_MAX_DELTA_TURNS 轮（从最早的开始），
+    积压更多时推进水位后继续合并下一批，直到追上最新消息。
+    同一会话同时只跑一个任务；运行期间的新提交合并为一次重跑（重跑时从最新水位继续）。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._running: set[str] = set()
+        self._next: Dict[str, Dict[str, Any]] = {}
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.turns_merged = 0
+        self.truncated = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(getattr(settings, "ENABLE_ROLLING_SUMMARY", True)) and bool(getattr(settings, "SM_ROLLING_SUMMARY_BACKGROUND", True))
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            workers = int(getattr(settings, "SM_ROLLING_SUMMARY_WORKERS", 2) or 2)
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rolling-summary")
+        return self._executor
+
+    def submit(self, *, session_id: str, language: str) -> bool:
+        job = {"language": language}
+        with self._lock:
+            self.submitted += 1
+            if session_id in self._running:
+                if session_id in self._next:
+                    self.coalesced += 1
+                self._next[session_id] = job
+                return True
+            self._running.add(session_id)
+            pool = self._pool()
+        pool.submit(self._run, session_id, job)
+        return True
+
+    def _run(self, session_id: str, job: Dict[str, Any]) -> None:
+        while job is not None:
+            more = False
+            try:
+                more = self._merge_and_store(session_id, job)
+                with self._lock:
+                    self.completed += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.warning(f"RollingSummary: session={session_id} failed: {e}")
+            with self._lock:
+                nxt = self._next.pop(session_id, None)
+                # 水位之后仍有积压：用同一任务继续合并下一批
+                job = nxt if nxt is not None else (job if more else None)
+                if job is None:
+                    self._running.discard(session_id)
+
+    def _merge_and_store(self, session_id: str, job: Dict[str, Any]) -> bool:
+        """合并水位之后最早的一批消息并推进水位；返回水位之后是否还有未合并的消息。"""
+        from service.core.rag.llm.client import LLMClient
+        from service.session_service import SessionService
+        from utils.database import SessionLocal
+
+        max_tokens = int(getattr(settings, "SM_ROLLING_SUMMARY_MAX_TOKENS", 512) or 512)
+        max_points = int(getattr(settings, "SM_ROLLING_SUMMARY_MAX_POINTS", 12) or 12)
+        turn_chars = int(getattr(settings, "SM_ROLLING_SUMMARY_TURN_CHARS", 2000) or 2000)
+        max_delta = int(getattr(settings, "SM_ROLLING_SUMMARY_MAX_DELTA_TURNS", 10) or 10)
+        db = SessionLocal()
+        try:
+            svc = SessionService(db)
+            s = svc.get_session_by_id(session_id=session_id)
+            if s is None:
+                return False
+            # 多取一条用于判断是否还有积压
+            rows = svc.list_messages_after_watermark(session_id=session_id, watermark=s.rolling_summary_watermark, limit=max_delta + 1)
+            if not rows:
+                return False
+            more = len(rows) > max_delta
+            rows = rows[:max_delta]
+            turns: List[Dict[str, str]] = []
+            for m in rows:
+                turns.append({"role": "user", "content": _clip(m.user_question, turn_chars)})
+                turns.append({"role": "assistant", "content": _clip(m.model_answer, turn_chars)})
+            merged = merge_summary(LLMClient(), s.rolling_summary, turns, job.get("language") or "zh",
+                                   max_tokens=max_tokens, max_points=max_points)
+            if not merged:
+                raise RuntimeError("empty summary")
+            merged, cut = bound_summary(merged, max_tokens)
+            svc.update_rolling_summary(session_id=session_id, rolling_summary=merged, watermark=str(rows[-1].message_id))
+        finally:
+            db.close()
+        with self._lock:
+            self.turns_merged += len(rows)
+            if cut:
+                self.truncated += 1
+        logger.info(f"RollingSummary: session={session_id} merged_turns={len(rows)} chars={len(merged)} truncated={cut} more={more}")
+        return more
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled(),
+                "running": len(self._running),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "coalesced": self.coalesced,
+                "turnsMerged": self.turns_merged,
+                "truncated": self.truncated,
+            }
+
+
+rolling_summary_scheduler = RollingSummaryScheduler()
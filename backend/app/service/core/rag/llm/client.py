@@ -1,8 +1,29 @@
 from __future__ import annotations
-from typing import Iterable, Generator, Optional, Dict, Any, List
+from typing import AsyncIterator, Iterable, Generator, Optional, Dict, Any, List
+import asyncio
+import hashlib
+import json
+import logging
+import queue
+import threading
 import time
+import uuid
 from core.config import settings
 import httpx
+from service.core.rag.llm.http_pool import llm_http_pool
+from service.core.rag.llm.sse import aiter_stream_deltas, iter_stream_deltas
+from service.core.rag.llm.resilience import backoff_delay, is_retryable, llm_resilience_stats
+from utils.singleflight import SingleFlight
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger("rag.llm")
+
+# 非流式调用的同键合并与可选短 TTL 结果缓存（键为 provider/model/messages/参数 的哈希）
+llm_singleflight = SingleFlight("llm.generate")
+llm_result_cache = TTLCache(
+    max_entries=int(getattr(settings, "SM_LLM_RESULT_CACHE_MAX_ENTRIES", 256) or 256),
+    ttl_seconds=float(getattr(settings, "SM_LLM_RESULT_CACHE_TTL_SECONDS", 0) or 0),
+)
 
 
 class LLMClient:
@@ -10,7 +31,10 @@ class LLMClient:
     Unified LLM client facade:
     - providers: dashscope/openai/local
     - streaming & non-streaming
-    - simple retry with backoff
+    - retry with jittered exponential backoff; one idempotent request id per logical call
+    - optional hedging for streams (sync and async): duplicate the request if no first token within p95 TTFT
+    - pooled keep-alive HTTP clients shared per provider (see http_pool.py)
+    - non-streaming: identical concurrent calls share one in-flight request; optional short-TTL result cache
     """
 
     def __init__(self) -> None:
@@ -43,15 +67,64 @@ class LLMClient:
     ) -> Iterable[str] | str:
         if stream:
             return self._generate_stream(messages, temperature, max_tokens, retries)
-        return self._generate_once(messages, temperature, max_tokens, retries)
+        if not getattr(settings, "SM_SINGLEFLIGHT_ENABLED", True):
+            return self._generate_once(messages, temperature, max_tokens, retries)
+        return self._generate_once_coalesced(messages, temperature, max_tokens, retries)
+
+    async def agenerate_stream(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        temperature: float = 0.3,
+        max_tokens: int = 512,
+        retries: int = 2,
+    ) -> AsyncIterator[str]:
+        """
+        异步流式生成（共享 AsyncClient）。调用方停止迭代（aclose）或任务被取消时，
+        `async with client.stream(...)` 随之退出并关闭上游响应，模型不再继续生成。
+        重试与对冲语义与同步路径（_hedged_stream）一致。
+        """
+        if self.provider not in ("dashscope", "openai"):
+            content = self._fake_completion(messages, temperature, max_tokens)
+            for part in content.split():
+                yield part + " "
+            return
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+        # 显式关闭内层生成器：外层被 aclose/取消时，内层的 finally 才会及时取消在途请求
+        inner = self._ahedged_stream(payload, retries)
+        try:
+            async for content in inner:
+                yield content
+        finally:
+            await inner.aclose()
 
     # --- internals ---
+    def _request_parts(self, payload: Dict[str, Any], request_id: str) -> tuple[str, Dict[str, str]]:
+        url = f"{self.base_url.rstrip('/')}/chat/completions"
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            # 同一次逻辑调用的重试/对冲共用同一个请求 ID，便于上游去重与链路排查
+            "X-Request-Id": request_id,
+            "Idempotency-Key": request_id,
+        }
+        return url, headers
+
+    @staticmethod
+    def _iter_stream_content(resp: httpx.Response) -> Generator[str, None, None]:
+        # 在原始字节流上解码 SSE（orjson 解析，支持多行事件与 [DONE]），见 sse.py
+        yield from iter_stream_deltas(resp.iter_bytes())
+
     def _generate_stream(
         self, messages: List[Dict[str, str]], temperature: float, max_tokens: int, retries: int
     ) -> Generator[str, None, None]:
         if self.provider in ("dashscope", "openai"):
-            url = f"{self.base_url.rstrip('/')}/chat/completions"
-            headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
             payload = {
                 "model": self.model,
                 "messages": messages,
@@ -59,32 +132,7 @@ class LLMClient:
                 "max_tokens": max_tokens,
                 "stream": True,
             }
-            # 直连 SSE，逐行解析 data: {...}
-            with httpx.stream("POST", url, headers=headers, json=payload, timeout=60.0) as resp:
-                resp.raise_for_status()
-                for line in resp.iter_lines():
-                    if not line:
-                        continue
-                    if isinstance(line, bytes):
-                        line = line.decode("utf-8", errors="ignore")
-                    if line.startswith("data: "):
-                        data = line[len("data: "):].strip()
-                        if data == "[DONE]":
-                            break
-                        try:
-                            obj = httpx.Response(200, text=data).json()
-                        except Exception:
-                            # 兜底：直接输出原始片段
-                            yield data
-                            continue
-                        # OpenAI/DashScope 兼容：delta.content 或 choices[0].message.content
-                        choices = obj.get("choices") or []
-                        if choices:
-                            c0 = choices[0]
-                            delta = c0.get("delta") or {}
-                            content = delta.get("content") or c0.get("message", {}).get("content")
-                            if content:
-                                yield content
+            yield from self._hedged_stream(payload, retries)
             return
         # 本地占位：仅用于无 Key 的开发场景
         content = self._fake_completion(messages, temperature, max_tokens)
@@ -92,12 +140,239 @@ class LLMClient:
             yield part + " "
         return
 
+    def _hedged_stream(self, payload: Dict[str, Any], retries: int) -> Generator[str, None, None]:
+        """
+        直连 SSE 的流式生成，带重试与对冲：
+        - 每个尝试在独立线程中读取上游流，token 经队列交给调用方
+        - 首个 token 到达前失败的尝试按退避重试（最多 retries 次）；已输出 token 后的失败直接抛出，避免重复内容
+        - 开启对冲时，若 hedge_delay（近期 TTFT p95）内仍无首 token，再发一个相同请求，先出 token 的一方胜出，另一方被取消
+        """
+        request_id = uuid.uuid4().hex
+        url, headers = self._request_parts(payload, request_id)
+        client = llm_http_pool.client(self.provider, self.base_url)
+        hedge_enabled = bool(getattr(settings, "SM_LLM_HEDGE_ENABLED", False))
+        events: "queue.Queue[tuple[int, str, Any]]" = queue.Queue()
+        cancels: List[threading.Event] = []
+        hedge_attempts: set[int] = set()
+        started: List[float] = []
+        llm_resilience_stats.incr("requests")
+
+        def worker(k: int, cancel: threading.Event) -> None:
+            try:
+                with client.stream("POST", url, headers=headers, json=payload,
+                                   extensions=llm_http_pool.trace_extensions(self.provider)) as resp:
+                    resp.raise_for_status()
+                    for content in self._iter_stream_content(resp):
+                        if cancel.is_set():
+                            return
+                        events.put((k, "token", content))
+                events.put((k, "done", None))
+            except Exception as e:
+                events.put((k, "error", e))
+
+        def start(is_hedge: bool = False) -> None:
+            started.append(time.time())
+            k = len(cancels)
+            cancels.append(threading.Event())
+            if is_hedge:
+                hedge_attempts.add(k)
+            threading.Thread(target=worker, args=(k, cancels[k]), daemon=True, name=f"llm-stream-{request_id[:8]}-{k}").start()
+
+        start()
+        in_flight = 1
+        retries_left = max(0, int(retries))
+        hedged = False
+        winner: Optional[int] = None
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge_enabled and not hedged:
+                    timeout = max(0.0, llm_resilience_stats.hedge_delay() - (time.time() - started[-1]))
+                try:
+                    k, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedged = True
+                    llm_resilience_stats.incr("hedges_fired")
+                    start(is_hedge=True)
+                    in_flight += 1
+                    continue
+                if winner is not None and k != winner:
+                    continue
+                if kind == "token":
+                    if winner is None:
+                        winner = k
+                        llm_resilience_stats.record_ttft(time.time() - started[k])
+                        if k in hedge_attempts:
+                            llm_resilience_stats.incr("hedges_won")
+                        for j, c in enumerate(cancels):
+                            if j != k:
+                                c.set()
+                    yield value
+                elif kind == "done":
+                    if winner is None:
+                        winner = k
+                    return
+                else:
+                    if winner is not None:
+                        # 已输出部分内容，无法安全重试
+                        llm_resilience_stats.incr("failures")
+                        raise value
+                    in_flight -= 1
+                    if in_flight > 0:
+                        continue
+                    if retries_left > 0 and is_retryable(value):
+                        delay = backoff_delay(int(retries) - retries_left, value)
+                        retries_left -= 1
+                        llm_resilience_stats.incr("retries")
+                        try:
+                            logger.warning(f"LLM stream attempt failed, retrying in {delay:.2f}s request_id={request_id}: {value}")
+                        except Exception:
+                            pass
+                        time.sleep(delay)
+                        start()
+                        in_flight += 1
+                        continue
+                    llm_resilience_stats.incr("failures")
+                    raise value
+        finally:
+            for c in cancels:
+                c.set()
+
+    async def _ahedged_stream(self, payload: Dict[str, Any], retries: int) -> AsyncIterator[str]:
+        """
+        _hedged_stream 的异步版本：
+        - 每个尝试是一个读取上游流的 Task，token 经 asyncio.Queue 交给调用方
+        - 首个 token 到达前失败的尝试按退避重试（最多 retries 次）；已输出 token 后的失败直接抛出
+        - 开启对冲时，若 hedge_delay（近期 TTFT p95）内仍无首 token，再发一个相同请求，先出 token 的一方胜出，
+          另一方的 Task 被取消（退出 stream 上下文即关闭其上游响应）
+        """
+        request_id = uuid.uuid4().hex
+        url, headers = self._request_parts(payload, request_id)
+        client = llm_http_pool.async_client(self.provider, self.base_url)
+        hedge_enabled = bool(getattr(settings, "SM_LLM_HEDGE_ENABLED", False))
+        events: "asyncio.Queue[tuple[int, str, Any]]" = asyncio.Queue()
+        tasks: List[asyncio.Task] = []
+        hedge_attempts: set[int] = set()
+        started: List[float] = []
+        llm_resilience_stats.incr("requests")
+
+        async def worker(k: int) -> None:
+            try:
+                async with client.stream("POST", url, headers=headers, json=payload,
+                                         extensions=llm_http_pool.async_trace_extensions(self.provider)) as resp:
+                    resp.raise_for_status()
+                    async for content in aiter_stream_deltas(resp.aiter_bytes()):
+                        events.put_nowait((k, "token", content))
+                events.put_nowait((k, "done", None))
+            except Exception as e:
+                events.put_nowait((k, "error", e))
+
+        def start(is_hedge: bool = False) -> None:
+            started.append(time.time())
+            k = len(tasks)
+            if is_hedge:
+                hedge_attempts.add(k)
+            tasks.append(asyncio.create_task(worker(k), name=f"llm-astream-{request_id[:8]}-{k}"))
+
+        def cancel_others(keep: Optional[int]) -> None:
+            for j, t in enumerate(tasks):
+                if j != keep and not t.done():
+                    t.cancel()
+
+        start()
+        in_flight = 1
+        retries_left = max(0, int(retries))
+        hedged = False
+        winner: Optional[int] = None
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge_enabled and not hedged:
+                    timeout = max(0.0, llm_resilience_stats.hedge_delay() - (time.time() - started[-1]))
+                try:
+                    k, kind, value = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    hedged = True
+                    llm_resilience_stats.incr("hedges_fired")
+                    start(is_hedge=True)
+                    in_flight += 1
+                    continue
+                if winner is not None and k != winner:
+                    continue
+                if kind == "token":
+                    if winner is None:
+                        winner = k
+                        llm_resilience_stats.record_ttft(time.time() - started[k])
+                        if k in hedge_attempts:
+                            llm_resilience_stats.incr("hedges_won")
+                        cancel_others(k)
+                    yield value
+                elif kind == "done":
+                    if winner is None:
+                        winner = k
+                    return
+                else:
+                    if winner is not None:
+                        # 已输出部分内容，无法安全重试
+                        llm_resilience_stats.incr("failures")
+                        raise value
+                    in_flight -= 1
+                    if in_flight > 0:
+                        continue
+                    if retries_left > 0 and is_retryable(value):
+                        delay = backoff_delay(int(retries) - retries_left, value)
+                        retries_left -= 1
+                        llm_resilience_stats.incr("retries")
+                        try:
+                            logger.warning(f"LLM async stream attempt failed, retrying in {delay:.2f}s request_id={request_id}: {value}")
+                        except Exception:
+                            pass
+                        await asyncio.sleep(delay)
+                        start()
+                        in_flight += 1
+                        continue
+                    llm_resilience_stats.incr("failures")
+                    raise value
+        finally:
+            # 调用方 aclose/取消或本次结束：取消所有仍在读取的尝试，并等待其关闭上游连接
+            cancel_others(None)
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _prompt_key(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        raw = json.dumps({
+            "provider": self.provider,
+            "base_url": self.base_url,
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    def _generate_once_coalesced(
+        self, messages: List[Dict[str, str]], temperature: float, max_tokens: int, retries: int
+    ) -> str:
+        # 相同 prompt 的并发调用只发一次上游请求；开启结果缓存时短时间内的重复调用直接返回
+        key = self._prompt_key(messages, temperature, max_tokens)
+        ttl = float(getattr(settings, "SM_LLM_RESULT_CACHE_TTL_SECONDS", 0) or 0)
+        if ttl > 0:
+            hit = llm_result_cache.get(key)
+            if hit is not None:
+                return hit
+
+        def call() -> str:
+            out = self._generate_once(messages, temperature, max_tokens, retries)
+            if ttl > 0 and out:
+                llm_result_cache.set(key, out, ttl_seconds=ttl)
+            return out
+
+        out, _shared = llm_singleflight.do(key, call)
+        return out
+
     def _generate_once(
         self, messages: List[Dict[str, str]], temperature: float, max_tokens: int, retries: int
     ) -> str:
         if self.provider in ("dashscope", "openai"):
-            url = f"{self.base_url.rstrip('/')}/chat/completions"
-            headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
             payload = {
                 "model": self.model,
                 "messages": messages,
@@ -105,8 +380,28 @@ class LLMClient:
                 "max_tokens": max_tokens,
                 "stream": False,
             }
-            r = httpx.post(url, headers=headers, json=payload, timeout=60.0)
-            r.raise_for_status()
+            request_id = uuid.uuid4().hex
+            url, headers = self._request_parts(payload, request_id)
+            client = llm_http_pool.client(self.provider, self.base_url)
+            llm_resilience_stats.incr("requests")
+            attempt = 0
+            while True:
+                try:
+                    r = client.post(url, headers=headers, json=payload, extensions=llm_http_pool.trace_extensions(self.provider))
+                    r.raise_for_status()
+                    break
+                except Exception as e:
+                    if attempt >= max(0, int(retries)) or not is_retryable(e):
+                        llm_resilience_stats.incr("failures")
+                        raise
+                    delay = backoff_delay(attempt, e)
+                    attempt += 1
+                    llm_resilience_stats.incr("retries")
+                    try:
+                        logger.warning(f"LLM request failed, retrying in {delay:.2f}s request_id={request_id}: {e}")
+                    except Exception:
+                        pass
+                    time.sleep(delay)
             obj = r.json()
             choices = obj.get("choices") or []
             if choices:
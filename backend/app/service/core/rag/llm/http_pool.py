@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import importlib.util
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from core.config import settings
+
+logger = logging.getLogger("rag.llm.http_pool")
+
+
+def _http2_available() -> bool:
+    # httpx 的 HTTP/2 支持依赖可选包 h2；未安装时退回 HTTP/1.1 keep-alive
+    return importlib.util.find_spec("h2") is not None
+
+
+class _ConnStats:
+    """按 provider 统计请求数与新建连接数（新建连接 = TCP 建连次数，其余请求复用了已有连接）。"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        reused = max(0, self.requests - self.new_connections)
+        return {
+            "requests": self.requests,
+            "newConnections": self.new_connections,
+            "tlsHandshakes": self.tls_handshakes,
+            "reusedRequests": reused,
+            "reuseRate": (reused / self.requests) if self.requests else 0.0,
+        }
+
+
+class LLMHttpClientPool:
+    """
+    LLM 提供方（DashScope/OpenAI 兼容接口）的共享 httpx 客户端：
+    - 每个 (provider, base_url) 一个同步 Client 与一个 AsyncClient，进程内复用，保持 keep-alive 长连接
+    - 连接池上限、keep-alive 过期时间、connect/read/write/pool 超时均可配置
+    - h2 可用且开启时使用 HTTP/2（单连接多路复用）
+    - 通过 httpcore 的 trace 扩展统计建连/TLS 握手次数，得到连接复用率
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str], httpx.Client] = {}
+        self._async_clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+        self._stats: Dict[str, _ConnStats] = {}
+
+    @staticmethod
+    def _limits() -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=int(getattr(settings, "SM_LLM_HTTP_MAX_CONNECTIONS", 32) or 32),
+            max_keepalive_connections=int(getattr(settings, "SM_LLM_HTTP_MAX_KEEPALIVE", 16) or 16),
+            keepalive_expiry=float(getattr(settings, "SM_LLM_HTTP_KEEPALIVE_EXPIRY", 60.0) or 60.0),
+        )
+
+    @staticmethod
+    def timeout(read: Optional[float] = None) -> httpx.Timeout:
+        """connect 与 read 分开设置：建连失败应尽快暴露，流式生成则允许较长的 token 间隔。"""
+        return httpx.Timeout(
+            connect=float(getattr(settings, "SM_LLM_HTTP_CONNECT_TIMEOUT", 5.0) or 5.0),
+            read=float(read if read is not None else (getattr(settings, "SM_LLM_HTTP_READ_TIMEOUT", 60.0) or 60.0)),
+            write=float(getattr(settings, "SM_LLM_HTTP_WRITE_TIMEOUT", 10.0) or 10.0),
+            pool=float(getattr(settings, "SM_LLM_HTTP_POOL_TIMEOUT", 10.0) or 10.0),
+        )
+
+    @staticmethod
+    def _use_http2() -> bool:
+        return bool(getattr(settings, "SM_LLM_HTTP2", True)) and _http2_available()
+
+    def _stats_for(self, provider: str) -> _ConnStats:
+        st = self._stats.get(provider)
+        if st is None:
+            st = self._stats.setdefault(provider, _ConnStats())
+        return st
+
+    def client(self, provider: str, base_url: str) -> httpx.Client:
+        key = (provider, base_url)
+        c = self._clients.get(key)
+        if c is not None:
+            return c
+        with self._lock:
+            c = self._clients.get(key)
+            if c is None:
+                c = httpx.Client(limits=self._limits(), timeout=self.timeout(), http2=self._use_http2())
+                self._clients[key] = c
+                logger.info(f"LLM http client created provider={provider} base_url={base_url} http2={self._use_http2()}")
+        return c
+
+    def async_client(self, provider: str, base_url: str) -> httpx.AsyncClient:
+        key = (provider, base_url)
+        c = self._async_clients.get(key)
+        if c is not None:
+            return c
+        with self._lock:
+            c = self._async_clients.get(key)
+            if c is None:
+                c = httpx.AsyncClient(limits=self._limits(), timeout=self.timeout(), http2=self._use_http2())
+                self._async_clients[key] = c
+                logger.info(f"LLM async http client created provider={provider} base_url={base_url} http2={self._use_http2()}")
+        return c
+
+    def trace_extensions(self, provider: str) -> Dict[str, Any]:
+        """同步请求的 extensions：记录请求数，并通过 trace 事件统计新建连接与 TLS 握手。"""
+        st = self._stats_for(provider)
+        with self._lock:
+            st.requests += 1
+
+        def trace(event_name: str, info: Dict[str, Any]) -> None:
+            self._on_trace(st, event_name)
+
+        return {"trace": trace}
+
+    def async_trace_extensions(self, provider: str) -> Dict[str, Any]:
+        """AsyncClient 请求的 extensions（httpcore 要求异步 trace 回调）。"""
+        st = self._stats_for(provider)
+        with self._lock:
+            st.requests += 1
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            self._on_trace(st, event_name)
+
+        return {"trace": trace}
+
+    def _on_trace(self, st: _ConnStats, event_name: str) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                st.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                st.tls_handshakes += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "http2": self._use_http2(),
+                "clients": len(self._clients),
+                "asyncClients": len(self._async_clients),
+                "providers": {p: st.snapshot() for p, st in self._stats.items()},
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for c in clients:
+            try:
+                c.close()
+            except Exception:
+                pass
+
+    async def aclose(self) -> None:
+        self.close()
+        with self._lock:
+            clients, self._async_clients = list(self._async_clients.values()), {}
+        for c in clients:
+            try:
+                await c.aclose()
+            except Exception:
+                pass
+
+
+llm_http_pool = LLMHttpClientPool()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import random
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+import httpx
+
+from core.config import settings
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """网络/超时错误与 408/409/429/5xx 可重试；其余（鉴权、参数错误等）直接失败。"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in _RETRYABLE_STATUS
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff_delay(attempt: int, exc: Optional[BaseException] = None) -> float:
+    """
+    第 attempt 次重试（从 0 开始）前的等待秒数：指数退避 + full jitter，避免多个请求同时重试。
+    429/503 带 Retry-After 时以其为下限（仍受上限约束）。
+    """
+    base = float(getattr(settings, "SM_LLM_RETRY_BACKOFF_BASE", 0.5) or 0.5)
+    cap = float(getattr(settings, "SM_LLM_RETRY_BACKOFF_MAX", 8.0) or 8.0)
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if isinstance(exc, httpx.HTTPStatusError):
+        try:
+            retry_after = float(exc.response.headers.get("retry-after", ""))
+            delay = max(delay, min(cap, retry_after))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+
+class LLMResilienceStats:
+    """
+    LLM 请求的重试/对冲计数与首 token 延迟（TTFT）样本。
+    对冲延迟取近期 TTFT 的 p95：样本不足时使用默认值，并以最小值兜底，避免过早重复请求。
+    """
+
+    def __init__(self, window: int = 256) -> None:
+        self._lock = threading.Lock()
+        self._ttft: deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def record_ttft(self, seconds: float) -> None:
+        with self._lock:
+            self._ttft.append(seconds)
+
+    def _percentile(self, p: float) -> Optional[float]:
+        if not self._ttft:
+            return None
+        vs = sorted(self._ttft)
+        return vs[min(len(vs) - 1, int(round(p / 100.0 * (len(vs) - 1))))]
+
+    def hedge_delay(self) -> float:
+        min_delay = float(getattr(settings, "SM_LLM_HEDGE_MIN_DELAY", 0.3) or 0.0)
+        min_samples = int(getattr(settings, "SM_LLM_HEDGE_MIN_SAMPLES", 20) or 0)
+        with self._lock:
+            p95 = self._percentile(95) if len(self._ttft) >= min_samples else None
+        if p95 is None:
+            p95 = float(getattr(settings, "SM_LLM_HEDGE_DEFAULT_DELAY", 2.0) or 2.0)
+        return max(min_delay, p95)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            p50, p95 = self._percentile(50), self._percentile(95)
+            out = {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "hedgesFired": self.hedges_fired,
+                "hedgesWon": self.hedges_won,
+                "hedgeFireRate": (self.hedges_fired / self.requests) if self.requests else 0.0,
+                "hedgeWinRate": (self.hedges_won / self.hedges_fired) if self.hedges_fired else 0.0,
+                "ttftSamples": len(self._ttft),
+                "ttftP50Ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "ttftP95Ms": round(p95 * 1000, 1) if p95 is not None else None,
+            }
+        out["hedgeEnabled"] = bool(getattr(settings, "SM_LLM_HEDGE_ENABLED", False))
+        out["hedgeDelayMs"] = round(self.hedge_delay() * 1000, 1)
+        return out
+
+
+llm_resilience_stats = LLMResilienceStats()
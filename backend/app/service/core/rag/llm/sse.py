@@ -0,0 +1,201 @@
+"""
+LLM 流式响应（OpenAI/DashScope 兼容 SSE）的轻量解码器。
+
+直接在原始字节流上切分 SSE 事件，用 orjson 解析 `data:` 负载并取出增量文本，
+不为每个 token 构造 httpx.Response / str 行对象。
+
+基准测试（解码开销，不含网络）：
+    python -m service.core.rag.llm.sse --events 200000
+"""
+from __future__ import annotations
+
+import json
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional
+
+try:
+    import orjson as _orjson
+except ImportError:  # pragma: no cover
+    _orjson = None
+
+_DONE = b"[DONE]"
+
+
+def loads(data: bytes):
+    return _orjson.loads(data) if _orjson is not None else json.loads(data)
+
+
+class SSEDecoder:
+    """
+    增量 SSE 解码：feed 任意切分的字节块，返回其中已完整的事件（多行 data 以 \\n 拼接）。
+    event/id/retry 字段与注释行（以 ":" 开头）被忽略。
+    """
+
+    __slots__ = ("_buf", "_data")
+
+    def __init__(self) -> None:
+        self._buf = b""
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        events: List[bytes] = []
+        buf = self._buf + chunk if self._buf else chunk
+        start = 0
+        while True:
+            nl = buf.find(b"\n", start)
+            if nl < 0:
+                break
+            line = buf[start:nl]
+            start = nl + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if not line:
+                if self._data:
+                    events.append(self._data[0] if len(self._data) == 1 else b"\n".join(self._data))
+                    self._data = []
+                continue
+            if line.startswith(b"data:"):
+                v = line[5:]
+                self._data.append(v[1:] if v.startswith(b" ") else v)
+        self._buf = buf[start:]
+        return events
+
+    def flush(self) -> List[bytes]:
+        """流结束时输出未以空行结尾的最后一个事件。"""
+        if self._buf:
+            line = self._buf.rstrip(b"\r")
+            self._buf = b""
+            if line.startswith(b"data:"):
+                v = line[5:]
+                self._data.append(v[1:] if v.startswith(b" ") else v)
+        if not self._data:
+            return []
+        out = [b"\n".join(self._data)]
+        self._data = []
+        return out
+
+
+def delta_content(data: bytes) -> Optional[str]:
+    """
+    从一个 data 负载中取出增量文本：choices[0].delta.content 或 choices[0].message.content。
+    负载不是 JSON 时原样返回（与旧实现的兜底行为一致）。
+    """
+    try:
+        obj = loads(data)
+    except Exception:
+        return data.strip().decode("utf-8", errors="ignore") or None
+    if not isinstance(obj, dict):
+        return None
+    choices = obj.get("choices")
+    if not choices:
+        return None
+    c0 = choices[0]
+    delta = c0.get("delta")
+    content = delta.get("content") if delta else None
+    if not content:
+        msg = c0.get("message")
+        content = msg.get("content") if msg else None
+    return content or None
+
+
+def iter_stream_deltas(chunks: Iterable[bytes]) -> Iterator[str]:
+    """同步字节流（如 httpx.Response.iter_bytes()）-> 增量文本；遇到 [DONE] 结束。"""
+    dec = SSEDecoder()
+    for chunk in chunks:
+        for data in dec.feed(chunk):
+            if data.strip() == _DONE:
+                return
+            content = delta_content(data)
+            if content:
+                yield content
+    for data in dec.flush():
+        if data.strip() == _DONE:
+            return
+        content = delta_content(data)
+        if content:
+            yield content
+
+
+async def aiter_stream_deltas(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """异步字节流（如 httpx.Response.aiter_bytes()）版本的 iter_stream_deltas。"""
+    dec = SSEDecoder()
+    async for chunk in chunks:
+        for data in dec.feed(chunk):
+            if data.strip() == _DONE:
+                return
+            content = delta_content(data)
+            if content:
+                yield content
+    for data in dec.flush():
+        if data.strip() == _DONE:
+            return
+        content = delta_content(data)
+        if content:
+            yield content
+
+
+def _legacy_deltas(lines: Iterable[str]) -> Iterator[str]:
+    """旧实现（逐行 str + httpx.Response(200, text=data).json()），仅用于基准对比。"""
+    import httpx
+    for line in lines:
+        if not line:
+            continue
+        if line.startswith("data: "):
+            data = line[len("data: "):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                obj = httpx.Response(200, text=data).json()
+            except Exception:
+                yield data
+                continue
+            choices = obj.get("choices") or []
+            if choices:
+                c0 = choices[0]
+                delta = c0.get("delta") or {}
+                content = delta.get("content") or c0.get("message", {}).get("content")
+                if content:
+                    yield content
+
+
+def _bench(n_events: int, chunk_size: int) -> None:
+    import time
+
+    words = ["检索", "增强", " generation", " with", " citations", "。", " 论文", " model"]
+    events = []
+    for i in range(n_events):
+        payload = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "model": "qwen-plus",
+                   "choices": [{"index": 0, "delta": {"content": words[i % len(words)]}, "finish_reason": None}]}
+        events.append(b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n")
+    events.append(b"data: [DONE]\n\n")
+    raw = b"".join(events)
+    chunks = [raw[i:i + chunk_size] for i in range(0, len(raw), chunk_size)]
+
+    t0 = time.perf_counter()
+    n_new = sum(1 for _ in iter_stream_deltas(chunks))
+    t_new = time.perf_counter() - t0
+
+    # 旧实现的输入：httpx.Response.iter_lines() 已解码好的行，这里预先切好，不计入其耗时
+    lines = raw.decode("utf-8").splitlines()
+    try:
+        t0 = time.perf_counter()
+        n_old = sum(1 for _ in _legacy_deltas(lines))
+        t_old = time.perf_counter() - t0
+    except ImportError:
+        n_old, t_old = 0, 0.0
+
+    print(f"events={n_events} bytes={len(raw)} chunk_size={chunk_size} orjson={'yes' if _orjson is not None else 'no'}")
+    if t_old:
+        print(f"legacy  : {n_old} deltas in {t_old * 1000:.1f} ms -> {n_old / t_old:,.0f} tokens/s")
+    print(f"decoder : {n_new} deltas in {t_new * 1000:.1f} ms -> {n_new / t_new:,.0f} tokens/s")
+    if t_old:
+        print(f"speedup : {t_old / t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="SSE 增量解码开销基准")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=4096, help="模拟网络读取的字节块大小")
+    args = parser.parse_args()
+    _bench(args.events, args.chunk_size)
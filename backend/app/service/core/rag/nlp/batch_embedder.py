@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import logging
+from array import array
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from core.config import settings
+from service.core.rag.llm.http_pool import llm_http_pool
+from service.core.rag.llm.resilience import backoff_delay, is_retryable
+
+logger = logging.getLogger("rag.batch_embedder")
+
+_POOL_PROVIDER = "embedding"
+
+# 并发通道：bulk 为导入时的大批量嵌入；query 为交互检索的查询向量，独立限流，不排在导入批次之后
+LANE_BULK = "bulk"
+LANE_QUERY = "query"
+
+
+@dataclass
+class BatchEmbeddingResult:
+    vectors: List[Optional[List[float]]]
+    failed: List[int] = field(default_factory=list)       # 失败条目的下标（与输入一一对应）
+    errors: Dict[int, str] = field(default_factory=dict)  # 失败批次起始下标 -> 最后一次错误
+    batches: int = 0
+    retries: int = 0
+    throttled: int = 0
+    took_ms: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 并发控制（仅在嵌入器自己的事件循环中使用）：
+    - 429 时并发上限减半（一个冷却窗口内只减一次，避免同一波限流被重复计数）
+    - 连续成功 limit 次后上限 +1，直到 max_limit
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, cooldown: float = 1.0) -> None:
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = self.max_limit
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self) -> None:
+        cond = self._condition()
+        async with cond:
+            while self.in_flight >= self.limit:
+                await cond.wait()
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify_all()
+
+    def on_success(self) -> None:
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self._successes = 0
+
+    def on_throttle(self) -> None:
+        now = time.time()
+        self._successes = 0
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit // 2)
+
+
+class AsyncBatchEmbedder:
+    """
+    批量文本向量化（DashScope/OpenAI 兼容 /embeddings 接口），用于导入时的大批量嵌入：
+    - 输入按 batch_size 切批，多个批次并发在途（上限 SM_EMBED_BULK_CONCURRENCY），遇 429 按 AIMD 自适应降并发
+    - 每批独立重试（退避 + Retry-After），仅重试网络错误与 408/429/5xx
+    - 结果与输入顺序一致；重试耗尽的批次不会静默填 None 了事，其下标记录在 BatchEmbeddingResult.failed
+    - 在独立的后台事件循环中运行，复用连接池中的 AsyncClient；同步代码用 embed()，协程中用 aembed()
+    - 按 (lane, base_url) 各自限流：lane="query" 的查询向量有独立并发上限（SM_EMBED_QUERY_CONCURRENCY），
+      不会被同进程内进行中的导入批次阻塞
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._limiters: Dict[tuple, AdaptiveLimiter] = {}
+        self.requests = 0
+        self.batches = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failed_items = 0
+
+    # --- public ---
+    def embed(
+        self,
+        texts: List[str],
+        *,
+        model_name: str = "text-embedding-v3",
+        dimensions: int = 1024,
+        batch_size: Optional[int] = None,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        encoding_format: str = "float",
+        lane: str = LANE_BULK,
+    ) -> BatchEmbeddingResult:
+        return self._submit(texts, model_name, dimensions, batch_size, api_key, base_url, encoding_format, lane).result()
+
+    async def aembed(
+        self,
+        texts: List[str],
+        *,
+        model_name: str = "text-embedding-v3",
+        dimensions: int = 1024,
+        batch_size: Optional[int] = None,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        encoding_format: str = "float",
+        lane: str = LANE_BULK,
+    ) -> BatchEmbeddingResult:
+        return await asyncio.wrap_future(self._submit(texts, model_name, dimensions, batch_size, api_key, base_url, encoding_format, lane))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failedItems": self.failed_items,
+                "concurrency": {f"{lane}:{url}": {"limit": lim.limit, "max": lim.max_limit, "inFlight": lim.in_flight} for (lane, url), lim in self._limiters.items()},
+            }
+
+    # --- internals ---
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None:
+            return self._loop
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True, name="batch-embedder-loop").start()
+                self._loop = loop
+        return self._loop
+
+    def _submit(self, texts, model_name, dimensions, batch_size, api_key, base_url, encoding_format="float", lane=LANE_BULK) -> Future:
+        texts = [t or "" for t in texts]
+        if not texts:
+            fut: Future = Future()
+            fut.set_result(BatchEmbeddingResult(vectors=[]))
+            return fut
+        coro = self._run(
+            texts,
+            model_name=model_name,
+            dimensions=int(dimensions),
+            batch_size=max(1, int(batch_size or getattr(settings, "SM_EMBED_BULK_BATCH_SIZE", 10) or 10)),
+            api_key=api_key or settings.DASHSCOPE_API_KEY,
+            base_url=(base_url or settings.DASHSCOPE_BASE_URL or "").rstrip("/"),
+            encoding_format=encoding_format or "float",
+            lane=lane,
+        )
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def _limiter(self, base_url: str, lane: str = LANE_BULK) -> AdaptiveLimiter:
+        key = (lane, base_url)
+        lim = self._limiters.get(key)
+        if lim is None:
+            if lane == LANE_QUERY:
+                max_limit = int(getattr(settings, "SM_EMBED_QUERY_CONCURRENCY", 8) or 8)
+            else:
+                max_limit = int(getattr(settings, "SM_EMBED_BULK_CONCURRENCY", 4) or 4)
+            lim = AdaptiveLimiter(
+                max_limit=max_limit,
+                min_limit=int(getattr(settings, "SM_EMBED_BULK_MIN_CONCURRENCY", 1) or 1),
+            )
+            with self._lock:
+                self._limiters[key] = lim
+        return lim
+
+    async def _post(self, client: httpx.AsyncClient, url: str, headers: Dict[str, str], payload: Dict[str, Any], n: int) -> List[List[float]]:
+        r = await client.post(url, headers=headers, json=payload, extensions=llm_http_pool.async_trace_extensions(_POOL_PROVIDER))
+        r.raise_for_status()
+        data = sorted(r.json().get("data") or [], key=lambda d: d.get("index", 0))
+        if len(data) != n:
+            raise ValueError(f"embedding response has {len(data)} items for {n} inputs")
+        return [self._decode(d["embedding"]) for d in data]
+
+    @staticmethod
+    def _decode(emb: Any) -> List[float]:
+        # encoding_format="base64" 时返回小端 float32 字节的 base64 串
+        if isinstance(emb, str):
+            return array("f", base64.b64decode(emb)).tolist()
+        return emb
+
+    async def _run(self, texts: List[str], *, model_name: str, dimensions: int, batch_size: int, api_key: str, base_url: str,
+                   encoding_format: str = "float", lane: str = LANE_BULK) -> BatchEmbeddingResult:
+        t0 = time.time()
+        result = BatchEmbeddingResult(vectors=[None] * len(texts))
+        client = llm_http_pool.async_client(_POOL_PROVIDER, base_url)
+        url = f"{base_url}/embeddings"
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        limiter = self._limiter(base_url, lane)
+        max_retries = max(0, int(getattr(settings, "SM_EMBED_BULK_RETRIES", 3) or 0))
+
+        async def one(start: int, batch: List[str]) -> None:
+            payload = {"model": model_name, "input": batch, "dimensions": dimensions, "encoding_format": encoding_format}
+            attempt = 0
+            while True:
+                await limiter.acquire()
+                err: Optional[BaseException] = None
+                try:
+                    vecs = await self._post(client, url, headers, payload, len(batch))
+                    limiter.on_success()
+                except Exception as e:
+                    err = e
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+                        limiter.on_throttle()
+                        result.throttled += 1
+                finally:
+                    await limiter.release()
+                if err is None:
+                    result.vectors[start:start + len(batch)] = vecs
+                    return
+                if attempt >= max_retries or not is_retryable(err):
+                    result.failed.extend(range(start, start + len(batch)))
+                    result.errors[start] = str(err)
+                    logger.warning(f"BatchEmbedder: batch start={start} size={len(batch)} failed after {attempt + 1} attempts: {err}")
+                    return
+                result.retries += 1
+                await asyncio.sleep(backoff_delay(attempt, err))
+                attempt += 1
+
+        batches = [(s, texts[s:s + batch_size]) for s in range(0, len(texts), batch_size)]
+        result.batches = len(batches)
+        await asyncio.gather(*(one(s, b) for s, b in batches))
+        result.failed.sort()
+        result.took_ms = int((time.time() - t0) * 1000)
+        with self._lock:
+            self.requests += 1
+            self.batches += result.batches
+            self.retries += result.retries
+            self.throttled += result.throttled
+            self.failed_items += len(result.failed)
+        logger.info(
+            f"BatchEmbedder: lane={lane} texts={len(texts)} batches={result.batches} failed={len(result.failed)} "
+            f"retries={result.retries} throttled={result.throttled} limit={limiter.limit} took_ms={result.took_ms}"
+        )
+        return result
+
+
+batch_embedder = AsyncBatchEmbedder()
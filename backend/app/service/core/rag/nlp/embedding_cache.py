@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import array
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from core.config import settings
+from service.core.rag.nlp.batch_embedder import LANE_QUERY
+from service.core.rag.nlp.local_embedding import local_embedding_enabled
+from service.core.rag.nlp.model import embedding_model_id, generate_embedding, generate_embeddings_detailed
+from utils.dynamic_batcher import DynamicBatcher
+from utils.redis_client import get_redis, mark_redis_failed
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger("rag.embedding_cache")
+
+DEFAULT_MODEL_NAME = "text-embedding-v3"
+DEFAULT_DIMENSIONS = 1024
+_REDIS_PREFIX = "sm:qemb:"
+
+
+def normalize_query_text(text: str) -> str:
+    """查询文本归一化：NFKC（全半角统一）+ 折叠空白 + 去首尾空白。"""
+    t = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", t).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    两级查询向量缓存：
+    - L1：进程内 LRU + TTL（TTLCache）
+    - L2：可选 Redis（float32 字节存储，跨 worker 共享）
+    键 = (归一化文本, 模型名, 维度)，同一问题的重试/重生成/对比调用可直接复用向量。
+    """
+
+    def __init__(self) -> None:
+        self.l1 = TTLCache(
+            max_entries=int(getattr(settings, "SM_EMBED_CACHE_MAX_ENTRIES", 2048) or 2048),
+            ttl_seconds=float(getattr(settings, "SM_EMBED_CACHE_TTL_SECONDS", 3600) or 3600),
+        )
+        self._lock = threading.Lock()
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+
+    @staticmethod
+    def _key(text: str, model_name: str, dimensions: int) -> str:
+        raw = f"{model_name}|{int(dimensions)}|{normalize_query_text(text)}".encode("utf-8", errors="ignore")
+        return hashlib.sha256(raw).hexdigest()
+
+    def _redis(self):
+        if not getattr(settings, "SM_EMBED_CACHE_REDIS_ENABLED", False):
+            return None
+        return get_redis()
+
+    def get_many(self, texts: List[str], *, model_name: str, dimensions: int) -> List[Optional[List[float]]]:
+        keys = [self._key(t, model_name, dimensions) for t in texts]
+        out: List[Optional[List[float]]] = [self.l1.get(k) for k in keys]
+        missing = [i for i, v in enumerate(out) if v is None]
+        r = self._redis() if missing else None
+        if r is None:
+            return out
+        try:
+            raw = r.mget([_REDIS_PREFIX + keys[i] for i in missing])
+        except Exception as e:
+            mark_redis_failed()
+            with self._lock:
+                self.l2_errors += 1
+            logger.warning(f"QueryEmbeddingCache: redis mget failed: {e}")
+            return out
+        for i, blob in zip(missing, raw or []):
+            if not blob:
+                with self._lock:
+                    self.l2_misses += 1
+                continue
+            vec = array.array("f")
+            vec.frombytes(blob)
+            out[i] = vec.tolist()
+            self.l1.set(keys[i], out[i])
+            with self._lock:
+                self.l2_hits += 1
+        return out
+
+    def put_many(self, texts: List[str], vectors: List[Optional[List[float]]], *, model_name: str, dimensions: int) -> None:
+        items = [(self._key(t, model_name, dimensions), v) for t, v in zip(texts, vectors) if v]
+        for k, v in items:
+            self.l1.set(k, v)
+        r = self._redis() if items else None
+        if r is None:
+            return
+        ttl = int(getattr(settings, "SM_EMBED_CACHE_REDIS_TTL_SECONDS", 86400) or 86400)
+        try:
+            pipe = r.pipeline(transaction=False)
+            for k, v in items:
+                pipe.set(_REDIS_PREFIX + k, array.array("f", v).tobytes(), ex=ttl)
+            pipe.execute()
+        except Exception as e:
+            mark_redis_failed()
+            with self._lock:
+                self.l2_errors += 1
+            logger.warning(f"QueryEmbeddingCache: redis write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        l1 = self.l1.stats()
+        with self._lock:
+            return {
+                "l1": l1,
+                "l2": {
+                    "enabled": bool(getattr(settings, "SM_EMBED_CACHE_REDIS_ENABLED", False)),
+                    "hits": self.l2_hits,
+                    "misses": self.l2_misses,
+                    "errors": self.l2_errors,
+                },
+            }
+
+
+query_embedding_cache = QueryEmbeddingCache()
+
+
+def _embed_query_batch(items: List[tuple]) -> List[Optional[List[float]]]:
+    """DynamicBatcher 的批处理函数：items 为 (文本, 模型名, 维度)，按模型分组、组内去重后各发一次批量请求。"""
+    out: List[Optional[List[float]]] = [None] * len(items)
+    groups: Dict[tuple, Dict[str, List[int]]] = {}
+    for i, (text, model_name, dimensions) in enumerate(items):
+        groups.setdefault((model_name, dimensions), {}).setdefault(text, []).append(i)
+    for (model_name, dimensions), by_text in groups.items():
+        uniq = list(by_text.keys())
+        res = generate_embeddings_detailed(uniq, model_name=model_name, dimensions=dimensions, lane=LANE_QUERY)
+        for text, vec in zip(uniq, res.vectors):
+            for i in by_text[text]:
+                out[i] = vec
+    return out
+
+
+# 跨请求的查询向量微批：并发 /ask 的查询在 SM_QUERY_EMBED_BATCH_MAX_WAIT_MS 内合并为一次批量调用
+query_embedding_batcher = DynamicBatcher(
+    _embed_query_batch,
+    max_batch_size=int(getattr(settings, "SM_QUERY_EMBED_BATCH_MAX_SIZE", 32) or 32),
+    max_wait_ms=float(getattr(settings, "SM_QUERY_EMBED_BATCH_MAX_WAIT_MS", 5) or 0),
+    name="query-embedding",
+    # 多个批次可同时在途：单个慢批次（重试/退避）不会拖住进程内所有查询
+    max_in_flight=int(getattr(settings, "SM_QUERY_EMBED_BATCH_MAX_IN_FLIGHT", 4) or 4),
+)
+
+
+def _embed_uncached(texts: List[str], *, model_name: str, dimensions: int) -> List[Optional[List[float]]]:
+    # 本地引擎自带动态合批，直接调用；API 路径经 query_embedding_batcher 与其他请求合并
+    if not getattr(settings, "SM_QUERY_EMBED_BATCH_ENABLED", True) or local_embedding_enabled():
+        return generate_embedding(list(texts), model_name=model_name, dimensions=dimensions, lane=LANE_QUERY) or [None] * len(texts)
+    timeout = float(getattr(settings, "SM_QUERY_EMBED_BATCH_TIMEOUT_SECONDS", 3.0) or 0) or None
+    try:
+        return query_embedding_batcher.run([(t, model_name, int(dimensions)) for t in texts], timeout=timeout)
+    except Exception as e:
+        # 超时（所在批次过慢或排队过久）或批次失败：本请求改为独立直连，不再等待批次
+        logger.warning(f"QueryEmbeddingBatcher failed or timed out ({type(e).__name__}), falling back to direct call: {e}")
+        return generate_embedding(list(texts), model_name=model_name, dimensions=dimensions, lane=LANE_QUERY) or [None] * len(texts)
+
+
+def embed_queries(
+    texts: List[str],
+    *,
+    model_name: str = DEFAULT_MODEL_NAME,
+    dimensions: int = DEFAULT_DIMENSIONS,
+) -> List[Optional[List[float]]]:
+    """带缓存的批量查询向量生成：仅对未命中的文本发起请求（与并发请求的查询合批）。"""
+    if not texts:
+        return []
+    if not getattr(settings, "SM_EMBED_CACHE_ENABLED", True):
+        return _embed_uncached(list(texts), model_name=model_name, dimensions=dimensions)
+    cache_model = embedding_model_id(model_name)
+    out = query_embedding_cache.get_many(texts, model_name=cache_model, dimensions=dimensions)
+    missing = [i for i, v in enumerate(out) if v is None]
+    if missing:
+        miss_texts = [texts[i] for i in missing]
+        gen = _embed_uncached(miss_texts, model_name=model_name, dimensions=dimensions)
+        for k, i in enumerate(missing):
+            out[i] = gen[k] if k < len(gen) else None
+        query_embedding_cache.put_many(miss_texts, [out[i] for i in missing], model_name=cache_model, dimensions=dimensions)
+    return out
+
+
+def embed_query(
+    text: str,
+    *,
+    model_name: str = DEFAULT_MODEL_NAME,
+    dimensions: int = DEFAULT_DIMENSIONS,
+) -> Optional[List[float]]:
+    return embed_queries([text], model_name=model_name, dimensions=dimensions)[0]
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from core.config import settings
+from utils.dynamic_batcher import DynamicBatcher
+
+logger = logging.getLogger("rag.local_embedding")
+
+
+class LocalEmbeddingEngine:
+    """
+    本地 CPU 向量化引擎（generate_embedding 在 SM_EMBEDDER_TYPE=local 且 SM_LOCAL_EMBEDDING_ENGINE_ENABLED 时使用）：
+    - 后端：sentence-transformers（默认）或 ONNX Runtime（LOCAL_EMBEDDER_PATH 下的 tokenizer + ONNX 模型）
+    - 并发调用经 DynamicBatcher 合并：达到 SM_LOCAL_EMBEDDER_MAX_BATCH 条或等待 SM_LOCAL_EMBEDDER_MAX_WAIT_MS 后统一编码
+    - 合并后的批次按 token 长度排序，再切成 SM_LOCAL_EMBEDDER_BATCH_SIZE 的长度桶，桶内长度接近，padding 最少
+    - 输出 L2 归一化向量；吞吐、批大小、padding 效率见 stats()
+    模型在首次编码时加载。
+    """
+
+    def __init__(self) -> None:
+        self.backend = str(getattr(settings, "SM_LOCAL_EMBEDDER_BACKEND", "sentence_transformers") or "sentence_transformers")
+        self.model_path = settings.LOCAL_EMBEDDER_PATH
+        self.device = getattr(settings, "SM_LOCAL_EMBEDDER_DEVICE", "cpu") or "cpu"
+        self.max_length = int(getattr(settings, "SM_LOCAL_EMBEDDER_MAX_LENGTH", 512) or 512)
+        self.bucket_size = int(getattr(settings, "SM_LOCAL_EMBEDDER_BATCH_SIZE", 32) or 32)
+        self.pooling = str(getattr(settings, "SM_LOCAL_EMBEDDER_POOLING", "cls") or "cls")
+        self._load_lock = threading.Lock()
+        self._model = None
+        self._tokenizer = None
+        self._session = None
+        self._onnx_inputs: List[str] = []
+        self.dim: Optional[int] = None
+        self.load_seconds = 0.0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.batcher = DynamicBatcher(
+            self._encode_batch,
+            max_batch_size=int(getattr(settings, "SM_LOCAL_EMBEDDER_MAX_BATCH", 128) or 128),
+            max_wait_ms=float(getattr(settings, "SM_LOCAL_EMBEDDER_MAX_WAIT_MS", 5) or 0),
+            name="local-embedding",
+        )
+
+    @property
+    def model_id(self) -> str:
+        return f"local:{os.path.basename(str(self.model_path).rstrip('/'))}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """批量编码（阻塞至所在批次完成）；与其他线程的并发调用合批执行。"""
+        return self.batcher.run([t or "" for t in texts])
+
+    # --- internals ---
+    def _load(self) -> None:
+        if self._model is not None or self._session is not None:
+            return
+        with self._load_lock:
+            if self._model is not None or self._session is not None:
+                return
+            t0 = time.time()
+            if self.backend == "onnx":
+                import onnxruntime as ort  # type: ignore
+                from transformers import AutoTokenizer  # type: ignore
+
+                onnx_file = getattr(settings, "SM_LOCAL_EMBEDDER_ONNX_FILE", "onnx/model.onnx") or "onnx/model.onnx"
+                opts = ort.SessionOptions()
+                threads = int(getattr(settings, "SM_LOCAL_EMBEDDER_THREADS", 0) or 0)
+                if threads > 0:
+                    opts.intra_op_num_threads = threads
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+                session = ort.InferenceSession(os.path.join(self.model_path, onnx_file), sess_options=opts, providers=["CPUExecutionProvider"])
+                self._onnx_inputs = [i.name for i in session.get_inputs()]
+                self._session = session
+            else:
+                from sentence_transformers import SentenceTransformer  # type: ignore
+
+                model = SentenceTransformer(self.model_path, trust_remote_code=True, device=self.device)
+                model.max_seq_length = self.max_length
+                self._tokenizer = getattr(model, "tokenizer", None)
+                self._model = model
+            self.load_seconds = time.time() - t0
+            logger.info(f"LocalEmbeddingEngine: loaded backend={self.backend} model={self.model_path} device={self.device} took={self.load_seconds:.1f}s")
+
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        tok = self._tokenizer
+        if tok is not None:
+            try:
+                ids = tok(texts, add_special_tokens=True, truncation=True, max_length=self.max_length)["input_ids"]
+                return [len(x) for x in ids]
+            except Exception:
+                pass
+        return [min(len(t) + 2, self.max_length) for t in texts]
+
+    def _encode_bucket(self, texts: List[str]) -> np.ndarray:
+        if self._session is not None:
+            enc = self._tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+            feeds = {k: enc[k].astype(np.int64) for k in self._onnx_inputs if k in enc}
+            if "token_type_ids" in self._onnx_inputs and "token_type_ids" not in feeds:
+                feeds["token_type_ids"] = np.zeros_like(enc["input_ids"], dtype=np.int64)
+            hidden = self._session.run(None, feeds)[0]
+            if hidden.ndim == 3:
+                if self.pooling == "mean":
+                    mask = enc["attention_mask"][..., None].astype(hidden.dtype)
+                    hidden = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+                else:
+                    hidden = hidden[:, 0]
+            norms = np.linalg.norm(hidden, axis=1, keepdims=True)
+            return hidden / np.clip(norms, 1e-12, None)
+        return self._model.encode(texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+
+    def _encode_batch(self, texts: List[str]) -> List[List[float]]:
+        self._load()
+        lengths = self._token_lengths(texts)
+        # 长度分桶：按 token 数排序后切块，同桶内补齐长度相近
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        real = padded = 0
+        for start in range(0, len(order), self.bucket_size):
+            idx = order[start:start + self.bucket_size]
+            vecs = self._encode_bucket([texts[i] for i in idx])
+            for i, v in zip(idx, vecs):
+                out[i] = v.tolist()
+            real += sum(lengths[i] for i in idx)
+            padded += max(lengths[i] for i in idx) * len(idx)
+        if self.dim is None and out and out[0] is not None:
+            self.dim = len(out[0])
+        self.real_tokens += real
+        self.padded_tokens += padded
+        return out  # type: ignore[return-value]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "model": self.model_path,
+            "loaded": self._model is not None or self._session is not None,
+            "loadSeconds": round(self.load_seconds, 2),
+            "dim": self.dim,
+            "bucketSize": self.bucket_size,
+            "paddingEfficiency": round(self.real_tokens / self.padded_tokens, 4) if self.padded_tokens else None,
+            "batcher": self.batcher.stats(),
+        }
+
+
+_engine: Optional[LocalEmbeddingEngine] = None
+_engine_lock = threading.Lock()
+
+
+def local_embedding_enabled() -> bool:
+    return getattr(settings, "SM_EMBEDDER_TYPE", "local") == "local" and bool(getattr(settings, "SM_LOCAL_EMBEDDING_ENGINE_ENABLED", False))
+
+
+def get_local_embedding_engine() -> LocalEmbeddingEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = LocalEmbeddingEngine()
+    return _engine
+
+
+def local_embedding_stats() -> Dict[str, Any]:
+    if _engine is None:
+        return {"enabled": local_embedding_enabled(), "loaded": False}
+    return dict(_engine.stats(), enabled=local_embedding_enabled())
@@ -6,6 +6,8 @@ import numpy as np
 from typing import List
 
 from core.config import settings
+from service.core.rag.nlp.batch_embedder import LANE_BULK, BatchEmbeddingResult, batch_embedder
+from service.core.rag.nlp.local_embedding import get_local_embedding_engine, local_embedding_enabled
 
 
 def get_chat_completion_block(session_id, question, references):
@@ -35,6 +37,47 @@ def rerank_similarity(query, texts):
     return np.array(scores), None
 
 
+def embedding_model_id(model_name: str = "text-embedding-v3") -> str:
+    """当前实际生效的嵌入模型标识（用于缓存键，避免本地与 API 向量混用）。"""
+    if local_embedding_enabled():
+        return get_local_embedding_engine().model_id
+    return model_name
+
+
+def generate_embeddings_detailed(
+    texts: List[str],
+    api_key: str | None = None,
+    base_url: str | None = None,
+    model_name: str = "text-embedding-v3",
+    dimensions: int = 1024,
+    max_batch_size: int | None = None,
+    encoding_format: str = "float",
+    lane: str = LANE_BULK,
+) -> BatchEmbeddingResult:
+    """批量向量化并返回失败下标（BatchEmbeddingResult.failed），供导入流程判断哪些片段缺少向量。
+    交互检索的查询向量传 lane="query"，与导入批次分开限流。"""
+    texts = list(texts)
+    # SM_EMBEDDER_TYPE=local 且开启本地引擎时，走本地 CPU 模型（动态合批），不受 API 延迟与限流影响
+    if local_embedding_enabled():
+        try:
+            vecs = get_local_embedding_engine().embed(texts)
+            return BatchEmbeddingResult(vectors=list(vecs), batches=1)
+        except Exception as e:
+            print(f"本地嵌入失败: {e}")
+            return BatchEmbeddingResult(vectors=[None] * len(texts), failed=list(range(len(texts))), errors={0: str(e)})
+    # API：多批并发在途、共享连接池、429 自适应降并发、逐批重试
+    return batch_embedder.embed(
+        texts,
+        model_name=model_name,
+        dimensions=dimensions,
+        batch_size=max_batch_size,
+        api_key=api_key,
+        base_url=base_url,
+        encoding_format=encoding_format,
+        lane=lane,
+    )
+
+
 def generate_embedding(
     text: str | List[str],
     api_key: str | None = None,
@@ -43,42 +86,25 @@ def generate_embedding(
     dimensions: int = 1024,
     encoding_format: str = "float",
     max_batch_size: int = 10,
+    lane: str = LANE_BULK,
 ):
-    api_key = api_key or settings.DASHSCOPE_API_KEY
-    base_url = base_url or settings.DASHSCOPE_BASE_URL
-
-    client = OpenAI(api_key=api_key, base_url=base_url)
-
+    """单条返回向量（失败为 None）；列表返回与输入等长的向量列表，失败位置为 None（需要失败下标时用 generate_embeddings_detailed）。"""
+    texts = [text] if isinstance(text, str) else list(text)
+    res = generate_embeddings_detailed(
+        texts,
+        api_key=api_key,
+        base_url=base_url,
+        model_name=model_name,
+        dimensions=dimensions,
+        max_batch_size=max_batch_size,
+        encoding_format=encoding_format,
+        lane=lane,
+    )
+    if res.failed:
+        print(f"嵌入请求失败: {len(res.failed)}/{len(texts)} 条, 下标 {res.failed[:20]}")
     if isinstance(text, str):
-        try:
-            completion = client.embeddings.create(
-                model=model_name,
-                input=text,
-                dimensions=dimensions,
-                encoding_format=encoding_format,
-            )
-            return completion.data[0].embedding
-        except Exception as e:
-            print(f"OpenAI API 请求失败: {e}")
-            return None
-
-    if isinstance(text, list):
-        all_embeddings: List[List[float] | None] = []
-        for i in range(0, len(text), max_batch_size):
-            batch = text[i : i + max_batch_size]
-            try:
-                completion = client.embeddings.create(
-                    model=model_name,
-                    input=batch,
-                    dimensions=dimensions,
-                    encoding_format=encoding_format,
-                )
-                batch_embeddings = [item.embedding for item in completion.data]
-                all_embeddings.extend(batch_embeddings)
-            except Exception as e:
-                print(f"OpenAI API 批量请求失败 (batch {i//max_batch_size + 1}): {e}")
-                all_embeddings.extend([None] * len(batch))
-        return all_embeddings
+        return res.vectors[0]
+    return res.vectors
 
 
 if __name__ == "__main__":
@@ -317,12 +317,17 @@ class FulltextQueryer:
                 - 仅关键词相似度分数数组
                 - 仅向量相似度分数数组
         """
-        from sklearn.metrics.pairwise import cosine_similarity as CosineSimilarity
         import numpy as np
-
-        sims = CosineSimilarity([avec], bvecs)
+        from service.core.rag.nlp.scoring import cosine_similarity_rows, decode_vectors
+
+        # bvecs 可直接传入解码好的 (n, dim) 矩阵，避免重复转换
+        if isinstance(bvecs, np.ndarray) and bvecs.ndim == 2:
+            mat = bvecs
+        else:
+            mat = decode_vectors(list(bvecs), len(avec))
+        sims = cosine_similarity_rows(avec, mat)
         tksim = self.token_similarity(atks, btkss)
-        return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+        return sims * vtweight + np.asarray(tksim) * tkweight, tksim, sims
 
     def token_similarity(self, atks, btkss):
         """
@@ -333,7 +338,7 @@ class FulltextQueryer:
             btkss (list[str | list[str]]): 多个文档的关键词列表 (B)。
 
         Returns:
-            list[float]: 一个列表，包含了查询(A)与每个文档(B)的关键词相似度分数。
+            numpy.ndarray: 查询(A)与每个文档(B)的关键词相似度分数。
         """
         def toDict(tks):
             d = {}
@@ -345,9 +350,10 @@ class FulltextQueryer:
                 d[t] += c
             return d
 
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+        from service.core.rag.nlp.scoring import token_overlap_scores
+
+        # similarity 只用到文档中出现了哪些词，不必为每个候选计算词权重
+        return token_overlap_scores(toDict(atks), btkss)
 
     def similarity(self, qtwt, dtwt):
         """
@@ -0,0 +1,71 @@
+"""
+精排打分的 NumPy 批量实现。
+
+Dealer.rerank / rerank_by_model 一次要对上百个候选打分，逐条解析向量字符串、
+逐条计算相似度会占据单次查询的大部分 CPU。这里把候选向量解码成一个矩阵、
+用一次矩阵乘法得到全部余弦相似度，并把关键词相似度、排名特征分数也改为批量计算。
+"""
+from typing import Iterable, List, Sequence
+
+import numpy as np
+
+
+def decode_vectors(values: Sequence, dim: int) -> np.ndarray:
+    """
+    把候选的向量字段（list[float] 或制表符分隔的字符串）解码为 (n, dim) 的 float32 矩阵。
+    缺失或维度不符的向量以零向量代替（与余弦相似度为 0 的原有行为一致）。
+    """
+    n = len(values)
+    mat = np.zeros((n, dim), dtype=np.float32)
+    str_rows: List[int] = []
+    str_vals: List[str] = []
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        if isinstance(v, str):
+            str_rows.append(i)
+            str_vals.append(v)
+        elif len(v) == dim:
+            mat[i] = np.asarray(v, dtype=np.float32)
+    if str_vals:
+        # 拼成一个字符串一次性解析，避免逐条 float() 推导
+        flat = np.array("\t".join(str_vals).split("\t"), dtype=np.float32)
+        if flat.size == len(str_vals) * dim:
+            mat[str_rows] = flat.reshape(len(str_vals), dim)
+        else:
+            for i, v in zip(str_rows, str_vals):
+                row = np.array(v.split("\t"), dtype=np.float32)
+                if row.size == dim:
+                    mat[i] = row
+    return mat
+
+
+def cosine_similarity_rows(query: Sequence[float], mat: np.ndarray) -> np.ndarray:
+    """查询向量与矩阵每一行的余弦相似度；零向量的相似度记为 0。"""
+    q = np.asarray(query, dtype=np.float32).reshape(-1)
+    if mat.size == 0:
+        return np.zeros(mat.shape[0], dtype=np.float64)
+    q_norm = float(np.linalg.norm(q))
+    row_norms = np.linalg.norm(mat, axis=1)
+    denom = row_norms * q_norm
+    sims = mat @ q
+    out = np.zeros(mat.shape[0], dtype=np.float64)
+    np.divide(sims, denom, out=out, where=denom > 0)
+    return out
+
+
+def token_overlap_scores(query_weights: dict, doc_token_lists: Iterable) -> np.ndarray:
+    """
+    批量计算 FulltextQueryer.similarity：(查询词与文档词交集的查询权重之和) / (查询词权重之和)。
+    该公式只依赖文档中出现了哪些词，因此无需为每个候选计算词权重，
+    只需构造 (文档 × 查询词) 的命中矩阵后与查询权重做一次点乘。
+    """
+    keys = list(query_weights.keys())
+    qw = np.array([query_weights[k] for k in keys], dtype=np.float64)
+    docs = [set(tks.split()) if isinstance(tks, str) else set(tks) for tks in doc_token_lists]
+    hit = np.zeros((len(docs), len(keys)), dtype=np.float64)
+    for i, d in enumerate(docs):
+        for j, k in enumerate(keys):
+            if k in d:
+                hit[i, j] = 1.0
+    return (hit @ qw + 1e-9) / (qw.sum() + 1e-9)
@@ -22,7 +22,10 @@ from service.core.rag.utils import rmSpace
 from service.core.rag.nlp import rag_tokenizer, query
 import numpy as np
 from service.core.rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
-from service.core.rag.nlp.model import generate_embedding, rerank_similarity
+from service.core.rag.nlp.model import rerank_similarity
+from service.core.rag.nlp.scoring import decode_vectors
+from service.core.rag.nlp.embedding_cache import embed_query
+from core.config import settings
 
 def index_name(uid): return f"{uid}"
 
@@ -64,7 +67,9 @@ class Dealer:
         Returns:
             MatchDenseExpr: 一个封装了向量检索查询所需全部信息的对象。
         """
-        qv = generate_embedding(txt)
+        qv = embed_query(txt)
+        if qv is None:
+            raise Exception("Dealer.get_vector failed to embed the query text.")
         shape = np.array(qv).shape
         if len(shape) > 1:
             raise Exception(
@@ -214,13 +219,37 @@ class Dealer:
             
             # 3. 查询执行：将三部分组合并发送给数据存储层。
             matchExprs = [matchText, matchDense, fusionExpr]
-            res = self.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
-                                        idx_names, kb_ids, rank_feature=rank_feature)
-            total = self.dataStore.getTotal(res)
-            logging.debug("Dealer.search TOTAL: {}".format(total))
+            # 调用方可通过 req["prefetch_relaxed"] 按请求开启（如预期零命中较常见的场景）
+            prefetch_relaxed = bool(req.get("prefetch_relaxed", getattr(settings, "SM_MSEARCH_ZERO_HIT_PREFETCH", False)))
+            if prefetch_relaxed:
+                # 主查询与放宽条件的重试查询合并为一次 _msearch 发出，省去零命中时的第二次往返；
+                # 仅当主查询无结果时才采用放宽查询的结果。代价是每次检索都多执行一条放宽查询。
+                relaxedText, _ = self.qryr.question(qst, min_match=0.1)
+                relaxedFilters = dict(filters)
+                relaxedFilters.pop("doc_ids", None)
+                relaxedDense = MatchDenseExpr(matchDense.vector_column_name, matchDense.embedding_data,
+                                              matchDense.embedding_data_type, matchDense.distance_type,
+                                              matchDense.topn, dict(matchDense.extra_options, similarity=0.17))
+                common = dict(selectFields=src, highlightFields=highlightFields, orderBy=orderBy, offset=offset,
+                              limit=limit, indexNames=idx_names, knowledgebaseIds=kb_ids, rank_feature=rank_feature)
+                res, relaxed = self.dataStore.msearch([
+                    dict(common, condition=filters, matchExprs=matchExprs),
+                    dict(common, condition=relaxedFilters, matchExprs=[relaxedText, relaxedDense, fusionExpr]),
+                ])
+                total = self.dataStore.getTotal(res)
+                logging.debug("Dealer.search TOTAL: {}".format(total))
+                if total == 0:
+                    res = relaxed
+                    total = self.dataStore.getTotal(res)
+                    logging.debug("Dealer.search 2 TOTAL: {}".format(total))
+            else:
+                res = self.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
+                                            idx_names, kb_ids, rank_feature=rank_feature)
+                total = self.dataStore.getTotal(res)
+                logging.debug("Dealer.search TOTAL: {}".format(total))
 
             # 4. 失败重试：如果首次查询无结果，则放宽条件重试一次。
-            if total == 0:
+            if total == 0 and not prefetch_relaxed:
                 # 放宽文本匹配要求和向量相似度阈值
                 matchText, _ = self.qryr.question(qst, min_match=0.1)
                 filters.pop("doc_ids", None)
@@ -356,12 +385,13 @@ class Dealer:
 
         chunks_tks = [rag_tokenizer.tokenize(self.qryr.rmWWW(ck)).split()
                       for ck in chunks]
+        chunk_mat = decode_vectors(chunk_v, len(ans_v[0]))
         cites = {}
         thr = 0.63
         while thr > 0.3 and len(cites.keys()) == 0 and pieces_ and chunks_tks:
             for i, a in enumerate(pieces_):
                 sim, tksim, vtsim = self.qryr.hybrid_similarity(ans_v[i],
-                                                                chunk_v,
+                                                                chunk_mat,
                                                                 rag_tokenizer.tokenize(
                                                                     self.qryr.rmWWW(pieces_[i])).split(),
                                                                 chunks_tks,
@@ -408,27 +438,33 @@ class Dealer:
             numpy.ndarray: 一个包含每个召回文档的附加特征分数的数组。
         """
         ## For rank feature(tag_fea) scores.
-        rank_fea = []
-        pageranks = []
-        for chunk_id in search_res.ids:
-            pageranks.append(search_res.field[chunk_id].get(PAGERANK_FLD, 0))
-        pageranks = np.array(pageranks, dtype=float)
+        n = len(search_res.ids)
+        pageranks = np.fromiter((float(search_res.field[chunk_id].get(PAGERANK_FLD, 0) or 0) for chunk_id in search_res.ids),
+                                dtype=float, count=n)
 
         if not query_rfea:
-            return np.array([0 for _ in range(len(search_res.ids))]) + pageranks
+            return np.zeros(n) + pageranks
 
+        # 按查询特征构造 (文档 × 查询标签) 的分数矩阵，一次点乘得到分子
+        q_tags = [t for t in query_rfea.keys()]
+        q_vec = np.array([query_rfea[t] for t in q_tags], dtype=float)
         q_denor = np.sqrt(np.sum([s*s for t,s in query_rfea.items() if t != PAGERANK_FLD]))
-        for i in search_res.ids:
-            nor, denor = 0, 0
-            for t, sc in eval(search_res.field[i].get(TAG_FLD, "{}")).items():
-                if t in query_rfea:
-                    nor += query_rfea[t] * sc
-                denor += sc * sc
-            if denor == 0:
-                rank_fea.append(0)
-            else:
-                rank_fea.append(nor/np.sqrt(denor)/q_denor)
-        return np.array(rank_fea)*10. + pageranks
+        tag_mat = np.zeros((n, len(q_tags)), dtype=float)
+        denor = np.zeros(n, dtype=float)
+        for row, i in enumerate(search_res.ids):
+            tags = search_res.field[i].get(TAG_FLD, "{}")
+            tags = eval(tags) if isinstance(tags, str) else (tags or {})
+            if not tags:
+                continue
+            scores = np.fromiter((float(sc) for sc in tags.values()), dtype=float, count=len(tags))
+            denor[row] = float(scores @ scores)
+            for j, t in enumerate(q_tags):
+                if t in tags:
+                    tag_mat[row, j] = float(tags[t])
+        nor = tag_mat @ q_vec
+        rank_fea = np.zeros(n, dtype=float)
+        np.divide(nor, np.sqrt(denor) * q_denor, out=rank_fea, where=denor > 0)
+        return rank_fea*10. + pageranks
 
     def rerank(self, sres, query, tkweight=0.3,
                vtweight=0.7, cfield="content_ltks",
@@ -472,15 +508,10 @@ class Dealer:
         _, keywords = self.qryr.question(query)
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        # 全部候选向量一次性解码为 (n, dim) 矩阵，余弦相似度用一次矩阵乘法完成
+        ins_embd = decode_vectors([sres.field[chunk_id].get(vector_column) for chunk_id in sres.ids], vector_size)
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
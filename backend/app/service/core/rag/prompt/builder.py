@@ -47,6 +47,13 @@ class PromptBuilder:
         sections.append(PromptSection(role="user", content=instr))
         return sections
 
+    def build_without_context(self, *, user: str, extra_system: Optional[str] = None) -> List[PromptSection]:
+        """仅 system + user 两段（不附检索上下文），用于对已整理好的材料做汇总，如 compare 的 reduce 阶段。"""
+        return [
+            PromptSection(role="system", content=self._build_system(extra_system)),
+            PromptSection(role="user", content=user),
+        ]
+
     # --- internals ---
     def _build_system(self, extra: Optional[str]) -> str:
         base_zh = (
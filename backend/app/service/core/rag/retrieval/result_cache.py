@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import settings
+from utils.redis_client import get_redis, mark_redis_failed
+from utils.singleflight import SingleFlight
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger("rag.retrieval_cache")
+
+_REDIS_PREFIX = "sm:rgen:"
+_GLOBAL_SCOPE = "global"
+
+
+class RetrievalGenerations:
+    """
+    检索结果缓存的“代数”计数器：按索引与知识库两个维度分别计数。
+    - 写入（ESIndexer.index）、删除（ESConnection.delete / 文档删除）时递增对应代数
+    - 缓存键包含读取时的代数，代数变化后旧条目自然失效，不会被再次命中
+    - 进程内计数始终维护；启用 Redis 时额外用 INCR 共享给其它 worker
+    另记录最近一次递增时间：ES 写入后需等待 refresh 才可见，
+    在该窗口内的检索结果不写缓存，避免把“尚未可见”的旧结果缓存到新代数下。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local: Dict[str, int] = {}
+        self._local_ts: Dict[str, float] = {}
+
+    @staticmethod
+    def _scopes(index_name: Optional[str], kb_id: Any) -> List[str]:
+        scopes = [_GLOBAL_SCOPE]
+        if index_name:
+            scopes.append(f"idx:{index_name}")
+        if kb_id is not None and str(kb_id) != "":
+            scopes.append(f"kb:{kb_id}")
+        return scopes
+
+    def _redis(self):
+        if not getattr(settings, "SM_RETRIEVAL_CACHE_REDIS_ENABLED", False):
+            return None
+        return get_redis()
+
+    def bump(self, *, index_name: Optional[str] = None, kb_id: Any = None) -> None:
+        """递增索引/知识库代数；两者都缺省时递增全局代数（使全部缓存失效）。"""
+        scopes = self._scopes(index_name, kb_id)
+        if len(scopes) > 1:
+            scopes = scopes[1:]
+        now = time.time()
+        with self._lock:
+            for sc in scopes:
+                self._local[sc] = self._local.get(sc, 0) + 1
+                self._local_ts[sc] = now
+        r = self._redis()
+        if r is None:
+            return
+        try:
+            pipe = r.pipeline(transaction=False)
+            for sc in scopes:
+                pipe.incr(_REDIS_PREFIX + sc)
+                pipe.set(_REDIS_PREFIX + "ts:" + sc, str(now))
+            pipe.execute()
+        except Exception as e:
+            mark_redis_failed()
+            logger.warning(f"RetrievalGenerations: redis bump failed: {e}")
+
+    def current(self, *, index_name: Optional[str], kb_id: Any) -> Tuple[Tuple[Any, ...], float]:
+        """返回 (代数元组, 最近一次递增时间)。"""
+        scopes = self._scopes(index_name, kb_id)
+        with self._lock:
+            gens: List[Any] = [self._local.get(sc, 0) for sc in scopes]
+            last_ts = max([self._local_ts.get(sc, 0.0) for sc in scopes] or [0.0])
+        r = self._redis()
+        if r is not None:
+            try:
+                keys = [_REDIS_PREFIX + sc for sc in scopes] + [_REDIS_PREFIX + "ts:" + sc for sc in scopes]
+                vals = r.mget(keys)
+                n = len(scopes)
+                gens.extend([int(v or 0) for v in vals[:n]])
+                last_ts = max([last_ts] + [float(v or 0.0) for v in vals[n:]])
+            except Exception as e:
+                mark_redis_failed()
+                logger.warning(f"RetrievalGenerations: redis read failed: {e}")
+                gens.append("local-only")
+        return tuple(gens), last_ts
+
+
+retrieval_generations = RetrievalGenerations()
+
+
+class RetrievalResultCache:
+    """缓存 RAGService.retrieve 的 chunk 列表与调试信息，键中包含索引/知识库代数。"""
+
+    def __init__(self) -> None:
+        self.cache = TTLCache(
+            max_entries=int(getattr(settings, "SM_RETRIEVAL_CACHE_MAX_ENTRIES", 1024) or 1024),
+            ttl_seconds=float(getattr(settings, "SM_RETRIEVAL_CACHE_TTL_SECONDS", 600) or 600),
+        )
+        self._lock = threading.Lock()
+        self.skipped_unsettled = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(getattr(settings, "SM_RETRIEVAL_CACHE_ENABLED", True))
+
+    @staticmethod
+    def make_key(
+        *,
+        index_name: str,
+        kb_id: Any,
+        focus_doc_ids: Optional[List[int]],
+        query: str,
+        top_k: int,
+        strategy: str,
+        use_vector: bool,
+        generations: Tuple[Any, ...],
+    ) -> str:
+        payload = {
+            "index": index_name,
+            "kb": str(kb_id),
+            "focus": sorted(str(d) for d in (focus_doc_ids or []) if d is not None),
+            "q": " ".join((query or "").split()),
+            "k": int(top_k),
+            "strategy": strategy,
+            "vec": bool(use_vector),
+            "gen": list(generations),
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        hit = self.cache.get(key)
+        if hit is None:
+            return None
+        chunks, debug = hit
+        return copy.deepcopy(chunks), copy.deepcopy(debug)
+
+    def put(self, key: str, chunks: List[Dict[str, Any]], debug: Optional[Dict[str, Any]], *, last_bump_ts: float) -> None:
+        settle = float(getattr(settings, "SM_RETRIEVAL_CACHE_SETTLE_SECONDS", 2.0) or 0.0)
+        if last_bump_ts and time.time() - last_bump_ts < settle:
+            with self._lock:
+                self.skipped_unsettled += 1
+            return
+        self.cache.set(key, (copy.deepcopy(chunks), copy.deepcopy(debug)))
+
+    def stats(self) -> Dict[str, Any]:
+        out = self.cache.stats()
+        out["skippedUnsettled"] = self.skipped_unsettled
+        return out
+
+
+retrieval_result_cache = RetrievalResultCache()
+
+# 相同检索键（与结果缓存同一键）的并发 retrieve 只执行一次
+retrieval_singleflight = SingleFlight("rag.retrieve")
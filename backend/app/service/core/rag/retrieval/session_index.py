@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+from service.core.rag.retrieval.result_cache import retrieval_generations
+from service.core.rag.utils.doc_store_conn import OrderByExpr
+
+logger = logging.getLogger("rag.session_index")
+
+SESSION_INDEX_PREFIX = "sm_sess_"
+_SOURCE_FIELDS = ["text", "vector", "kb_id", "document_id", "page", "offset_start", "offset_end"]
+_TERM_RE = re.compile(r"[a-z0-9]+|[一-鿿]")
+
+# Lucene/ES 默认 BM25 参数
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+
+def _tokens(text: str) -> List[str]:
+    """近似 ES standard 分析器（会话索引的 text 字段为动态映射）：小写，英文/数字按词、中文按字。"""
+    return _TERM_RE.findall((text or "").lower())
+
+
+class SessionANNIndex:
+    """
+    单个会话索引（sm_sess_{id}）的内存副本：平铺（flat）的归一化向量矩阵 + chunk 元数据 + 倒排表。
+    会话索引通常只有几百到几千个 chunk，暴力内积即为精确检索，且比一次 ES 往返更快。
+    打分按 es_conn 对 [MatchTextExpr, MatchDenseExpr, FusionExpr] 的翻译复现：
+    - 文本：query_string 的 BM25（k1=1.2, b=0.75，IDF/平均长度取整个索引），乘以 1-向量权重
+    - 向量：knn 在过滤后的 chunk 中取余弦前 k（similarity=0 以下不入选），得分 (1+cos)/2，不加权
+    - 二者相加；只被其中一路召回的 chunk 只得该路分数
+    IDF 统计与分片、分词细节仍与 ES 有差异，分数只是近似。
+    """
+
+    def __init__(self, dims: int) -> None:
+        self.dims = dims
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metas: List[Dict[str, Any]] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.total_len = 0
+        self.matrix = np.zeros((0, dims), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, rows: Iterable[Tuple[str, str, List[float], Dict[str, Any]]]) -> None:
+        known = set(self.ids)
+        vecs = []
+        for chunk_id, text, vec, meta in rows:
+            if chunk_id in known or not vec or len(vec) != self.dims:
+                continue
+            known.add(chunk_id)
+            doc = len(self.ids)
+            self.ids.append(chunk_id)
+            self.texts.append(text or "")
+            self.metas.append(meta)
+            toks = _tokens(text)
+            self.lengths.append(len(toks))
+            self.total_len += len(toks)
+            for t, f in Counter(toks).items():
+                self.postings.setdefault(t, []).append((doc, f))
+            vecs.append(vec)
+        if not vecs:
+            return
+        m = np.asarray(vecs, dtype=np.float32)
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = np.vstack([self.matrix, m / norms])
+
+    def _bm25(self, query_text: str) -> np.ndarray:
+        n_docs = len(self.ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        if not n_docs:
+            return scores
+        avgdl = max(self.total_len / n_docs, 1e-9)
+        lengths = np.asarray(self.lengths, dtype=np.float32)
+        # 查询中重复的词在 query_string 中是重复子句，得分累加
+        for term, qf in Counter(_tokens(query_text)).items():
+            post = self.postings.get(term)
+            if not post:
+                continue
+            arr = np.asarray(post, dtype=np.int64)
+            docs, freqs = arr[:, 0], arr[:, 1].astype(np.float32)
+            idf = np.log(1.0 + (n_docs - len(post) + 0.5) / (len(post) + 0.5))
+            norm = _BM25_K1 * (1.0 - _BM25_B + _BM25_B * lengths[docs] / avgdl)
+            scores[docs] += qf * idf * freqs / (freqs + norm)
+        return scores
+
+    def search(
+        self,
+        query_vector: List[float],
+        query_text: str,
+        *,
+        limit: int,
+        knn_k: int,
+        kb_id: Any,
+        focus_doc_ids: Optional[List[str]],
+        vector_weight: float = 0.5,
+    ) -> List[Tuple[str, str, float, Dict[str, Any]]]:
+        if not self.ids:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        qn = float(np.linalg.norm(q))
+        if qn == 0:
+            return []
+        # 过滤条件（kb_id / document_id）同时作用于全文查询与 knn 的 filter
+        mask = np.ones(len(self.ids), dtype=bool)
+        kb = str(kb_id)
+        focus = set(focus_doc_ids or [])
+        for i, md in enumerate(self.metas):
+            if str(md.get("kb_id")) != kb or (focus and str(md.get("document_id")) not in focus):
+                mask[i] = False
+        idx = np.flatnonzero(mask)
+        if idx.size == 0:
+            return []
+        # knn：过滤后的候选中取余弦前 knn_k
+        cos = self.matrix[idx] @ (q / qn)
+        k = min(max(1, int(knn_k)), idx.size)
+        top_knn = np.argpartition(-cos, k - 1)[:k]
+        top_knn = top_knn[cos[top_knn] >= 0.0]
+        knn_score = np.zeros(len(self.ids), dtype=np.float32)
+        knn_hit = np.zeros(len(self.ids), dtype=bool)
+        knn_score[idx[top_knn]] = (1.0 + cos[top_knn]) / 2.0
+        knn_hit[idx[top_knn]] = True
+        # 全文：BM25 × (1 - 向量权重)
+        bm25 = self._bm25(query_text)
+        scores = (1.0 - vector_weight) * bm25 + knn_score
+        cand = np.flatnonzero(mask & ((bm25 > 0) | knn_hit))
+        if cand.size == 0:
+            return []
+        n = min(limit, cand.size)
+        top = cand[np.argpartition(-scores[cand], n - 1)[:n]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], self.texts[i], float(scores[i]), dict(self.metas[i])) for i in top]
+
+
+class SessionIndexTier:
+    """
+    会话索引的进程内检索层：按索引名 LRU 缓存 SessionANNIndex，ES 仍是唯一数据源。
+    - 首次检索时从 ES 全量拉取（hydrate）；入库任务（ParseIndexHandler）对已驻留的会话直接追加
+    - 条目记录拉取时的索引/知识库代数，代数变化（写入/删除）后条目作废并重新拉取
+    - 超过单会话 chunk 上限的索引不驻留（记为 oversized，直到代数变化），检索回退 ES
+    - 会话数与总 chunk 数超限时按 LRU 淘汰
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Tuple[Any, ...], Optional[SessionANNIndex]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.hydrations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(getattr(settings, "SM_SESSION_ANN_ENABLED", False))
+
+    @staticmethod
+    def applies_to(index_name: Optional[str]) -> bool:
+        return bool(index_name) and str(index_name).startswith(SESSION_INDEX_PREFIX)
+
+    def _total_chunks(self) -> int:
+        return sum(len(idx) for _, idx in self._entries.values() if idx is not None)
+
+    def _evict(self) -> None:
+        max_sessions = int(getattr(settings, "SM_SESSION_ANN_MAX_SESSIONS", 64) or 64)
+        max_total = int(getattr(settings, "SM_SESSION_ANN_MAX_TOTAL_CHUNKS", 20000) or 20000)
+        while self._entries and (len(self._entries) > max_sessions or self._total_chunks() > max_total):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _hydrate(self, es, index_name: str) -> Optional[SessionANNIndex]:
+        """从 ES 拉取整个会话索引；超过上限返回 None。"""
+        max_chunks = int(getattr(settings, "SM_SESSION_ANN_MAX_CHUNKS", 4000) or 4000)
+        # 走 DocStoreConnection.search，ES 与 SQLite 文档存储通用
+        res = es.search(_SOURCE_FIELDS, [], {}, [], OrderByExpr(), 0, max_chunks + 1, index_name, [])
+        hits = res.get("hits", {}).get("hits", [])
+        if len(hits) > max_chunks:
+            return None
+        dims = int(getattr(settings, "SM_VECTOR_DIMS", 1024) or 1024)
+        idx = SessionANNIndex(dims)
+        idx.add(self._rows_from_hits(hits))
+        return idx
+
+    @staticmethod
+    def _rows_from_hits(hits: List[Dict[str, Any]]):
+        for h in hits:
+            src = h.get("_source", {}) or {}
+            yield h.get("_id", ""), src.get("text", ""), src.get("vector"), {
+                "kb_id": src.get("kb_id"),
+                "document_id": src.get("document_id"),
+                "page": src.get("page"),
+                "offset_start": src.get("offset_start"),
+                "offset_end": src.get("offset_end"),
+            }
+
+    def get(self, es, index_name: str, kb_id: Any) -> Optional[SessionANNIndex]:
+        """返回可用的内存索引；不可用（超限/拉取失败）时返回 None，由调用方回退 ES。"""
+        gens, last_bump_ts = retrieval_generations.current(index_name=index_name, kb_id=kb_id)
+        with self._lock:
+            entry = self._entries.get(index_name)
+            if entry is not None and entry[0] == gens:
+                self._entries.move_to_end(index_name)
+                if entry[1] is not None:
+                    self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # 刚写入/删除后 ES 尚未 refresh，此时拉取可能缺数据，直接回退 ES
+        settle = float(getattr(settings, "SM_RETRIEVAL_CACHE_SETTLE_SECONDS", 2.0) or 0.0)
+        if last_bump_ts and time.time() - last_bump_ts < settle:
+            return None
+        try:
+            idx = self._hydrate(es, index_name)
+        except Exception as e:
+            logger.warning(f"SessionIndexTier: hydrate failed index={index_name}: {e}")
+            return None
+        with self._lock:
+            self.hydrations += 1
+            self._entries[index_name] = (gens, idx)
+            self._entries.move_to_end(index_name)
+            self._evict()
+        return idx
+
+    def add_records(self, index_name: str, kb_id: Any, records: List[Dict[str, Any]], *, prev_generations: Tuple[Any, ...]) -> None:
+        """
+        入库后调用（ESIndexer.index 已写入 ES 并递增代数）：会话已驻留时把新 chunk 直接追加，
+        并把条目代数更新为当前代数，省去下一次检索时的全量重新拉取。
+        prev_generations 为写入前的代数；与条目不一致说明期间还有其它写入/删除，此时不追加，
+        留待下一次检索重新拉取。
+        """
+        with self._lock:
+            entry = self._entries.get(index_name)
+            if entry is None or entry[1] is None or entry[0] != prev_generations:
+                return
+            gens, _ = retrieval_generations.current(index_name=index_name, kb_id=kb_id)
+            idx = entry[1]
+            max_chunks = int(getattr(settings, "SM_SESSION_ANN_MAX_CHUNKS", 4000) or 4000)
+            if len(idx) + len(records) > max_chunks:
+                self._entries[index_name] = (gens, None)
+                return
+            idx.add((r["id"], r.get("text", ""), r.get("vector"), {
+                "kb_id": r.get("kb_id"),
+                "document_id": r.get("document_id"),
+                "page": r.get("page"),
+                "offset_start": r.get("offset_start"),
+                "offset_end": r.get("offset_end"),
+            }) for r in records)
+            self._entries[index_name] = (gens, idx)
+            self._entries.move_to_end(index_name)
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled(),
+                "sessions": len(self._entries),
+                "chunks": self._total_chunks(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hydrations": self.hydrations,
+                "evictions": self.evictions,
+                "hitRate": (self.hits / total) if total else 0.0,
+            }
+
+
+session_index_tier = SessionIndexTier()
@@ -1,9 +1,12 @@
 from __future__ import annotations
 from typing import List, Optional, Dict, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+import asyncio
 import logging
-from service.core.rag.utils.es_conn import ESConnection
-from service.core.rag.nlp.model import generate_embedding
+from service.core.rag.utils.doc_store import get_doc_store_conn
+from core.config import settings
+from service.core.rag.nlp.embedding_cache import embed_queries
+from service.core.rag.retrieval.session_index import session_index_tier
 import time
 
 
@@ -15,6 +18,7 @@ class RetrieveQuery:
     focus_doc_ids: Optional[List[int]] = None
     index_override: Optional[str] = None  # for session-level index
     use_vector: bool = True  # enable hybrid retrieval (text + vector)
+    query_vector: Optional[List[float]] = None  # precomputed query embedding (skip per-query embedding call)
 
 
 @dataclass
@@ -29,14 +33,103 @@ class VectorStore:
     def search(self, *, query: RetrieveQuery) -> List[RetrievedChunk]:
         raise NotImplementedError
 
+    def search_many(self, queries: List[RetrieveQuery], *, max_concurrent_searches: Optional[int] = None) -> List[List[RetrievedChunk]]:
+        """批量检索；默认逐条调用 search，支持批量请求的实现应覆盖以减少往返。
+        各查询耗时（毫秒，与 queries 一一对应）记录在 last_took_ms。"""
+        out: List[List[RetrievedChunk]] = []
+        took: List[int] = []
+        for q in queries:
+            t0 = time.time()
+            out.append(self.search(query=q))
+            took.append(int((time.time() - t0) * 1000))
+        self.last_took_ms = took
+        return out
+
 
 class ESVectoreStore(VectorStore):
     def __init__(self, default_index: str | None = None) -> None:
-        self.es = ESConnection()
+        self.es = get_doc_store_conn()
         self.default_index = default_index
         self.logger = logging.getLogger("rag.retriever.es")
 
     def search(self, *, query: RetrieveQuery) -> List[RetrievedChunk]:
+        if self._use_session_tier(query):
+            query = self._with_query_vector(query)
+            local = self._search_local(query)
+            if local is not None:
+                return local
+        index_name, req = self._build_request(query)
+        t0 = time.time()
+        res = self.es.search(**req)
+        took_ms = int((time.time() - t0) * 1000)
+        return self._postprocess(query, index_name, res, took_ms)
+
+    def search_many(self, queries: List[RetrieveQuery], *, max_concurrent_searches: Optional[int] = None) -> List[List[RetrievedChunk]]:
+        """多个查询合并为一次 _msearch 请求；单条失败时对应位置返回空列表。
+        各查询耗时记录在 last_took_ms：ES 查询取 msearch 各响应的 took，进程内会话层取本地耗时。"""
+        self.last_took_ms = []
+        if not queries:
+            return []
+        out: List[Optional[List[RetrievedChunk]]] = [None] * len(queries)
+        took: List[int] = [0] * len(queries)
+        queries = list(queries)
+        for i, q in enumerate(queries):
+            if self._use_session_tier(q):
+                t_local = time.time()
+                queries[i] = self._with_query_vector(q)
+                out[i] = self._search_local(queries[i])
+                took[i] = int((time.time() - t_local) * 1000)
+        remote = [i for i, r in enumerate(out) if r is None]
+        if remote:
+            built = [self._build_request(queries[i]) for i in remote]
+            t0 = time.time()
+            responses = self.es.msearch([req for _, req in built], max_concurrent_searches=max_concurrent_searches)
+            took_ms = int((time.time() - t0) * 1000)
+            try:
+                self.logger.info(f"ESRetriever.msearch: queries={len(remote)} took_ms={took_ms}")
+            except Exception:
+                pass
+            for i, (index_name, _), res in zip(remote, built, responses):
+                took[i] = int(res.get("took", 0) or 0)
+                out[i] = self._postprocess(queries[i], index_name, res, took[i])
+        self.last_took_ms = took
+        return [r or [] for r in out]
+
+    # --- 会话索引的进程内检索层（见 session_index.py） ---
+    def _use_session_tier(self, query: RetrieveQuery) -> bool:
+        index_name = query.index_override or self.default_index
+        return bool(query.use_vector) and session_index_tier.enabled() and session_index_tier.applies_to(index_name)
+
+    def _with_query_vector(self, query: RetrieveQuery) -> RetrieveQuery:
+        if query.query_vector:
+            return query
+        try:
+            vec = embed_queries([query.text])[0]
+        except Exception as e:
+            try:
+                self.logger.warning(f"Query embedding failed, fallback to text-only: {e}")
+            except Exception:
+                pass
+            vec = None
+        return replace(query, query_vector=vec) if vec else replace(query, use_vector=False)
+
+    def _search_local(self, query: RetrieveQuery) -> Optional[List[RetrievedChunk]]:
+        """命中内存会话索引时返回结果；不可用（未启用/超限/拉取失败）时返回 None，由 ES 处理。"""
+        if not query.query_vector:
+            return None
+        index_name = query.index_override or self.default_index
+        t0 = time.time()
+        idx = session_index_tier.get(self.es, index_name, query.kb_id)
+        if idx is None:
+            return None
+        focus = [str(d) for d in query.focus_doc_ids if d is not None] if query.focus_doc_ids else None
+        # limit / knn_k 与 _build_request 中的 size 与 knn k 保持一致
+        rows = idx.search(query.query_vector, query.text, limit=max(query.top_k * 2, 10), knn_k=max(query.top_k, 10), kb_id=query.kb_id, focus_doc_ids=focus)
+        # 组装成 ES 响应形状，复用同一套去重/排序逻辑
+        hits = [{"_id": cid, "_score": score, "_source": dict(md, text=text)} for cid, text, score, md in rows]
+        return self._postprocess(query, index_name, {"hits": {"hits": hits}}, int((time.time() - t0) * 1000))
+
+    def _build_request(self, query: RetrieveQuery) -> tuple[str, Dict[str, Any]]:
         index_name = query.index_override or self.default_index or "scholarmind_default"
         from service.core.rag.utils.doc_store_conn import MatchTextExpr, MatchDenseExpr, FusionExpr, OrderByExpr
 
@@ -53,7 +146,7 @@ class ESVectoreStore(VectorStore):
         # 2) optional vector match (hybrid)
         if query.use_vector:
             try:
-                q_emb = generate_embedding([query.text])
+                q_emb = [query.query_vector] if query.query_vector else embed_queries([query.text])
                 if q_emb and q_emb[0] is not None:
                     match_exprs.append(
                         MatchDenseExpr(
@@ -62,7 +155,7 @@ class ESVectoreStore(VectorStore):
                             embedding_data_type="float32",
                             distance_type="cosine",
                             topn=max(query.top_k, 10),
-                            extra_options={"similarity": 0.0},
+                            extra_options=self._dense_options(),
                         )
                     )
                     # Fusion weights: text:vector = 0.5:0.5（可后续调参/从defaults读取）
@@ -81,15 +174,13 @@ class ESVectoreStore(VectorStore):
         if query.focus_doc_ids:
             condition["document_id"] = [str(d) for d in query.focus_doc_ids if d is not None]
 
-        # 4) execute
-        t0 = time.time()
-        from service.core.rag.utils.doc_store_conn import OrderByExpr as _OrderBy
-        res = self.es.search(
+        # 4) request (executed by search / search_many)
+        req = dict(
             selectFields=["text", "kb_id", "document_id", "page", "offset_start", "offset_end"],
             highlightFields=["text"],
             condition=condition,
             matchExprs=match_exprs,
-            orderBy=_OrderBy().desc("_score"),
+            orderBy=OrderByExpr().desc("_score"),
             offset=0,
             limit=max(query.top_k * 2, 10),  # 拉宽召回，再做去重与排序
             indexNames=index_name,
@@ -97,8 +188,17 @@ class ESVectoreStore(VectorStore):
             aggFields=[],
             rank_feature=None,
         )
-        took_ms = int((time.time() - t0) * 1000)
+        return index_name, req
+
+    @staticmethod
+    def _dense_options() -> Dict[str, Any]:
+        opts: Dict[str, Any] = {"similarity": 0.0}
+        oversample = float(getattr(settings, "SM_VECTOR_RESCORE_OVERSAMPLE", 0.0) or 0.0)
+        if oversample > 0:
+            opts["rescore_oversample"] = oversample
+        return opts
 
+    def _postprocess(self, query: RetrieveQuery, index_name: str, res: Dict[str, Any], took_ms: int) -> List[RetrievedChunk]:
         hits = res.get("hits", {}).get("hits", [])
         # 5) transform -> RetrievedChunk
         raw_chunks: List[RetrievedChunk] = []
@@ -156,3 +256,60 @@ class ESVectoreStore(VectorStore):
         except Exception:
             pass
         return final_chunks
+
+
+class AsyncESVectoreStore(ESVectoreStore):
+    """
+    ESVectoreStore 的异步版本：查询构造与结果后处理完全复用同步实现，
+    仅把 ES 请求换成 AsyncESConnection，查询向量生成（同步 HTTP 调用）放到线程中执行，
+    避免在事件循环上阻塞。
+    """
+
+    def __init__(self, default_index: str | None = None) -> None:
+        super().__init__(default_index=default_index)
+        from service.core.rag.utils.es_conn_async import AsyncESConnection
+        self.aes = AsyncESConnection()
+        self.logger = logging.getLogger("rag.retriever.es_async")
+
+    async def _with_query_vectors(self, queries: List[RetrieveQuery]) -> List[RetrieveQuery]:
+        need = [i for i, q in enumerate(queries) if q.use_vector and not q.query_vector]
+        if not need:
+            return list(queries)
+        out = list(queries)
+        vecs: List[Optional[List[float]]] = []
+        try:
+            vecs = await asyncio.to_thread(embed_queries, [queries[i].text for i in need])
+        except Exception as e:
+            try:
+                self.logger.warning(f"Query embedding failed, fallback to text-only: {e}")
+            except Exception:
+                pass
+        for k, i in enumerate(need):
+            vec = vecs[k] if k < len(vecs) else None
+            # 没有向量时直接退化为纯文本检索，避免 _build_request 在事件循环上再次同步生成向量
+            out[i] = replace(queries[i], query_vector=vec) if vec else replace(queries[i], use_vector=False)
+        return out
+
+    async def asearch(self, *, query: RetrieveQuery) -> List[RetrievedChunk]:
+        query = (await self._with_query_vectors([query]))[0]
+        if self._use_session_tier(query):
+            # 首次访问需从 ES 同步拉取会话索引，放到线程中执行
+            local = await asyncio.to_thread(self._search_local, query)
+            if local is not None:
+                return local
+        index_name, req = self._build_request(query)
+        t0 = time.time()
+        res = await self.aes.search(**req)
+        took_ms = int((time.time() - t0) * 1000)
+        return self._postprocess(query, index_name, res, took_ms)
+
+    async def asearch_many(self, queries: List[RetrieveQuery], *, max_concurrent_searches: Optional[int] = None) -> List[List[RetrievedChunk]]:
+        if not queries:
+            return []
+        queries = await self._with_query_vectors(queries)
+        built = [self._build_request(q) for q in queries]
+        responses = await self.aes.msearch([req for _, req in built], max_concurrent_searches=max_concurrent_searches)
+        return [
+            self._postprocess(q, index_name, res, int(res.get("took", 0) or 0))
+            for q, (index_name, _), res in zip(queries, built, responses)
+        ]
@@ -1,13 +1,21 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Generator, Optional
+from typing import List, Dict, Any, Generator, Optional, Tuple
 from dataclasses import dataclass
+import copy
 import re
 from core.config import settings
-from service.core.rag.retrieval.vector_store import ESVectoreStore, RetrieveQuery
+from service.core.rag.retrieval.vector_store import ESVectoreStore, AsyncESVectoreStore, RetrieveQuery
+from service.core.rag.retrieval.result_cache import retrieval_generations, retrieval_result_cache, retrieval_singleflight
 from service.core.rag.prompt.builder import PromptBuilder
 from service.core.rag.llm.client import LLMClient
+from service.core.rag.history_summary import rolling_summary_scheduler, summarize_history
+from service.core.rag.utils.token_counter import token_counter
+from service.core.rag.nlp.embedding_cache import embed_queries
 from core.config import settings
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
+import threading
 import time
 
 
@@ -20,6 +28,7 @@ class RAGResult:
 class RAGService:
     def __init__(self) -> None:
         self.store = ESVectoreStore(default_index=settings.ES_DEFAULT_INDEX)
+        self._astore: Optional[AsyncESVectoreStore] = None  # 异步检索链路按需创建
         self.prompt = PromptBuilder(
             language=settings.SM_DEFAULT_LANGUAGE,
             enable_citations=settings.SM_ENABLE_CITATIONS,
@@ -31,6 +40,7 @@ class RAGService:
         self._last_retrieval_debug: Dict[str, Any] | None = None
         self._last_history_debug: Dict[str, Any] | None = None
         self._last_history_summary: str | None = None
+        self._pending_history_compaction: Dict[str, Any] | None = None
 
     def retrieve(
         self,
@@ -42,6 +52,140 @@ class RAGService:
         use_vector: bool = True,
         index_override: Optional[str] = None,
     ) -> List[Dict[str, Any]]:
+        kwargs = dict(query=query, kb_id=kb_id, top_k=top_k, focus_doc_ids=focus_doc_ids, use_vector=use_vector, index_override=index_override)
+        use_cache = retrieval_result_cache.enabled()
+        coalesce = bool(getattr(settings, "SM_SINGLEFLIGHT_ENABLED", True))
+        if not use_cache and not coalesce:
+            return self._retrieve_uncached(**kwargs)[0]
+        key, last_bump_ts = self._result_cache_key(**kwargs)
+        if use_cache:
+            hit = self._result_cache_get(key, kb_id=kb_id, top_k=top_k, index_override=index_override)
+            if hit is not None:
+                return hit
+
+        def run():
+            # debug 随返回值传递，不经实例状态读取：同一 RAGService 可能被多个线程并发检索（如 compare map-reduce）
+            chunks, debug = self._retrieve_uncached(**kwargs)
+            if use_cache:
+                debug = self._result_cache_put(key, chunks, debug, last_bump_ts=last_bump_ts)
+            return chunks, debug
+
+        if not coalesce:
+            chunks, debug = run()
+            self._last_retrieval_debug = debug
+            return chunks
+        # 相同检索的并发请求共享同一次执行（键与结果缓存一致，含索引/知识库代数）
+        (chunks, debug), shared = retrieval_singleflight.do(key, run)
+        if shared:
+            self._last_retrieval_debug = dict(debug or {}, singleflight="shared")
+            return copy.deepcopy(chunks)
+        self._last_retrieval_debug = debug
+        return chunks
+
+    async def aretrieve(
+        self,
+        *,
+        query: str,
+        kb_id: int,
+        top_k: int = 5,
+        focus_doc_ids: Optional[List[int]] = None,
+        use_vector: bool = True,
+        index_override: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """retrieve 的异步版本：basic 策略经 AsyncESVectoreStore 检索，不占用线程池；
+        multi_query 需同步调用 LLM 改写子查询，整体放到线程中执行。"""
+        kwargs = dict(query=query, kb_id=kb_id, top_k=top_k, focus_doc_ids=focus_doc_ids, use_vector=use_vector, index_override=index_override)
+        if getattr(settings, "SM_RETRIEVAL_STRATEGY", "basic") == "multi_query":
+            return await asyncio.to_thread(self.retrieve, **kwargs)
+        astore = self._get_async_store()
+        if astore is None:
+            return await asyncio.to_thread(self.retrieve, **kwargs)
+        key = None
+        last_bump_ts = 0.0
+        if retrieval_result_cache.enabled():
+            key, last_bump_ts = self._result_cache_key(**kwargs)
+            hit = self._result_cache_get(key, kb_id=kb_id, top_k=top_k, index_override=index_override)
+            if hit is not None:
+                return hit
+        rq = RetrieveQuery(
+            text=query,
+            kb_id=kb_id,
+            top_k=top_k,
+            focus_doc_ids=focus_doc_ids,
+            index_override=index_override,
+            use_vector=use_vector,
+        )
+        t0 = time.time()
+        results = await astore.asearch(query=rq)
+        chunks, debug = self._basic_chunks(results, took_ms=int((time.time() - t0) * 1000), kb_id=kb_id, top_k=top_k, focus_doc_ids=focus_doc_ids, index_override=index_override)
+        if key is not None:
+            self._result_cache_put(key, chunks, debug, last_bump_ts=last_bump_ts)
+        return chunks
+
+    def _get_async_store(self) -> Optional[AsyncESVectoreStore]:
+        # 异步检索只对 Elasticsearch 有意义；SQLite 文档存储为本地读，直接在线程池中同步检索
+        if getattr(settings, "SM_DOC_STORE_TYPE", "elasticsearch") != "elasticsearch":
+            return None
+        if self._astore is None:
+            try:
+                self._astore = AsyncESVectoreStore(default_index=settings.ES_DEFAULT_INDEX)
+            except Exception as e:
+                # AsyncElasticsearch 依赖 aiohttp；不可用时退回线程池中的同步检索
+                try:
+                    self.logger.warning(f"Async ES store unavailable, fallback to threadpool retrieval: {e}")
+                except Exception:
+                    pass
+                return None
+        return self._astore
+
+    def _result_cache_key(self, *, query: str, kb_id: int, top_k: int, focus_doc_ids: Optional[List[int]], use_vector: bool, index_override: Optional[str]) -> tuple[str, float]:
+        # 结果缓存：键包含索引/知识库代数，写入或删除后旧条目不再命中
+        index_name = index_override or settings.ES_DEFAULT_INDEX
+        gens, last_bump_ts = retrieval_generations.current(index_name=index_name, kb_id=kb_id)
+        key = retrieval_result_cache.make_key(
+            index_name=index_name,
+            kb_id=kb_id,
+            focus_doc_ids=focus_doc_ids,
+            query=query,
+            top_k=top_k,
+            strategy=getattr(settings, "SM_RETRIEVAL_STRATEGY", "basic"),
+            use_vector=use_vector,
+            generations=gens,
+        )
+        return key, last_bump_ts
+
+    def _result_cache_get(self, key: str, *, kb_id: int, top_k: int, index_override: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        hit = retrieval_result_cache.get(key)
+        if hit is None:
+            return None
+        chunks, debug = hit
+        self._last_retrieval_debug = dict(debug or {}, cache="hit")
+        try:
+            self.logger.info(f"RAG.retrieve cache hit kb={kb_id} top_k={top_k} hits={len(chunks)} index={index_override or settings.ES_DEFAULT_INDEX}")
+        except Exception:
+            pass
+        return chunks
+
+    def _result_cache_put(self, key: str, chunks: List[Dict[str, Any]], debug: Optional[Dict[str, Any]], *, last_bump_ts: float) -> Optional[Dict[str, Any]]:
+        """写入结果缓存（debug 由调用方传入，与本次检索一一对应）；返回标记 cache=miss 的 debug 副本。"""
+        if chunks:
+            retrieval_result_cache.put(key, chunks, debug, last_bump_ts=last_bump_ts)
+        if debug is not None:
+            debug = dict(debug, cache="miss")
+            self._last_retrieval_debug = debug
+        return debug
+
+    def _retrieve_uncached(
+        self,
+        *,
+        query: str,
+        kb_id: int,
+        top_k: int = 5,
+        focus_doc_ids: Optional[List[int]] = None,
+        use_vector: bool = True,
+        index_override: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """按策略检索，返回 (chunks, debug)。"""
         # strategy-aware retrieval entry
         strategy = getattr(settings, "SM_RETRIEVAL_STRATEGY", "basic")
         if strategy == "multi_query":
@@ -57,7 +201,10 @@ class RAGService:
         )
         t0 = time.time()
         results = self.store.search(query=rq)
-        dt = int((time.time() - t0) * 1000)
+        return self._basic_chunks(results, took_ms=int((time.time() - t0) * 1000), kb_id=kb_id, top_k=top_k, focus_doc_ids=focus_doc_ids, index_override=index_override)
+
+    def _basic_chunks(self, results: list, *, took_ms: int, kb_id: int, top_k: int, focus_doc_ids: Optional[List[int]], index_override: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        dt = took_ms
         try:
             self.logger.info(
                 f"RAG.retrieve kb={kb_id} top_k={top_k} focus={len(focus_doc_ids or [])} hits={len(results)} took_ms={dt} index={'session' if index_override else 'default'}"
@@ -66,7 +213,7 @@ class RAGService:
             pass
         # debug footprint
         try:
-            self._last_retrieval_debug = {
+            debug = {
                 "strategy": "basic",
                 "kb_id": kb_id,
                 "top_k": top_k,
@@ -75,12 +222,13 @@ class RAGService:
                 "index": (index_override or settings.ES_DEFAULT_INDEX),
             }
         except Exception:
-            self._last_retrieval_debug = None
+            debug = None
+        self._last_retrieval_debug = debug
         # convert to common dict format for prompt
         chunks: List[Dict[str, Any]] = []
         for r in results:
             chunks.append({"text": r.text, "metadata": r.metadata, "score": r.score, "chunk_id": r.chunk_id})
-        return chunks
+        return chunks, debug
 
     # --- advanced retrieval strategies ---
     def _retrieve_multi_query(
@@ -91,9 +239,10 @@ class RAGService:
         top_k: int,
         focus_doc_ids: Optional[List[int]],
         index_override: Optional[str],
-    ) -> List[Dict[str, Any]]:
+    ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
         """Generate N sub-queries via LLM, retrieve in parallel, fuse by RRF, then dedup and cut to top_k.
-        Minimal implementation: serial calls; easy to evolve to async.
+        Sub-query embeddings are generated in one batched call; ES searches go out as a single _msearch
+        with max_concurrent_searches bounded by SM_MULTI_QUERY_CONCURRENCY.
         """
         n = max(int(getattr(settings, "SM_MULTI_QUERY_NUM", 4) or 4), 2)
         # 1) expand queries
@@ -125,20 +274,64 @@ class RAGService:
             uniq = [query]
         subs = uniq[:n]
 
-        # 2) retrieve for each sub-query
-        all_hits: List[Dict[str, Any]] = []
-        per_q_hits: Dict[str, int] = {}
-        for q in subs:
-            rq = RetrieveQuery(
-                text=q,
+        # 2) 子查询向量一次批量生成，再批量下发 ES 检索
+        t_mq = time.time()
+        sub_vecs: List[Optional[List[float]]] = [None] * len(subs)
+        t_emb = time.time()
+        try:
+            embs = embed_queries(list(subs))
+            for i, v in enumerate(embs[: len(subs)]):
+                sub_vecs[i] = v if v else None
+        except Exception as e:
+            try:
+                self.logger.warning(f"RAG.retrieve[mq] batch embedding failed, fallback to per-query embedding: {e}")
+            except Exception:
+                pass
+        embed_ms = int((time.time() - t_emb) * 1000)
+
+        # 子查询合并为一次 _msearch 请求；SM_MULTI_QUERY_CONCURRENCY 映射为 ES 端 max_concurrent_searches
+        rqs = [
+            RetrieveQuery(
+                text=subs[i],
                 kb_id=kb_id,
                 top_k=max(top_k * 2, 10),
                 focus_doc_ids=focus_doc_ids,
                 index_override=index_override,
                 use_vector=True,
+                query_vector=sub_vecs[i],
             )
-            results = self.store.search(query=rq)
-            per_q_hits[q] = len(results or [])
+            for i in range(len(subs))
+        ]
+        workers = max(1, min(int(getattr(settings, "SM_MULTI_QUERY_CONCURRENCY", 4) or 4), len(subs)))
+        per_q_results: List[list] = [[] for _ in subs]
+        per_q_ms: List[int] = [0] * len(subs)
+        try:
+            for i, res in enumerate(self.store.search_many(rqs, max_concurrent_searches=workers)):
+                per_q_results[i] = res or []
+            # 各子查询耗时取 msearch 每个响应的 took
+            for i, ms in enumerate((getattr(self.store, "last_took_ms", None) or [])[: len(subs)]):
+                per_q_ms[i] = int(ms or 0)
+        except Exception as e:
+            try:
+                self.logger.warning(f"RAG.retrieve[mq] batched search failed, fallback to per-query search: {e}")
+            except Exception:
+                pass
+            for i, rq in enumerate(rqs):
+                t_q = time.time()
+                try:
+                    per_q_results[i] = self.store.search(query=rq) or []
+                except Exception as e2:
+                    try:
+                        self.logger.warning(f"RAG.retrieve[mq] sub-query search failed q='{subs[i][:64]}': {e2}")
+                    except Exception:
+                        pass
+                per_q_ms[i] = int((time.time() - t_q) * 1000)
+        search_ms = int((time.time() - t_mq) * 1000) - embed_ms
+
+        all_hits: List[Dict[str, Any]] = []
+        per_q_hits: Dict[str, int] = {}
+        for q, results in zip(subs, per_q_results):
+            per_q_hits[q] = len(results)
             for r in results:
                 all_hits.append({
                     "chunk_id": r.chunk_id,
@@ -149,25 +342,17 @@ class RAGService:
                 })
 
         # 3) RRF fuse (Reciprocal Rank Fusion)
-        # build per-query rank list
-        ranks: Dict[str, Dict[str, int]] = {}
-        for q in subs:
-            q_hits = [h for h in all_hits if h["q"] == q]
-            # sort by ES score desc
-            q_hits.sort(key=lambda x: x["score"], reverse=True)
-            for i, h in enumerate(q_hits[: max(top_k * 3, 30)]):
-                ranks.setdefault(q, {})[h["chunk_id"]] = i + 1
-
+        # 各子查询结果按 ES 分数降序取前若干名，累加 1/(k+rank)
         agg: Dict[str, float] = {}
-        for h in all_hits:
-            cid = h["chunk_id"]
-            s = 0.0
-            for q in subs:
-                r = ranks.get(q, {}).get(cid)
-                if r is not None:
-                    s += 1.0 / (60 + r)  # k=60，稳健融合
-            if s > 0:
-                agg[cid] = agg.get(cid, 0.0) + s
+        rank_cut = max(top_k * 3, 30)
+        for results in per_q_results:
+            ordered_q = sorted(results, key=lambda r: float(r.score or 0.0), reverse=True)
+            seen_q: set[str] = set()
+            for r in ordered_q[:rank_cut]:
+                if r.chunk_id in seen_q:
+                    continue
+                seen_q.add(r.chunk_id)
+                agg[r.chunk_id] = agg.get(r.chunk_id, 0.0) + 1.0 / (60 + len(seen_q))  # k=60，稳健融合
 
         # 4) dedup by chunk_id, keep metadata/text of first occurrence
         by_id: Dict[str, Dict[str, Any]] = {}
@@ -192,30 +377,47 @@ class RAGService:
                 self.logger.warning("RAG.retrieve[mq] got 0 chunks, fallback to basic retrieval")
             except Exception:
                 pass
-            return self.retrieve(query=query, kb_id=kb_id, top_k=top_k, focus_doc_ids=focus_doc_ids, index_override=index_override)
+            # 直接执行 basic 检索：经 self.retrieve 会算出与当前调用相同的缓存/合并键，在 singleflight 中等待自身
+            rq = RetrieveQuery(
+                text=query,
+                kb_id=kb_id,
+                top_k=top_k,
+                focus_doc_ids=focus_doc_ids,
+                index_override=index_override,
+                use_vector=True,
+            )
+            t0 = time.time()
+            results = self.store.search(query=rq)
+            return self._basic_chunks(results, took_ms=int((time.time() - t0) * 1000), kb_id=kb_id, top_k=top_k, focus_doc_ids=focus_doc_ids, index_override=index_override)
         # debug footprint for MQ+RRF（裁剪以控制体积）
         try:
             fused_preview = [{"chunk_id": r["chunk_id"], "fused": float(agg.get(r["chunk_id"], 0.0)), "doc": r["metadata"].get("document_id"), "page": r["metadata"].get("page")} for r in ordered[: min(50, len(ordered))]]
-            self._last_retrieval_debug = {
+            debug = {
                 "strategy": "multi_query",
                 "subqueries": subs,
                 "per_query_hits": per_q_hits,
+                "per_query_took_ms": dict(zip(subs, per_q_ms)),
                 "kb_id": kb_id,
                 "hits_all": len(all_hits),
                 "fused_kept": len(chunks),
                 "top_k": top_k,
                 "fused_preview": fused_preview,
                 "index": (index_override or settings.ES_DEFAULT_INDEX),
+                "embed_took_ms": embed_ms,
+                "search_took_ms": search_ms,
+                "concurrency": workers,
+                "took_ms": int((time.time() - t_mq) * 1000),
             }
         except Exception:
-            self._last_retrieval_debug = None
-        return chunks
+            debug = None
+        self._last_retrieval_debug = debug
+        return chunks, debug
 
     def get_last_retrieval_debug(self) -> Dict[str, Any] | None:
         return self._last_retrieval_debug
 
-    def generate(self, *, question: str, chunks: List[Dict[str, Any]], temperature: float = None, max_tokens: int = None, stream: bool = True, history: Optional[List[Dict[str, str]]] = None, compress_history: bool = False, rolling_summary: Optional[str] = None, style: Optional[str] = None, extra_system: Optional[str] = None):
-        t0 = time.time()
+    def _build_messages(self, *, question: str, chunks: List[Dict[str, Any]], temperature: float = None, max_tokens: int = None, stream: bool = True, history: Optional[List[Dict[str, str]]] = None, compress_history: bool = False, rolling_summary: Optional[str] = None, style: Optional[str] = None, extra_system: Optional[str] = None):
+        """历史压缩/摘要、上下文裁剪与 Prompt 组装；返回 (messages, temperature, max_tokens)。关闭后台摘要（SM_ROLLING_SUMMARY_BACKGROUND）时可能同步调用 LLM 压缩历史。"""
         # 关闭开关时，不使用滚动摘要
         try:
             if not getattr(settings, "ENABLE_ROLLING_SUMMARY", True):
@@ -224,6 +426,8 @@ class RAGService:
             pass
         # build optional conversation history summary
         history_summary = None
+        self._pending_history_compaction = None
+        est_tokens = budget_tokens = None
         try:
             hs = history if isinstance(history, list) else None
             need_compact = bool(compress_history)
@@ -241,7 +445,8 @@ class RAGService:
                 est_tokens = self._estimate_tokens(joined)
                 if est_tokens > budget_tokens:
                     need_compact = True
-            if hs and need_compact:
+            background = need_compact and rolling_summary_scheduler.enabled()
+            if hs and need_compact and not background:
                 # 将已有滚动摘要与完整历史共同压缩为新的摘要
                 if rolling_summary:
                     ext = {"role": "system", "content": f"[rolling_summary]\n{rolling_summary}"}
@@ -260,6 +465,10 @@ class RAGService:
                 est_tokens = self._estimate_tokens(history_summary)
                 budget_tokens = int(getattr(settings, "SM_HISTORY_MAX_TOKENS", 2048) or 2048)
                 self._last_history_debug = {"mode": "recent_tail", "orig_turns": len(hs), "used_turns": len(tail), "summary_chars": len(history_summary or ""), "estTokens": est_tokens, "budgetTokens": budget_tokens}
+                if background:
+                    # 超出预算：本轮先用“滚动摘要+近期原文”，回答完成后由 schedule_history_compaction 在后台重算摘要
+                    self._pending_history_compaction = {"orig_turns": len(hs)}
+                    self._last_history_debug["deferred_summary"] = True
             else:
                 self._last_history_debug = {"mode": "none"}
         except Exception:
@@ -297,6 +506,15 @@ class RAGService:
             self.logger.info(f"RAG.generate stream={stream} temp={temperature} max_tokens={max_tokens} prompt_chars={sum(len(m['content']) for m in messages)}")
         except Exception:
             pass
+        return messages, temperature, max_tokens
+
+    def generate(self, *, question: str, chunks: List[Dict[str, Any]], temperature: float = None, max_tokens: int = None, stream: bool = True, history: Optional[List[Dict[str, str]]] = None, compress_history: bool = False, rolling_summary: Optional[str] = None, style: Optional[str] = None, extra_system: Optional[str] = None):
+        t0 = time.time()
+        messages, temperature, max_tokens = self._build_messages(
+            question=question, chunks=chunks, temperature=temperature, max_tokens=max_tokens, stream=stream,
+            history=history, compress_history=compress_history, rolling_summary=rolling_summary,
+            style=style, extra_system=extra_system,
+        )
         out = self.llm.generate(messages, temperature=temperature, max_tokens=max_tokens, stream=stream)
         if not stream:
             try:
@@ -318,6 +536,24 @@ class RAGService:
                 pass
         return out
 
+    async def agenerate_stream(self, *, question: str, chunks: List[Dict[str, Any]], temperature: float = None, max_tokens: int = None, history: Optional[List[Dict[str, str]]] = None, compress_history: bool = False, rolling_summary: Optional[str] = None, style: Optional[str] = None, extra_system: Optional[str] = None):
+        """
+        generate(stream=True) 的异步版本：Prompt 组装（可能同步压缩历史）放到线程中执行，
+        之后直接迭代异步 LLM 流；调用方 aclose() 即取消上游请求。
+        """
+        messages, temperature, max_tokens = await asyncio.to_thread(
+            self._build_messages,
+            question=question, chunks=chunks, temperature=temperature, max_tokens=max_tokens, stream=True,
+            history=history, compress_history=compress_history, rolling_summary=rolling_summary,
+            style=style, extra_system=extra_system,
+        )
+        parts = self.llm.agenerate_stream(messages, temperature=temperature, max_tokens=max_tokens)
+        try:
+            async for part in parts:
+                yield part
+        finally:
+            await parts.aclose()
+
     def get_last_usage(self) -> Dict[str, Any] | None:
         return self._last_usage
 
@@ -340,29 +576,21 @@ class RAGService:
 
     # --- context helpers ---
     def _summarize_history(self, history: List[Dict[str, str]]) -> str:
+        return summarize_history(self.llm, history, self.prompt.language)
+
+    def schedule_history_compaction(self, *, session_id: str) -> bool:
+        """
+        若本轮 _build_messages 因超出预算而推迟了历史摘要，则在本轮问答落库后提交后台任务，
+        把水位之后的新消息增量合并进 rolling_summary 供下一轮使用。返回是否已提交。
+        """
+        pending = self._pending_history_compaction
+        self._pending_history_compaction = None
+        if not pending or not session_id:
+            return False
         try:
-            # 压缩为简洁要点，保留关键信息与用户约束
-            lines = []
-            for m in history:
-                role = m.get("role", "user")
-                content = str(m.get("content", ""))
-                lines.append(f"{role}: {content}")
-            body = "\n".join(lines[-20:])  # 限制输入规模
-            msgs = [
-                {"role": "system", "content": (
-                    "请将以下对话历史压缩为6-10条要点，务必保留：用户目标/约束、偏好、拒答规则、安全要求、已达成结论与未决问题，以及与当前问题相关的关键信息。不要虚构。"
-                    if self.prompt.language == "zh"
-                    else "Summarize the conversation into 6-10 bullet points. MUST preserve: user goals/constraints, preferences, refusal/safety rules, reached conclusions and open questions, and key facts relevant to the current query. Do not fabricate."
-                )},
-                {"role": "user", "content": body},
-            ]
-            # 超时与重试保护
-            summary = self.llm.generate(msgs, temperature=0.2, max_tokens=256, stream=False)
-            if not summary:
-                summary = self.llm.generate(msgs, temperature=0.2, max_tokens=256, stream=False)
-            return summary or ""
+            return rolling_summary_scheduler.submit(session_id=session_id, language=self.prompt.language)
         except Exception:
-            return ""
+            return False
 
     def get_last_history_debug(self) -> Dict[str, Any] | None:
         return self._last_history_debug
@@ -371,28 +599,8 @@ class RAGService:
         return self._last_history_summary
 
     def _estimate_tokens(self, text: str) -> int:
-        try:
-            import tiktoken  # type: ignore
-            model = None
-            if getattr(settings, "SM_LLM_TYPE", "openai") == "openai":
-                model = getattr(settings, "OPENAI_MODEL_NAME", None)
-            # DashScope 没有官方 tiktoken 配置，退回 cl100k_base 近似
-            enc = None
-            if model:
-                try:
-                    enc = tiktoken.encoding_for_model(model)
-                except Exception:
-                    enc = tiktoken.get_encoding("cl100k_base")
-            else:
-                enc = tiktoken.get_encoding("cl100k_base")
-            return len(enc.encode(text or ""))
-        except Exception:
-            # 回退：中文1:1，英文1:4 近似
-            if not text:
-                return 0
-            zh = sum(1 for c in text if ord(c) > 127)
-            en = len(text) - zh
-            return zh + en // 4
+        # 进程级共享计数服务（编码器与短文本结果均有缓存），见 rag/utils/token_counter.py
+        return token_counter.count(text or "")
 
     def _model_context_window(self) -> int | None:
         name = None
@@ -420,9 +628,8 @@ class RAGService:
             return chunks
         kept: List[Dict[str, Any]] = []
         acc = 0
-        for c in chunks:
-            txt = (c or {}).get("text") or (c or {}).get("content") or ""
-            tks = self._estimate_tokens(txt)
+        counts = token_counter.count_many([(c or {}).get("text") or (c or {}).get("content") or "" for c in chunks])
+        for c, tks in zip(chunks, counts):
             if acc + tks > budget_tokens and kept:
                 continue
             kept.append(c)
@@ -481,9 +688,12 @@ class RAGService:
         dimensions: List[str],
         top_k: int = 8,
         index_override: Optional[str] = None,
+        mode: Optional[str] = None,
     ) -> Dict[str, Any]:
         """Retrieve with focus on selected documents and generate a Markdown table comparison.
-        Returns: { answer: str, chunks: List[Dict] }
+        mode: single（整体检索+一次生成）| map_reduce（逐文档检索与要点抽取并行，再汇总成表）| auto（文档数达到 SM_COMPARE_MAP_REDUCE_MIN_DOCS 时用 map_reduce）
+        top_k：single 为总检索条数（至少 8）；map_reduce 为各文档合计的下限，每篇取 max(SM_COMPARE_PER_DOC_TOP_K, ceil(top_k/文档数))
+        Returns: { answer: str, chunks: List[Dict], debug: Dict }
         """
         dims = [str(x).strip() for x in (dimensions or []) if str(x).strip()]
         if not dims:
@@ -506,7 +716,18 @@ class RAGService:
             )
             style = "concise, bullet-style, tabular"
 
+        mode = (mode or getattr(settings, "SM_COMPARE_MODE", "single") or "single").lower()
+        if mode == "auto":
+            min_docs = int(getattr(settings, "SM_COMPARE_MAP_REDUCE_MIN_DOCS", 8) or 8)
+            mode = "map_reduce" if len(doc_ids or []) >= min_docs else "single"
+        if mode == "map_reduce" and doc_ids:
+            return self._compare_map_reduce(
+                kb_id=kb_id, doc_ids=list(doc_ids), dims=dims, question=question,
+                extra=extra, style=style, index_override=index_override, top_k=top_k,
+            )
+
         # Focused retrieval
+        t0 = time.time()
         rq_topk = max(top_k, 8)
         chunks = self.retrieve(
             query=question,
@@ -515,6 +736,7 @@ class RAGService:
             focus_doc_ids=doc_ids,
             index_override=index_override,
         )
+        t1 = time.time()
         answer = self.generate(
             question=question,
             chunks=chunks,
@@ -524,4 +746,156 @@ class RAGService:
             style=style,
             extra_system=extra,
         )
-        return {"answer": answer or "", "chunks": chunks}
+        t2 = time.time()
+        debug = {
+            "mode": "single",
+            "timings": {"retrieve_ms": int((t1 - t0) * 1000), "generate_ms": int((t2 - t1) * 1000), "total_ms": int((t2 - t0) * 1000)},
+        }
+        return {"answer": answer or "", "chunks": chunks, "debug": debug}
+
+    def _compare_map_reduce(
+        self,
+        *,
+        kb_id: int,
+        doc_ids: List[int],
+        dims: List[str],
+        question: str,
+        extra: str,
+        style: str,
+        index_override: Optional[str],
+        top_k: int = 8,
+    ) -> Dict[str, Any]:
+        """
+        并行 map-reduce 对比：
+        - map：每篇文档单独聚焦检索（每篇 SM_COMPARE_PER_DOC_TOP_K 个片段、SM_COMPARE_PER_DOC_TOKENS 预算），
+          再调用 LLM 按维度抽取该文档的要点；检索与抽取分别受 SM_COMPARE_RETRIEVAL_CONCURRENCY / SM_COMPARE_LLM_CONCURRENCY 限流
+        - reduce：把各文档要点（而非原始片段）交给 LLM 汇总成 Markdown 表格；失败时按要点直接拼表
+        每篇文档有独立的上下文预算，不会因其他文档片段得分更高而缺少上下文。
+        """
+        zh = self.prompt.language == "zh"
+        # 调用方的 top_k 视为各文档合计的下限，均摊到每篇；SM_COMPARE_PER_DOC_TOP_K 为每篇的下限
+        per_doc_k = max(int(getattr(settings, "SM_COMPARE_PER_DOC_TOP_K", 6) or 6), -(-max(int(top_k or 0), 1) // max(len(doc_ids), 1)))
+        per_doc_tokens = int(getattr(settings, "SM_COMPARE_PER_DOC_TOKENS", 3000) or 3000)
+        map_max_tokens = int(getattr(settings, "SM_COMPARE_MAP_MAX_TOKENS", 512) or 512)
+        retr_conc = max(1, int(getattr(settings, "SM_COMPARE_RETRIEVAL_CONCURRENCY", 4) or 4))
+        llm_conc = max(1, int(getattr(settings, "SM_COMPARE_LLM_CONCURRENCY", 4) or 4))
+        retr_sem = threading.Semaphore(retr_conc)
+        llm_sem = threading.Semaphore(llm_conc)
+        dims_lines = "\n".join(f"- {d}" for d in dims)
+        if zh:
+            map_extra = (
+                "只根据上下文抽取该文档在各维度上的要点，每个维度一行，格式为“- 维度: 要点 [文档ID:页码]”。"
+                "信息不足时写“- 维度: —（原因）”。不要编造，不要输出表格。"
+            )
+        else:
+            map_extra = (
+                "Extract this document's key points for each dimension from the context only, one line per dimension, formatted as '- Dimension: points [documentId:page]'. "
+                "If insufficient, write '- Dimension: — (reason)'. Do not fabricate and do not output a table."
+            )
+
+        def map_one(doc_id: int) -> Dict[str, Any]:
+            item: Dict[str, Any] = {"doc_id": doc_id, "chunks": [], "notes": "", "ok": False}
+            q = f"文档 {doc_id} 的以下维度：\n{dims_lines}" if zh else f"Document {doc_id} on these dimensions:\n{dims_lines}"
+            t0 = time.time()
+            try:
+                with retr_sem:
+                    chunks = self.retrieve(query=question, kb_id=kb_id, top_k=per_doc_k, focus_doc_ids=[doc_id], index_override=index_override)
+                item["chunks"] = self._trim_chunks_to_tokens(chunks, per_doc_tokens) if chunks else []
+            except Exception as e:
+                item["error"] = f"retrieve: {e}"
+            t1 = time.time()
+            item["retrieve_ms"] = int((t1 - t0) * 1000)
+            if item["chunks"]:
+                try:
+                    sections = self.prompt.build(question=q, chunks=item["chunks"], style=style, extra_system=map_extra)
+                    msgs = [{"role": sec.role, "content": sec.content} for sec in sections]
+                    item["prompt_chars"] = sum(len(m["content"]) for m in msgs)
+                    with llm_sem:
+                        item["notes"] = (self.llm.generate(msgs, temperature=0.2, max_tokens=map_max_tokens, stream=False) or "").strip()
+                    item["ok"] = bool(item["notes"])
+                except Exception as e:
+                    item["error"] = f"map: {e}"
+            item["map_ms"] = int((time.time() - t1) * 1000)
+            return item
+
+        t0 = time.time()
+        # 检索与抽取在同一任务内流水执行，线程数取两者之和，由信号量分别限流
+        workers = max(1, min(len(doc_ids), retr_conc + llm_conc))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compare-map") as ex:
+            items = list(ex.map(map_one, doc_ids))
+        t1 = time.time()
+
+        blocks = []
+        for it in items:
+            notes = it["notes"] or ("—（未检索到相关内容）" if zh else "— (no relevant context retrieved)")
+            blocks.append(f"### 文档 {it['doc_id']}\n{notes}" if zh else f"### Document {it['doc_id']}\n{notes}")
+        notes_text = "\n\n".join(blocks)
+        if zh:
+            reduce_q = f"{question}\n以下是各文档按维度抽取的要点（已附引用），请据此汇总，保留原有引用标签：\n\n{notes_text}\n\n风格：{style}"
+        else:
+            reduce_q = f"{question}\nBelow are per-document key points by dimension (with citations). Assemble the table from them and keep the citation tags:\n\n{notes_text}\n\nStyle: {style}"
+        msgs = [{"role": sec.role, "content": sec.content} for sec in self.prompt.build_without_context(user=reduce_q, extra_system=extra)]
+        answer = ""
+        reduce_error = None
+        try:
+            answer = self.llm.generate(msgs, temperature=0.2, max_tokens=settings.SM_MAX_TOKENS, stream=False) or ""
+        except Exception as e:
+            reduce_error = str(e)
+        if not answer.strip():
+            answer = self._assemble_compare_table(dims, items)
+        try:
+            answer = self._normalize_citations(answer)
+        except Exception:
+            pass
+        t2 = time.time()
+
+        ratio = 4 if self.prompt.language == "en" else 1
+        prompt_chars = sum(int(it.get("prompt_chars") or 0) for it in items) + sum(len(m["content"]) for m in msgs)
+        completion_chars = sum(len(it["notes"]) for it in items) + len(answer)
+        self._last_usage = {
+            "prompt_tokens": prompt_chars // ratio,
+            "completion_tokens": completion_chars // ratio,
+            "total_tokens": (prompt_chars + completion_chars) // ratio,
+        }
+        per_doc = []
+        for it in items:
+            d = {"doc_id": it["doc_id"], "hits": len(it["chunks"]), "ok": it["ok"], "retrieve_ms": it["retrieve_ms"], "map_ms": it["map_ms"]}
+            if it.get("error"):
+                d["error"] = it["error"]
+            per_doc.append(d)
+        # 各线程检索的 debug 只用于本次检索（结果缓存/合并经返回值传递）；对外改为逐文档的汇总
+        self._last_retrieval_debug = {"strategy": "compare_map_reduce", "perDoc": [{"doc_id": d["doc_id"], "hits": d["hits"]} for d in per_doc]}
+        debug = {
+            "mode": "map_reduce",
+            "perDocTopK": per_doc_k,
+            "concurrency": {"workers": workers, "retrieval": retr_conc, "llm": llm_conc},
+            "timings": {"map_ms": int((t1 - t0) * 1000), "reduce_ms": int((t2 - t1) * 1000), "total_ms": int((t2 - t0) * 1000)},
+            "perDoc": per_doc,
+        }
+        if reduce_error:
+            debug["reduce_error"] = reduce_error
+        try:
+            self.logger.info(f"RAG.compare map_reduce docs={len(doc_ids)} map_ms={debug['timings']['map_ms']} reduce_ms={debug['timings']['reduce_ms']}")
+        except Exception:
+            pass
+        chunks = [c for it in items for c in it["chunks"]]
+        return {"answer": answer, "chunks": chunks, "debug": debug}
+
+    @staticmethod
+    def _assemble_compare_table(dims: List[str], items: List[Dict[str, Any]]) -> str:
+        """reduce 失败时的兜底：解析各文档 “- 维度: 要点” 行，直接拼成 行=维度、列=文档 的表格。"""
+        cells: Dict[Any, Dict[str, str]] = {}
+        for it in items:
+            row: Dict[str, str] = {}
+            for line in (it.get("notes") or "").splitlines():
+                m = re.match(r"^\s*[-*]\s*([^:：]+)[:：]\s*(.+)$", line)
+                if m:
+                    row[m.group(1).strip().strip("*").lower()] = m.group(2).strip().replace("|", "\\|")
+            cells[it["doc_id"]] = row
+        lines = [
+            "| | " + " | ".join(str(it["doc_id"]) for it in items) + " |",
+            "|---|" + "---|" * len(items),
+        ]
+        for d in dims:
+            lines.append(f"| {d} | " + " | ".join(cells[it["doc_id"]].get(d.lower(), "—") for it in items) + " |")
+        return "\n".join(lines)
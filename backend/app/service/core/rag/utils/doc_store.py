@@ -0,0 +1,17 @@
+from core.config import settings
+from exceptions.base import ModelNotFoundError
+
+
+def get_doc_store_conn():
+    """
+    按 SM_DOC_STORE_TYPE 返回 RAG 检索链路（Dealer / ESVectoreStore / ESIndexer）使用的文档存储连接。
+    两种实现都是进程内单例，且返回相同形状的检索结果；按需导入，sqlite 模式下无需安装 elasticsearch。
+    """
+    store_type = getattr(settings, "SM_DOC_STORE_TYPE", "elasticsearch")
+    if store_type == "elasticsearch":
+        from service.core.rag.utils.es_conn import ESConnection
+        return ESConnection()
+    elif store_type == "sqlite":
+        from service.core.rag.utils.sqlite_conn import SQLiteConnection
+        return SQLiteConnection()
+    raise ModelNotFoundError(model_name=store_type, message="Unknown doc store type configured.")
@@ -208,6 +208,13 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def msearch(self, requests: list[dict], max_concurrent_searches: int | None = None) -> list[dict]:
+        """
+        Run several searches, each given as a dict of search() keyword arguments.
+        Backends supporting batched queries should override this to save round trips.
+        """
+        return [self.search(**req) for req in requests]
+
     @abstractmethod
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         """
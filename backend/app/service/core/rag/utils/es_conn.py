@@ -26,7 +26,8 @@ from elasticsearch_dsl import UpdateByQuery, Q, Search, Index
 from service.core.rag.utils import singleton
 from service.core.api.utils.file_utils import get_project_base_directory
 from service.core.rag.utils.doc_store_conn import MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, FusionExpr
-from service.core.rag.nlp import is_english
+from service.core.rag.utils.es_result import ESResultMixin
+from service.core.rag.retrieval.result_cache import retrieval_generations
 from core.config import settings
 
 # 统一使用 settings.ES_URL（可包含认证信息）
@@ -38,8 +39,218 @@ TAG_FLD = "tag_feas"
 logger = logging.getLogger('ragflow.es_conn')
 
 
+def build_search_body(
+        highlightFields: list[str],
+        condition: dict,
+        matchExprs: list[MatchExpr],
+        orderBy: OrderByExpr,
+        offset: int,
+        limit: int,
+        knowledgebaseIds: list[str],
+        aggFields: list[str] = [],
+        rank_feature: dict | None = None
+) -> dict:
+    """
+    将 Expr 形式的检索请求翻译为原生 Elasticsearch 查询 DSL（请求体）。
+
+    供 `ESConnection` 与 `AsyncESConnection`（es_conn_async.py）的 search/msearch 共用，
+    保证同步/异步、单查询/批量查询的翻译结果完全一致。参数含义同 `ESConnection.search`。
+
+    Returns:
+        dict: 可直接作为 `_search` 请求体发送的查询 JSON。
+    """
+    # 第一步：构建过滤查询 (bool.filter)
+    # 这部分用于精确匹配，不计算得分，能有效利用ES缓存，性能高。
+    # 类似于SQL中的 WHERE a=1 AND b IN (2,3)
+    bqry = Q("bool", must=[])
+    condition["kb_id"] = knowledgebaseIds
+    for k, v in condition.items():
+        if k == "available_int":
+            if v == 0:
+                bqry.filter.append(Q("range", available_int={"lt": 1}))
+            else:
+                bqry.filter.append(
+                    Q("bool", must_not=Q("range", available_int={"lt": 1})))
+            continue
+        if not v:
+            continue
+        if isinstance(v, list):
+            bqry.filter.append(Q("terms", **{k: v}))
+        elif isinstance(v, str) or isinstance(v, int):
+            bqry.filter.append(Q("term", **{k: v}))
+        else:
+            raise Exception(
+                f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+    
+    s = Search()
+    
+    # 第二步：解析查询组件清单 (matchExprs)，构建相关度查询 (must/should) 和向量查询 (knn)
+    # 这是整个方法最核心的“翻译”部分。
+    vector_similarity_weight = 0.5
+    
+    # 2.1 (预处理): 如果是混合查询，先提取融合权重。
+    for m in matchExprs:
+        if isinstance(m, FusionExpr) and m.method == "weighted_sum" and "weights" in m.fusion_params:
+            # 断言确保是标准的“文本+向量+融合”三组件模式
+            assert len(matchExprs) == 3 and isinstance(matchExprs[0], MatchTextExpr) and isinstance(matchExprs[1],
+                                                                                                   MatchDenseExpr) and isinstance(
+                matchExprs[2], FusionExpr)
+            weights = m.fusion_params["weights"]
+            vector_similarity_weight = float(weights.split(",")[1])
+    
+    # 2.2 (翻译): 遍历清单，将每个Expr对象翻译成对应的ES查询子句。
+    for m in matchExprs:
+        # 翻译 MatchTextExpr -> bool.must + query_string
+        if isinstance(m, MatchTextExpr):
+            minimum_should_match = m.extra_options.get("minimum_should_match", 0.0)
+            if isinstance(minimum_should_match, float):
+                minimum_should_match = str(int(minimum_should_match * 100)) + "%"
+            bqry.must.append(Q("query_string", fields=m.fields,
+                               type="best_fields", query=m.matching_text,
+                               minimum_should_match=minimum_should_match,
+                               boost=1))
+            # 使用从FusionExpr中提取的权重，来调整文本查询的整体重要性
+            bqry.boost = 1.0 - vector_similarity_weight
+    
+        # 翻译 MatchDenseExpr -> knn
+        elif isinstance(m, MatchDenseExpr):
+            assert (bqry is not None)
+            similarity = 0.0
+            if "similarity" in m.extra_options:
+                similarity = m.extra_options["similarity"]
+            # k-NN查询是一个特殊的顶层查询，它内部可以包含一个filter子句。
+            # 这里我们将前面构建的所有过滤条件都传给了它。
+            s = s.knn(m.vector_column_name,
+                      m.topn,
+                      m.topn * 2,
+                      query_vector=list(m.embedding_data),
+                      filter=bqry.to_dict(),
+                      similarity=similarity,
+                      )
+    
+    # 2.3 (增强): 如果有rank_feature，构建should子句以提升特定文档的得分。
+    if bqry and rank_feature:
+        for fld, sc in rank_feature.items():
+            if fld != PAGERANK_FLD:
+                fld = f"{TAG_FLD}.{fld}"
+            bqry.should.append(Q("rank_feature", field=fld, linear={}, boost=sc))
+    
+    # 将构建好的布尔查询（包含filter, must, should）应用到主查询上
+    if bqry:
+        s = s.query(bqry)
+    
+    # 第三步：构建辅助功能 (高亮、排序、聚合、分页)
+    # 翻译 Highlight -> highlight
+    for field in highlightFields:
+        s = s.highlight(field)
+    
+    # 翻译 OrderByExpr -> sort
+    if orderBy:
+        orders = list()
+        for field, order in orderBy.fields:
+            order = "asc" if order == 0 else "desc"
+            # _score 是 ES 的内置排序字段，不支持 unmapped_type 等扩展参数
+            if field == "_score":
+                orders.append({field: {"order": order}})
+                continue
+            if field in ["page_num_int", "top_int"]:
+                order_info = {"order": order, "unmapped_type": "float",
+                              "mode": "avg", "numeric_type": "double"}
+            elif field.endswith("_int") or field.endswith("_flt"):
+                order_info = {"order": order, "unmapped_type": "float"}
+            else:
+                order_info = {"order": order, "unmapped_type": "text"}
+            orders.append({field: order_info})
+        s = s.sort(*orders)
+    
+    # 翻译 aggFields -> aggs
+    for fld in aggFields:
+        s.aggs.bucket(f'aggs_{fld}', 'terms', field=fld, size=1000000)
+    
+    # 翻译 offset/limit -> from/size
+    if limit > 0:
+        s = s[offset:offset + limit]
+    
+    # 第四步：最终组装
+    # 将所有构建的子句和选项，最终序列化为一个完整的ES查询JSON
+    body = s.to_dict()
+    # 量化索引（int8/int4/bbq）可选的原始 float 向量重打分：先按 oversample 倍数取候选，再用 float 向量精排
+    for m in matchExprs:
+        if isinstance(m, MatchDenseExpr) and m.extra_options.get("rescore_oversample") and "knn" in body:
+            knns = body["knn"] if isinstance(body["knn"], list) else [body["knn"]]
+            for knn in knns:
+                if knn.get("field") == m.vector_column_name:
+                    knn["rescore_vector"] = {"oversample": float(m.extra_options["rescore_oversample"])}
+    return body
+
+
+def build_index_body(mapping: dict, index_type: str | None = None, dims: int | None = None) -> dict:
+    """
+    生成建索引请求体：在 conf/mapping.json 的基础上为 `vector` 字段显式声明 dense_vector 映射。
+
+    index_type 为 "auto" 时保持原样（由 ES 动态映射 `vector` 字段）；
+    否则使用对应的 HNSW 变体（hnsw / int8_hnsw / int4_hnsw / bbq_hnsw），
+    量化变体只在 HNSW 图中保存量化向量，原始 float 向量仍保留用于重打分。
+    """
+    index_type = index_type or getattr(settings, "SM_VECTOR_INDEX_TYPE", "auto")
+    if not index_type or index_type == "auto":
+        return mapping
+    body = copy.deepcopy(mapping)
+    props = body.setdefault("mappings", {}).setdefault("properties", {})
+    props["vector"] = {
+        "type": "dense_vector",
+        "dims": int(dims or getattr(settings, "SM_VECTOR_DIMS", 1024)),
+        "index": True,
+        "similarity": "cosine",
+        "index_options": {
+            "type": index_type,
+            "m": int(getattr(settings, "SM_VECTOR_HNSW_M", 16)),
+            "ef_construction": int(getattr(settings, "SM_VECTOR_HNSW_EF_CONSTRUCTION", 100)),
+        },
+    }
+    return body
+
+
+def build_msearch_searches(requests: list[dict]) -> list[dict]:
+    """
+    把多组 search() 关键字参数翻译为 _msearch 的 header/body 交替列表。
+    """
+    searches = []
+    for req in requests:
+        indexNames = req["indexNames"]
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        assert isinstance(indexNames, list) and len(indexNames) > 0
+        assert "_id" not in req.get("condition", {})
+        body = build_search_body(req.get("highlightFields", []), req.get("condition", {}), req.get("matchExprs", []),
+                                 req.get("orderBy"), req.get("offset", 0), req.get("limit", 0),
+                                 req.get("knowledgebaseIds", []), req.get("aggFields", []), req.get("rank_feature"))
+        body["track_total_hits"] = True
+        body["_source"] = True
+        body["timeout"] = "600s"
+        searches.append({"index": indexNames})
+        searches.append(body)
+    return searches
+
+
+def parse_msearch_responses(res) -> list[dict]:
+    """
+    拆分 _msearch 响应；出错的子查询替换为空命中结果并保留 "error" 字段。
+    """
+    out = []
+    for j, r in enumerate(res.get("responses", [])):
+        if "error" in r:
+            logger.error(f"ESConnection.msearch item {j} failed: {r.get('error')}")
+            out.append({"took": r.get("took", 0), "hits": {"total": {"value": 0}, "hits": []}, "error": r.get("error")})
+            continue
+        if str(r.get("timed_out", "")).lower() == "true":
+            logger.warning(f"ESConnection.msearch item {j} timed out, partial results returned")
+        out.append(r)
+    return out
+
+
 @singleton
-class ESConnection():
+class ESConnection(ESResultMixin):
     """
     一个单例类，用于管理与Elasticsearch数据库的连接和交互。
 
@@ -75,150 +286,13 @@ class ESConnection():
         """
         try:
             if not self.es.indices.exists(index=index_name):
-                self.es.indices.create(index=index_name, body=self.mapping)
-                logger.info(f"Created index '{index_name}' with mapping.")
+                self.es.indices.create(index=index_name, body=build_index_body(self.mapping))
+                logger.info(f"Created index '{index_name}' with mapping (vector index: {getattr(settings, 'SM_VECTOR_INDEX_TYPE', 'auto')}).")
         except Exception as e:
             logger.error(f"Failed to create index '{index_name}': {e}")
             # Even if it fails (e.g., race condition), we can proceed,
             # as the insert operation might still succeed if another process created it.
 
-    """
-    Helper functions for search result
-    """
-
-    def getTotal(self, res):
-        """
-        从Elasticsearch搜索结果中提取匹配的文档总数。
-
-        Args:
-            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
-
-        Returns:
-            int: 匹配的文档总数。
-        """
-        if isinstance(res["hits"]["total"], type({})):
-            return res["hits"]["total"]["value"]
-        return res["hits"]["total"]
-
-    def getChunkIds(self, res):
-        """
-        从Elasticsearch搜索结果中提取所有命中（hit）文档的ID列表。
-
-        Args:
-            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
-
-        Returns:
-            list[str]: 一个包含所有文档ID的列表。
-        """
-        return [d["_id"] for d in res["hits"]["hits"]]
-    
-
-    def getHighlight(self, res, keywords: list[str], fieldnm: str):
-        """
-        从Elasticsearch搜索结果中提取并格式化高亮片段。
-
-        高亮片段是在指定字段中与关键词匹配的部分，通常用`<em>`标签包裹。
-
-        Args:
-            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
-            keywords (list[str]): 用于高亮处理的关键词列表。
-            fieldnm (str): 需要提取高亮片段的字段名。
-
-        Returns:
-            dict[str, str]: 一个字典，键是文档ID，值是格式化后的高亮文本。
-        """
-        ans = {}
-        for d in res["hits"]["hits"]:
-            hlts = d.get("highlight")
-            if not hlts:
-                continue
-            txt = "...".join([a for a in list(hlts.items())[0][1]])
-            if not is_english(txt.split()):
-                ans[d["_id"]] = txt
-                continue
-
-            txt = d["_source"][fieldnm]
-            txt = re.sub(r"[\r\n]", " ", txt, flags=re.IGNORECASE | re.MULTILINE)
-            txts = []
-            for t in re.split(r"[.?!;\n]", txt):
-                for w in keywords:
-                    t = re.sub(r"(^|[ .?/'\"\(\)!,:;-])(%s)([ .?/'\"\(\)!,:;-])" % re.escape(w), r"\1<em>\2</em>\3", t,
-                               flags=re.IGNORECASE | re.MULTILINE)
-                if not re.search(r"<em>[^<>]+</em>", t, flags=re.IGNORECASE | re.MULTILINE):
-                    continue
-                txts.append(t)
-            ans[d["_id"]] = "...".join(txts) if txts else "...".join([a for a in list(hlts.items())[0][1]])
-
-        return ans
-    
-
-    def getAggregation(self, res, fieldnm: str):
-        """
-        从Elasticsearch搜索结果中提取聚合（aggregation）数据。
-
-        聚合数据类似于SQL中的 `GROUP BY` 结果，用于统计分析。
-
-        Args:
-            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
-            fieldnm (str): 执行聚合的字段名。
-
-        Returns:
-            list[tuple[str, int]]: 一个元组列表，每个元组包含 (聚合键, 文档数量)。
-        """
-        agg_field = "aggs_" + fieldnm
-        if "aggregations" not in res or agg_field not in res["aggregations"]:
-            return list()
-        bkts = res["aggregations"][agg_field]["buckets"]
-        return [(b["key"], b["doc_count"]) for b in bkts]
-
-    def getFields(self, res, fields: list[str]) -> dict[str, dict]:
-        """
-        从Elasticsearch搜索结果中提取每个命中（hit）文档的指定字段。
-
-        Args:
-            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
-            fields (list[str]): 需要提取的字段名列表。
-
-        Returns:
-            dict[str, dict]: 一个字典，键是文档ID，值是包含所请求字段的子字典。
-        """
-        res_fields = {}
-        if not fields:
-            return {}
-        for d in self.__getSource(res):
-            m = {n: d.get(n) for n in fields if d.get(n) is not None}
-            for n, v in m.items():
-                if isinstance(v, list):
-                    m[n] = v
-                    continue
-                if not isinstance(v, str):
-                    m[n] = str(m[n])
-                # if n.find("tks") > 0:
-                #     m[n] = rmSpace(m[n])
-
-            if m:
-                res_fields[d["id"]] = m
-        return res_fields
-
-
-    def __getSource(self, res):
-        """
-        一个私有辅助函数，用于从搜索结果中提取 `_source` 字段，
-        并附加 `_id` 和 `_score` 到 `_source` 中。
-
-        Args:
-            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
-
-        Returns:
-            list[dict]: 一个列表，其中每个元素都是一个文档的 `_source` 字典。
-        """
-        rr = []
-        for d in res["hits"]["hits"]:
-            d["_source"]["id"] = d["_id"]
-            d["_source"]["_score"] = d["_score"]
-            rr.append(d["_source"])
-        return rr
-
     """
     Database operations
     """
@@ -327,121 +401,8 @@ class ESConnection():
         assert isinstance(indexNames, list) and len(indexNames) > 0
         assert "_id" not in condition
 
-        # 第一步：构建过滤查询 (bool.filter)
-        # 这部分用于精确匹配，不计算得分，能有效利用ES缓存，性能高。
-        # 类似于SQL中的 WHERE a=1 AND b IN (2,3)
-        bqry = Q("bool", must=[])
-        condition["kb_id"] = knowledgebaseIds
-        for k, v in condition.items():
-            if k == "available_int":
-                if v == 0:
-                    bqry.filter.append(Q("range", available_int={"lt": 1}))
-                else:
-                    bqry.filter.append(
-                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
-                continue
-            if not v:
-                continue
-            if isinstance(v, list):
-                bqry.filter.append(Q("terms", **{k: v}))
-            elif isinstance(v, str) or isinstance(v, int):
-                bqry.filter.append(Q("term", **{k: v}))
-            else:
-                raise Exception(
-                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
-
-        s = Search()
-        
-        # 第二步：解析查询组件清单 (matchExprs)，构建相关度查询 (must/should) 和向量查询 (knn)
-        # 这是整个方法最核心的“翻译”部分。
-        vector_similarity_weight = 0.5
-        
-        # 2.1 (预处理): 如果是混合查询，先提取融合权重。
-        for m in matchExprs:
-            if isinstance(m, FusionExpr) and m.method == "weighted_sum" and "weights" in m.fusion_params:
-                # 断言确保是标准的“文本+向量+融合”三组件模式
-                assert len(matchExprs) == 3 and isinstance(matchExprs[0], MatchTextExpr) and isinstance(matchExprs[1],
-                                                                                                       MatchDenseExpr) and isinstance(
-                    matchExprs[2], FusionExpr)
-                weights = m.fusion_params["weights"]
-                vector_similarity_weight = float(weights.split(",")[1])
-        
-        # 2.2 (翻译): 遍历清单，将每个Expr对象翻译成对应的ES查询子句。
-        for m in matchExprs:
-            # 翻译 MatchTextExpr -> bool.must + query_string
-            if isinstance(m, MatchTextExpr):
-                minimum_should_match = m.extra_options.get("minimum_should_match", 0.0)
-                if isinstance(minimum_should_match, float):
-                    minimum_should_match = str(int(minimum_should_match * 100)) + "%"
-                bqry.must.append(Q("query_string", fields=m.fields,
-                                   type="best_fields", query=m.matching_text,
-                                   minimum_should_match=minimum_should_match,
-                                   boost=1))
-                # 使用从FusionExpr中提取的权重，来调整文本查询的整体重要性
-                bqry.boost = 1.0 - vector_similarity_weight
-
-            # 翻译 MatchDenseExpr -> knn
-            elif isinstance(m, MatchDenseExpr):
-                assert (bqry is not None)
-                similarity = 0.0
-                if "similarity" in m.extra_options:
-                    similarity = m.extra_options["similarity"]
-                # k-NN查询是一个特殊的顶层查询，它内部可以包含一个filter子句。
-                # 这里我们将前面构建的所有过滤条件都传给了它。
-                s = s.knn(m.vector_column_name,
-                          m.topn,
-                          m.topn * 2,
-                          query_vector=list(m.embedding_data),
-                          filter=bqry.to_dict(),
-                          similarity=similarity,
-                          )
-
-        # 2.3 (增强): 如果有rank_feature，构建should子句以提升特定文档的得分。
-        if bqry and rank_feature:
-            for fld, sc in rank_feature.items():
-                if fld != PAGERANK_FLD:
-                    fld = f"{TAG_FLD}.{fld}"
-                bqry.should.append(Q("rank_feature", field=fld, linear={}, boost=sc))
-
-        # 将构建好的布尔查询（包含filter, must, should）应用到主查询上
-        if bqry:
-            s = s.query(bqry)
-            
-        # 第三步：构建辅助功能 (高亮、排序、聚合、分页)
-        # 翻译 Highlight -> highlight
-        for field in highlightFields:
-            s = s.highlight(field)
-
-        # 翻译 OrderByExpr -> sort
-        if orderBy:
-            orders = list()
-            for field, order in orderBy.fields:
-                order = "asc" if order == 0 else "desc"
-                # _score 是 ES 的内置排序字段，不支持 unmapped_type 等扩展参数
-                if field == "_score":
-                    orders.append({field: {"order": order}})
-                    continue
-                if field in ["page_num_int", "top_int"]:
-                    order_info = {"order": order, "unmapped_type": "float",
-                                  "mode": "avg", "numeric_type": "double"}
-                elif field.endswith("_int") or field.endswith("_flt"):
-                    order_info = {"order": order, "unmapped_type": "float"}
-                else:
-                    order_info = {"order": order, "unmapped_type": "text"}
-                orders.append({field: order_info})
-            s = s.sort(*orders)
-
-        # 翻译 aggFields -> aggs
-        for fld in aggFields:
-            s.aggs.bucket(f'aggs_{fld}', 'terms', field=fld, size=1000000)
-
-        # 翻译 offset/limit -> from/size
-        if limit > 0:
-            s = s[offset:offset + limit]
-            
-        # 第四步：最终组装与执行
-        # 将所有构建的子句和选项，最终序列化为一个完整的ES查询JSON
-        q = s.to_dict()
+        q = build_search_body(highlightFields, condition, matchExprs, orderBy, offset, limit,
+                              knowledgebaseIds, aggFields, rank_feature)
         logger.debug(f"ESConnection.search {str(indexNames)} query: " + json.dumps(q))
 
         # 执行查询，并包含超时重试逻辑
@@ -466,6 +427,32 @@ class ESConnection():
         logger.error("ESConnection.search timeout for 3 times!")
         raise Exception("ESConnection.search timeout.")
 
+    def msearch(self, requests: list[dict], max_concurrent_searches: int | None = None) -> list[dict]:
+        """
+        批量检索：把多组 search() 参数合并成一次 _msearch 请求，减少网络往返。
+        每个元素是与 search() 同名的关键字参数字典；返回结果与输入一一对应。
+        单个子查询出错时不影响其它子查询，对应位置返回空命中并携带 "error" 字段。
+        """
+        if not requests:
+            return []
+        searches = build_msearch_searches(requests)
+        logger.debug(f"ESConnection.msearch {len(requests)} queries")
+
+        kwargs = {}
+        if max_concurrent_searches:
+            kwargs["max_concurrent_searches"] = int(max_concurrent_searches)
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.es.msearch(searches=searches, **kwargs)
+                return parse_msearch_responses(res)
+            except Exception as e:
+                logger.exception(f"ESConnection.msearch {len(requests)} queries")
+                if str(e).find("Timeout") > 0:
+                    continue
+                raise e
+        logger.error("ESConnection.msearch timeout for 3 times!")
+        raise Exception("ESConnection.msearch timeout.")
+
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         """
         根据指定的条件，从一个索引中删除文档。
@@ -523,6 +510,8 @@ class ESConnection():
             )
             
             logger.info(f"ES delete response: {response}")
+            # 使该索引/知识库下的检索结果缓存失效
+            retrieval_generations.bump(index_name=indexName, kb_id=knowledgebaseId)
             
             return response["deleted"]
             
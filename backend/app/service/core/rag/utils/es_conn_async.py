@@ -0,0 +1,101 @@
+import json
+import logging
+
+from elasticsearch import AsyncElasticsearch
+
+from service.core.rag.utils import singleton
+from service.core.rag.utils.doc_store_conn import MatchExpr, OrderByExpr
+from service.core.rag.utils.es_conn import (
+    ES_URL,
+    ATTEMPT_TIME,
+    build_search_body,
+    build_msearch_searches,
+    parse_msearch_responses,
+)
+
+logger = logging.getLogger('ragflow.es_conn_async')
+
+
+@singleton
+class AsyncESConnection():
+    """
+    ESConnection 的异步版本（基于 AsyncElasticsearch），供异步问答链路使用。
+
+    只提供检索相关的 search/msearch，查询 DSL 与同步版本共用 `build_search_body`；
+    写入、删除等仍走同步的 ESConnection。返回结构与同步版本一致，
+    结果解析可直接复用 ESConnection 的 getTotal/getFields 等方法。
+    """
+    def __init__(self):
+        logger.info(f"Connecting to Elasticsearch (async) at {ES_URL}")
+        self.es = AsyncElasticsearch(
+            [ES_URL],
+            verify_certs=False,
+            request_timeout=600,
+        )
+
+    async def search(
+            self, selectFields: list[str],
+            highlightFields: list[str],
+            condition: dict,
+            matchExprs: list[MatchExpr],
+            orderBy: OrderByExpr,
+            offset: int,
+            limit: int,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            aggFields: list[str] = [],
+            rank_feature: dict | None = None
+    ):
+        """参数与返回值同 `ESConnection.search`。"""
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        assert isinstance(indexNames, list) and len(indexNames) > 0
+        assert "_id" not in condition
+
+        q = build_search_body(highlightFields, condition, matchExprs, orderBy, offset, limit,
+                              knowledgebaseIds, aggFields, rank_feature)
+        logger.debug(f"AsyncESConnection.search {str(indexNames)} query: " + json.dumps(q))
+
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = await self.es.search(index=indexNames,
+                                           body=q,
+                                           timeout="600s",
+                                           track_total_hits=True,
+                                           _source=True)
+                if str(res.get("timed_out", "")).lower() == "true":
+                    raise Exception("Es Timeout.")
+                return res
+            except Exception as e:
+                logger.exception(f"AsyncESConnection.search {str(indexNames)} query: " + str(q))
+                if str(e).find("Timeout") > 0:
+                    continue
+                raise e
+        logger.error("AsyncESConnection.search timeout for 3 times!")
+        raise Exception("AsyncESConnection.search timeout.")
+
+    async def msearch(self, requests: list[dict], max_concurrent_searches: int | None = None) -> list[dict]:
+        """参数与返回值同 `ESConnection.msearch`。"""
+        if not requests:
+            return []
+        searches = build_msearch_searches(requests)
+        kwargs = {}
+        if max_concurrent_searches:
+            kwargs["max_concurrent_searches"] = int(max_concurrent_searches)
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = await self.es.msearch(searches=searches, **kwargs)
+                return parse_msearch_responses(res)
+            except Exception as e:
+                logger.exception(f"AsyncESConnection.msearch {len(requests)} queries")
+                if str(e).find("Timeout") > 0:
+                    continue
+                raise e
+        logger.error("AsyncESConnection.msearch timeout for 3 times!")
+        raise Exception("AsyncESConnection.msearch timeout.")
+
+    async def close(self):
+        try:
+            await self.es.close()
+        except Exception:
+            pass
@@ -0,0 +1,166 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import re
+
+from service.core.rag.nlp import is_english
+
+
+class ESResultMixin:
+    """
+    Elasticsearch 形状检索结果（{"hits": {"total", "hits": [...]}, "aggregations": ...}）的解析方法。
+
+    ESConnection 与 SQLiteConnection（sqlite_conn.py）返回同一形状的结果，
+    两者共用这组 getTotal/getChunkIds/getFields/getHighlight/getAggregation 实现，
+    上层的 Dealer 因此无需区分底层存储。
+    """
+
+    """
+    Helper functions for search result
+    """
+
+    def getTotal(self, res):
+        """
+        从Elasticsearch搜索结果中提取匹配的文档总数。
+
+        Args:
+            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
+
+        Returns:
+            int: 匹配的文档总数。
+        """
+        if isinstance(res["hits"]["total"], type({})):
+            return res["hits"]["total"]["value"]
+        return res["hits"]["total"]
+
+    def getChunkIds(self, res):
+        """
+        从Elasticsearch搜索结果中提取所有命中（hit）文档的ID列表。
+
+        Args:
+            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
+
+        Returns:
+            list[str]: 一个包含所有文档ID的列表。
+        """
+        return [d["_id"] for d in res["hits"]["hits"]]
+    
+
+    def getHighlight(self, res, keywords: list[str], fieldnm: str):
+        """
+        从Elasticsearch搜索结果中提取并格式化高亮片段。
+
+        高亮片段是在指定字段中与关键词匹配的部分，通常用`<em>`标签包裹。
+
+        Args:
+            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
+            keywords (list[str]): 用于高亮处理的关键词列表。
+            fieldnm (str): 需要提取高亮片段的字段名。
+
+        Returns:
+            dict[str, str]: 一个字典，键是文档ID，值是格式化后的高亮文本。
+        """
+        ans = {}
+        for d in res["hits"]["hits"]:
+            hlts = d.get("highlight")
+            if not hlts:
+                continue
+            txt = "...".join([a for a in list(hlts.items())[0][1]])
+            if not is_english(txt.split()):
+                ans[d["_id"]] = txt
+                continue
+
+            txt = d["_source"][fieldnm]
+            txt = re.sub(r"[\r\n]", " ", txt, flags=re.IGNORECASE | re.MULTILINE)
+            txts = []
+            for t in re.split(r"[.?!;\n]", txt):
+                for w in keywords:
+                    t = re.sub(r"(^|[ .?/'\"\(\)!,:;-])(%s)([ .?/'\"\(\)!,:;-])" % re.escape(w), r"\1<em>\2</em>\3", t,
+                               flags=re.IGNORECASE | re.MULTILINE)
+                if not re.search(r"<em>[^<>]+</em>", t, flags=re.IGNORECASE | re.MULTILINE):
+                    continue
+                txts.append(t)
+            ans[d["_id"]] = "...".join(txts) if txts else "...".join([a for a in list(hlts.items())[0][1]])
+
+        return ans
+    
+
+    def getAggregation(self, res, fieldnm: str):
+        """
+        从Elasticsearch搜索结果中提取聚合（aggregation）数据。
+
+        聚合数据类似于SQL中的 `GROUP BY` 结果，用于统计分析。
+
+        Args:
+            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
+            fieldnm (str): 执行聚合的字段名。
+
+        Returns:
+            list[tuple[str, int]]: 一个元组列表，每个元组包含 (聚合键, 文档数量)。
+        """
+        agg_field = "aggs_" + fieldnm
+        if "aggregations" not in res or agg_field not in res["aggregations"]:
+            return list()
+        bkts = res["aggregations"][agg_field]["buckets"]
+        return [(b["key"], b["doc_count"]) for b in bkts]
+
+    def getFields(self, res, fields: list[str]) -> dict[str, dict]:
+        """
+        从Elasticsearch搜索结果中提取每个命中（hit）文档的指定字段。
+
+        Args:
+            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
+            fields (list[str]): 需要提取的字段名列表。
+
+        Returns:
+            dict[str, dict]: 一个字典，键是文档ID，值是包含所请求字段的子字典。
+        """
+        res_fields = {}
+        if not fields:
+            return {}
+        for d in self.__getSource(res):
+            m = {n: d.get(n) for n in fields if d.get(n) is not None}
+            for n, v in m.items():
+                if isinstance(v, list):
+                    m[n] = v
+                    continue
+                if not isinstance(v, str):
+                    m[n] = str(m[n])
+                # if n.find("tks") > 0:
+                #     m[n] = rmSpace(m[n])
+
+            if m:
+                res_fields[d["id"]] = m
+        return res_fields
+
+
+    def __getSource(self, res):
+        """
+        一个私有辅助函数，用于从搜索结果中提取 `_source` 字段，
+        并附加 `_id` 和 `_score` 到 `_source` 中。
+
+        Args:
+            res (dict): Elasticsearch返回的原始搜索结果JSON对象。
+
+        Returns:
+            list[dict]: 一个列表，其中每个元素都是一个文档的 `_source` 字典。
+        """
+        rr = []
+        for d in res["hits"]["hits"]:
+            d["_source"]["id"] = d["_id"]
+            d["_source"]["_score"] = d["_score"]
+            rr.append(d["_source"])
+        return rr
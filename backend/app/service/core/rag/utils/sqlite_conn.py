@@ -0,0 +1,615 @@
+import fnmatch
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from service.core.rag.utils import singleton
+from service.core.api.utils.file_utils import get_project_base_directory
+from service.core.rag.utils.doc_store_conn import (
+    DocStoreConnection,
+    MatchExpr,
+    OrderByExpr,
+    MatchTextExpr,
+    MatchDenseExpr,
+    FusionExpr,
+)
+from service.core.rag.utils.es_result import ESResultMixin
+from service.core.rag.retrieval.result_cache import retrieval_generations
+from core.config import settings
+
+logger = logging.getLogger('ragflow.sqlite_conn')
+
+PAGERANK_FLD = "pagerank_fea"
+TAG_FLD = "tag_feas"
+# SQLite 单条语句的绑定参数有上限，IN (...) 按批展开
+_IN_BATCH = 500
+# 以 BLOB（float32）形式单独存放的向量字段：ESIndexer 的 `vector` 与 Dealer 的 `q_{dim}_vec`
+_VECTOR_FIELD_RE = re.compile(r"^(vector|q_\d+_vec)$")
+# 写入 FTS5 的文本字段；query_string 中的字段及其 boost 在此不区分，统一在一个全文列上检索
+_TEXT_FIELDS = (
+    "text", "content_with_weight", "content_ltks", "content_sm_ltks",
+    "title_tks", "title_sm_tks", "important_kwd", "important_tks", "question_tks",
+)
+# 英文/数字按词、中文按字切分；FTS5 使用 unicode61 分词器对空格拼接的结果建索引，写入与查询走同一切分
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[一-鿿]")
+_QUERY_SYNTAX_RE = re.compile(r"\^[0-9.]+|~[0-9]*|\b[A-Za-z_][A-Za-z0-9_]*:|\b(?:AND|OR|NOT)\b")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS doc_indices (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    rid INTEGER PRIMARY KEY,
+    idx TEXT NOT NULL,
+    id TEXT NOT NULL,
+    kb_id TEXT,
+    doc_id TEXT,
+    doc TEXT NOT NULL,
+    UNIQUE (idx, id)
+);
+CREATE INDEX IF NOT EXISTS chunks_idx_kb ON chunks (idx, kb_id);
+CREATE INDEX IF NOT EXISTS chunks_idx_doc ON chunks (idx, doc_id);
+CREATE TABLE IF NOT EXISTS chunk_vectors (
+    rid INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    vec BLOB NOT NULL,
+    PRIMARY KEY (rid, field)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(body, tokenize='unicode61');
+"""
+
+
+def _tokens(text) -> list[str]:
+    if isinstance(text, list):
+        text = " ".join(str(t) for t in text)
+    return _TOKEN_RE.findall(str(text or "").lower())
+
+
+def _query_tokens(matching_text: str) -> list[str]:
+    """从 query_string 语法（字段前缀、^boost、~slop、AND/OR/NOT）中提取检索词，保序去重。"""
+    seen = {}
+    for t in _tokens(_QUERY_SYNTAX_RE.sub(" ", matching_text or "")):
+        seen.setdefault(t, None)
+    return list(seen)
+
+
+def _fts_body(doc: dict) -> str:
+    return " ".join(" ".join(_tokens(doc[f])) for f in _TEXT_FIELDS if doc.get(f))
+
+
+def _str_or_none(v):
+    return None if v is None else str(v)
+
+
+def _as_values(v) -> list:
+    return v if isinstance(v, list) else [v]
+
+
+def _parse_msm(v) -> float:
+    """minimum_should_match：支持 0.3 与 "30%" 两种写法。"""
+    if isinstance(v, str):
+        v = v.strip()
+        return float(v[:-1]) / 100.0 if v.endswith("%") else float(v or 0)
+    return float(v or 0.0)
+
+
+def _filter_match(doc: dict, k: str, v) -> bool:
+    """与 build_search_body 的 bool.filter 翻译保持一致的条件判断。"""
+    if k == "available_int":
+        val = doc.get(k)
+        below = val is not None and float(val) < 1
+        return below if v == 0 else not below
+    if not v:
+        return True
+    if isinstance(v, list):
+        wanted = {str(x) for x in v}
+        return any(str(x) in wanted for x in _as_values(doc.get(k)) if x is not None)
+    if isinstance(v, (str, int)):
+        return any(str(x) == str(v) for x in _as_values(doc.get(k)) if x is not None)
+    raise Exception(f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+
+
+def _delete_match(doc: dict, k: str, v) -> bool:
+    """与 ESConnection.delete 一致：列表为 terms，两端或一端带 * 的字符串为 wildcard，其余为 term。"""
+    values = [str(x) for x in _as_values(doc.get(k)) if x is not None]
+    if isinstance(v, list):
+        wanted = {str(x) for x in v}
+        return any(x in wanted for x in values)
+    if isinstance(v, str) and (v.startswith("*") or v.endswith("*")):
+        return any(fnmatch.fnmatchcase(x, v) for x in values)
+    return str(v) in values
+
+
+def _highlight(text: str, tokens: list[str]) -> list[str]:
+    """在包含检索词的句子中用 <em> 标记检索词，返回至多 5 个片段（近似 ES 默认高亮）。"""
+    if not text or not tokens:
+        return []
+    parts = []
+    for t in sorted(tokens, key=len, reverse=True):
+        if re.match(r"[a-z0-9]", t):
+            parts.append(r"(?<![a-z0-9])" + re.escape(t) + r"(?![a-z0-9])")
+        else:
+            parts.append(re.escape(t))
+    pat = re.compile("(" + "|".join(parts) + ")", flags=re.IGNORECASE)
+    frags = []
+    for sent in re.split(r"(?<=[。！？!?;；\n])|(?<=\.)\s", text):
+        if sent and pat.search(sent):
+            frags.append(pat.sub(r"<em>\1</em>", sent.strip()))
+            if len(frags) >= 5:
+                break
+    return frags
+
+
+@singleton
+class SQLiteConnection(ESResultMixin, DocStoreConnection):
+    """
+    基于 SQLite 的 DocStoreConnection 实现，面向单机部署与 CI：无需外部服务，延迟可预期。
+
+    - MatchTextExpr：FTS5 全文检索，bm25 打分
+    - MatchDenseExpr：向量以 float32 BLOB 存放，按索引缓存归一化矩阵后暴力计算余弦相似度
+    - FusionExpr(weighted_sum)：文本分（按本次结果最大值归一化）与向量分（(1+cos)/2）加权求和
+    - 过滤、排序、分页、高亮、聚合、rank_feature 与 build_search_body 的语义对齐，
+      返回与 Elasticsearch 相同形状的结果，Dealer / ESVectoreStore / ESIndexer 无需改动即可使用
+
+    与 ES 的差异：query_string 的字段 boost 与短语语法被忽略（所有文本字段合并为一个全文列），
+    文本分数不与 ES 的 BM25 数值可比。
+    """
+    def __init__(self):
+        self.path = getattr(settings, "SM_SQLITE_DOC_STORE_PATH", None) or get_project_base_directory("storage", "doc_store.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._mat_lock = threading.Lock()
+        # (index, field) -> (version, rids, 归一化矩阵)
+        self._mats: dict[tuple[str, str], tuple[int, np.ndarray, np.ndarray]] = {}
+        logger.info(f"Opening SQLite doc store at {self.path}")
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # 每个线程一个连接；WAL 模式下读不阻塞写，写入由 _write_lock 串行化
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    """
+    Database operations
+    """
+
+    def dbType(self) -> str:
+        return "sqlite"
+
+    def health(self) -> dict:
+        conn = self._conn()
+        n = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        return {"type": "sqlite", "status": "green", "path": self.path, "chunks": int(n)}
+
+    def createIdx(self, indexName: str, knowledgebaseId: str, vectorSize: int):
+        conn = self._conn()
+        with self._write_lock, conn:
+            self._ensure_index(conn, indexName)
+
+    def deleteIdx(self, indexName: str, knowledgebaseId: str):
+        # 与 ES 一致：同一租户的知识库共用一个索引，删除知识库时保留索引
+        if knowledgebaseId:
+            return
+        conn = self._conn()
+        with self._write_lock, conn:
+            rids = [r[0] for r in conn.execute("SELECT rid FROM chunks WHERE idx = ?", (indexName,))]
+            self._delete_rids(conn, rids)
+            conn.execute("DELETE FROM doc_indices WHERE name = ?", (indexName,))
+        retrieval_generations.bump(index_name=indexName)
+
+    def indexExist(self, indexName: str, knowledgebaseId: str = None) -> bool:
+        conn = self._conn()
+        return conn.execute("SELECT 1 FROM doc_indices WHERE name = ?", (indexName,)).fetchone() is not None
+
+    @staticmethod
+    def _ensure_index(conn: sqlite3.Connection, indexName: str):
+        conn.execute("INSERT OR IGNORE INTO doc_indices (name, version) VALUES (?, 0)", (indexName,))
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection, indexName: str):
+        # 版本号随写入在同一事务内递增，其它进程写入后本进程的向量矩阵缓存也能感知失效
+        conn.execute("UPDATE doc_indices SET version = version + 1 WHERE name = ?", (indexName,))
+
+    def _resolve_indices(self, conn: sqlite3.Connection, indexNames: list[str]) -> list[str]:
+        """展开通配符索引名（如 scholarmind*），只保留已存在的索引。"""
+        known = [r[0] for r in conn.execute("SELECT name FROM doc_indices")]
+        out = []
+        for name in indexNames:
+            name = name.strip()
+            for k in known:
+                if (k == name or ("*" in name and fnmatch.fnmatchcase(k, name))) and k not in out:
+                    out.append(k)
+        return out
+
+    """
+    CRUD operations
+    """
+
+    def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
+        """
+        批量写入（同 id 覆盖），返回 "文档ID:错误详情" 形式的错误列表，全部成功时为空列表。
+        """
+        res = []
+        conn = self._conn()
+        with self._write_lock, conn:
+            self._ensure_index(conn, indexName)
+            for d in documents:
+                assert "_id" not in d
+                assert "id" in d
+                try:
+                    self._upsert(conn, indexName, d)
+                except Exception as e:
+                    res.append(str(d.get("id")) + ":" + str(e))
+            self._bump_version(conn, indexName)
+        if res:
+            logger.warning(f"SQLiteConnection.insert {indexName}: {len(res)} errors, first: {res[0]}")
+        return res
+
+    def _upsert(self, conn: sqlite3.Connection, indexName: str, d: dict):
+        doc = {k: v for k, v in d.items() if k != "id"}
+        vecs = {k: doc.pop(k) for k in list(doc.keys()) if _VECTOR_FIELD_RE.match(k)}
+        chunk_id = str(d["id"])
+        old = conn.execute("SELECT rid FROM chunks WHERE idx = ? AND id = ?", (indexName, chunk_id)).fetchone()
+        if old:
+            self._delete_rids(conn, [old[0]])
+        doc_id = doc.get("document_id", doc.get("doc_id"))
+        cur = conn.execute(
+            "INSERT INTO chunks (idx, id, kb_id, doc_id, doc) VALUES (?, ?, ?, ?, ?)",
+            (indexName, chunk_id, _str_or_none(doc.get("kb_id")), _str_or_none(doc_id), json.dumps(doc, ensure_ascii=False)),
+        )
+        rid = cur.lastrowid
+        conn.execute("INSERT INTO chunks_fts (rowid, body) VALUES (?, ?)", (rid, _fts_body(doc)))
+        for fld, v in vecs.items():
+            if v is None or len(v) == 0:
+                continue
+            conn.execute("INSERT INTO chunk_vectors (rid, field, vec) VALUES (?, ?, ?)",
+                         (rid, fld, np.asarray(v, dtype=np.float32).tobytes()))
+
+    @staticmethod
+    def _delete_rids(conn: sqlite3.Connection, rids: list[int]):
+        for i in range(0, len(rids), _IN_BATCH):
+            batch = rids[i:i + _IN_BATCH]
+            marks = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM chunks_fts WHERE rowid IN ({marks})", batch)
+            conn.execute(f"DELETE FROM chunk_vectors WHERE rid IN ({marks})", batch)
+            conn.execute(f"DELETE FROM chunks WHERE rid IN ({marks})", batch)
+
+    def _load_docs(self, conn: sqlite3.Connection, rids, cache: dict[int, dict]) -> dict[int, dict]:
+        """按 rid 读取文档 JSON（带 id），结果写入 cache 并返回。"""
+        todo = [r for r in rids if r not in cache]
+        for i in range(0, len(todo), _IN_BATCH):
+            batch = todo[i:i + _IN_BATCH]
+            rows = conn.execute(f"SELECT rid, id, doc FROM chunks WHERE rid IN ({','.join('?' * len(batch))})", batch)
+            for rid, cid, doc in rows:
+                d = json.loads(doc)
+                d["id"] = cid
+                cache[rid] = d
+        return cache
+
+    def _load_vectors(self, conn: sqlite3.Connection, rids: list[int]) -> dict[int, dict[str, list[float]]]:
+        out: dict[int, dict[str, list[float]]] = {}
+        for i in range(0, len(rids), _IN_BATCH):
+            batch = rids[i:i + _IN_BATCH]
+            rows = conn.execute(f"SELECT rid, field, vec FROM chunk_vectors WHERE rid IN ({','.join('?' * len(batch))})", batch)
+            for rid, fld, blob in rows:
+                out.setdefault(rid, {})[fld] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return out
+
+    def _matrix(self, conn: sqlite3.Connection, indexName: str, field: str, dim: int):
+        """返回 (rids, 归一化矩阵)；索引版本不变时复用缓存。"""
+        row = conn.execute("SELECT version FROM doc_indices WHERE name = ?", (indexName,)).fetchone()
+        version = row[0] if row else -1
+        key = (indexName, field)
+        with self._mat_lock:
+            hit = self._mats.get(key)
+            if hit is not None and hit[0] == version and hit[2].shape[1] == dim:
+                return hit[1], hit[2]
+        rids, vecs = [], []
+        for rid, blob in conn.execute(
+                "SELECT v.rid, v.vec FROM chunk_vectors v JOIN chunks c ON c.rid = v.rid WHERE c.idx = ? AND v.field = ?",
+                (indexName, field)):
+            if len(blob) == dim * 4:
+                rids.append(rid)
+                vecs.append(blob)
+        mat = np.frombuffer(b"".join(vecs), dtype=np.float32).reshape(len(vecs), dim) if vecs else np.zeros((0, dim), dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        mat = mat / norms
+        rids = np.asarray(rids, dtype=np.int64)
+        with self._mat_lock:
+            self._mats[key] = (version, rids, mat)
+        return rids, mat
+
+    @staticmethod
+    def _sql_filter(indices: list[str], knowledgebaseIds: list[str], condition: dict) -> tuple[str, list, dict]:
+        """把索引、知识库、文档 id 条件下推为 SQL（列 c.*），其余条件留给 Python 逐条判断。"""
+        clauses = [f"c.idx IN ({','.join('?' * len(indices))})"]
+        params: list = list(indices)
+        if knowledgebaseIds:
+            kbs = [str(k) for k in knowledgebaseIds]
+            clauses.append(f"c.kb_id IN ({','.join('?' * len(kbs))})")
+            params.extend(kbs)
+        rest = {}
+        for k, v in condition.items():
+            if k in ("document_id", "doc_id") and v and isinstance(v, (list, str, int)):
+                vals = [str(x) for x in _as_values(v)]
+                clauses.append(f"c.doc_id IN ({','.join('?' * len(vals))})")
+                params.extend(vals)
+            elif k != "kb_id":
+                rest[k] = v
+        return " AND ".join(clauses), params, rest
+
+    def search(
+            self, selectFields: list[str],
+            highlightFields: list[str],
+            condition: dict,
+            matchExprs: list[MatchExpr],
+            orderBy: OrderByExpr,
+            offset: int,
+            limit: int,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            aggFields: list[str] = [],
+            rank_feature: dict | None = None
+    ):
+        """参数与返回值同 `ESConnection.search`（返回 Elasticsearch 形状的结果字典）。"""
+        t0 = time.time()
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        assert isinstance(indexNames, list) and len(indexNames) > 0
+        assert "_id" not in condition
+
+        conn = self._conn()
+        indices = self._resolve_indices(conn, indexNames)
+        if not indices:
+            return self._response([], 0, {}, t0)
+        where, params, rest = self._sql_filter(indices, knowledgebaseIds, condition)
+        docs: dict[int, dict] = {}
+
+        # 1) 过滤：SQL 先按索引/知识库/文档收敛，其余条件在 Python 侧判断
+        allowed = [r[0] for r in conn.execute(f"SELECT c.rid FROM chunks c WHERE {where}", params)]
+        if rest:
+            self._load_docs(conn, allowed, docs)
+            allowed = [r for r in allowed if all(_filter_match(docs[r], k, v) for k, v in rest.items())]
+        allowed_set = set(allowed)
+
+        text_expr = next((m for m in matchExprs if isinstance(m, MatchTextExpr)), None)
+        dense_expr = next((m for m in matchExprs if isinstance(m, MatchDenseExpr)), None)
+        vector_similarity_weight = 0.5
+        for m in matchExprs:
+            if isinstance(m, FusionExpr) and m.method == "weighted_sum" and "weights" in (m.fusion_params or {}):
+                vector_similarity_weight = float(m.fusion_params["weights"].split(",")[1])
+
+        # 2) 全文：FTS5 + bm25（bm25() 越小越相关，取负作为得分）
+        qtokens = _query_tokens(text_expr.matching_text) if text_expr else []
+        text_scores: dict[int, float] = {}
+        if text_expr and qtokens and allowed_set:
+            msm = _parse_msm(text_expr.extra_options.get("minimum_should_match", 0.0))
+            fts_query = " OR ".join(f'"{t}"' for t in qtokens)
+            rows = conn.execute(
+                f"SELECT chunks_fts.rowid, -bm25(chunks_fts), chunks_fts.body FROM chunks_fts "
+                f"JOIN chunks c ON c.rid = chunks_fts.rowid WHERE chunks_fts MATCH ? AND {where}",
+                [fts_query] + params)
+            for rid, score, body in rows:
+                if rid not in allowed_set:
+                    continue
+                if msm > 0:
+                    body_tokens = set(body.split())
+                    if sum(1 for t in qtokens if t in body_tokens) < msm * len(qtokens):
+                        continue
+                text_scores[rid] = float(score)
+
+        # 3) 向量：过滤后的候选上做精确 top-n（与 ES knn 的 filter 语义一致）
+        dense_scores: dict[int, float] = {}
+        if dense_expr is not None and allowed_set:
+            q = np.asarray(list(dense_expr.embedding_data), dtype=np.float32)
+            qn = float(np.linalg.norm(q))
+            if qn > 0:
+                threshold = float(dense_expr.extra_options.get("similarity", 0.0) or 0.0)
+                allowed_arr = np.fromiter(allowed_set, dtype=np.int64, count=len(allowed_set))
+                for idx_name in indices:
+                    rids, mat = self._matrix(conn, idx_name, dense_expr.vector_column_name, q.shape[0])
+                    mask = np.isin(rids, allowed_arr)
+                    if not mask.any():
+                        continue
+                    cand_rids, sims = rids[mask], mat[mask] @ (q / qn)
+                    k = min(int(dense_expr.topn), sims.shape[0])
+                    top = np.argpartition(-sims, k - 1)[:k]
+                    for i in top:
+                        if sims[i] >= threshold:
+                            dense_scores[int(cand_rids[i])] = (1.0 + float(sims[i])) / 2.0
+                if len(dense_scores) > dense_expr.topn:
+                    keep = sorted(dense_scores.items(), key=lambda x: -x[1])[:int(dense_expr.topn)]
+                    dense_scores = dict(keep)
+
+        # 4) 融合
+        if text_expr is not None and dense_expr is not None:
+            max_text = max(text_scores.values(), default=0.0)
+            scores = {}
+            for rid in set(text_scores) | set(dense_scores):
+                t = text_scores.get(rid, 0.0) / max_text if max_text > 0 else 0.0
+                scores[rid] = (1.0 - vector_similarity_weight) * t + vector_similarity_weight * dense_scores.get(rid, 0.0)
+        elif text_expr is not None:
+            scores = text_scores
+        elif dense_expr is not None:
+            scores = dense_scores
+        else:
+            scores = {rid: 0.0 for rid in allowed}
+
+        if rank_feature and scores:
+            self._load_docs(conn, scores.keys(), docs)
+            for rid in scores:
+                d = docs[rid]
+                for fld, sc in rank_feature.items():
+                    val = d.get(PAGERANK_FLD) if fld == PAGERANK_FLD else (d.get(TAG_FLD) or {}).get(fld)
+                    if val:
+                        scores[rid] += float(sc) * float(val)
+
+        # 5) 排序、聚合、分页
+        ranked = sorted(scores.keys(), key=lambda r: -scores[r])
+        if orderBy and orderBy.fields:
+            if any(f != "_score" for f, _ in orderBy.fields):
+                self._load_docs(conn, ranked, docs)
+            # 从次要字段到主要字段依次做稳定排序；缺失值始终排在最后（同 ES 的 missing: _last）
+            for field, order in reversed(orderBy.fields):
+                vals = {r: self._sort_value(field, scores[r], docs.get(r)) for r in ranked}
+                present = sorted((r for r in ranked if vals[r] is not None), key=vals.__getitem__, reverse=bool(order))
+                ranked = present + [r for r in ranked if vals[r] is None]
+
+        aggs = {}
+        if aggFields:
+            self._load_docs(conn, ranked, docs)
+            for fld in aggFields:
+                cnt = Counter()
+                for r in ranked:
+                    for v in _as_values(docs[r].get(fld)):
+                        if v is not None and v != "":
+                            cnt[v] += 1
+                aggs[f"aggs_{fld}"] = {"buckets": [{"key": k, "doc_count": c} for k, c in sorted(cnt.items(), key=lambda x: (-x[1], str(x[0])))]}
+
+        page = ranked[offset:offset + limit] if limit > 0 else ranked[:10]
+        self._load_docs(conn, page, docs)
+        vectors = self._load_vectors(conn, page)
+        hits = []
+        for r in page:
+            src = dict(docs[r])
+            cid = src.pop("id")
+            src.update(vectors.get(r, {}))
+            hit = {"_index": "", "_id": cid, "_score": scores[r], "_source": src}
+            hl = {f: _highlight(str(src.get(f) or ""), qtokens) for f in highlightFields} if qtokens else {}
+            hl = {f: v for f, v in hl.items() if v}
+            if hl:
+                hit["highlight"] = hl
+            hits.append(hit)
+        return self._response(hits, len(ranked), aggs, t0)
+
+    @staticmethod
+    def _sort_value(field: str, score: float, doc: dict | None):
+        if field == "_score":
+            return score
+        v = (doc or {}).get(field)
+        if isinstance(v, list):
+            nums = [float(x) for x in v if isinstance(x, (int, float))]
+            return sum(nums) / len(nums) if nums else None
+        if v is None:
+            return None
+        if field.endswith("_int") or field.endswith("_flt"):
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                return None
+        return str(v)
+
+    @staticmethod
+    def _response(hits: list[dict], total: int, aggs: dict, t0: float) -> dict:
+        res = {
+            "took": int((time.time() - t0) * 1000),
+            "timed_out": False,
+            "hits": {
+                "total": {"value": total, "relation": "eq"},
+                "max_score": max((h["_score"] for h in hits), default=None),
+                "hits": hits,
+            },
+        }
+        if aggs:
+            res["aggregations"] = aggs
+        return res
+
+    def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
+        conn = self._conn()
+        sql, params = "SELECT rid FROM chunks WHERE idx = ? AND id = ?", [indexName, str(chunkId)]
+        if knowledgebaseIds:
+            sql += f" AND kb_id IN ({','.join('?' * len(knowledgebaseIds))})"
+            params.extend(str(k) for k in knowledgebaseIds)
+        row = conn.execute(sql, params).fetchone()
+        if not row:
+            return None
+        doc = self._load_docs(conn, [row[0]], {})[row[0]]
+        doc.update(self._load_vectors(conn, [row[0]]).get(row[0], {}))
+        return doc
+
+    def _select_for_write(self, conn: sqlite3.Connection, condition: dict, indexName: str, knowledgebaseId: str, match) -> dict[str, list[int]]:
+        indices = self._resolve_indices(conn, indexName.split(","))
+        out: dict[str, list[int]] = {}
+        for idx_name in indices:
+            sql, params = "SELECT rid FROM chunks WHERE idx = ?", [idx_name]
+            if knowledgebaseId:
+                sql += " AND kb_id = ?"
+                params.append(str(knowledgebaseId))
+            if isinstance(condition.get("id"), str):
+                sql += " AND id = ?"
+                params.append(condition["id"])
+            rids = [r[0] for r in conn.execute(sql, params)]
+            rest = {k: v for k, v in condition.items() if k != "id" or not isinstance(v, str)}
+            if rest:
+                docs = self._load_docs(conn, rids, {})
+                rids = [r for r in rids if all(match(docs[r], k, v) for k, v in rest.items())]
+            if rids:
+                out[idx_name] = rids
+        return out
+
+    def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
+        """按条件更新（字段覆盖写入，向量字段同步更新 BLOB）。"""
+        try:
+            conn = self._conn()
+            with self._write_lock, conn:
+                targets = self._select_for_write(conn, condition, indexName, knowledgebaseId, _filter_match)
+                for idx_name, rids in targets.items():
+                    docs = self._load_docs(conn, rids, {})
+                    vectors = self._load_vectors(conn, rids)
+                    for r in rids:
+                        d = dict(docs[r], **vectors.get(r, {}))
+                        d.update(newValue)
+                        self._upsert(conn, idx_name, d)
+                    self._bump_version(conn, idx_name)
+            for idx_name in targets:
+                retrieval_generations.bump(index_name=idx_name, kb_id=knowledgebaseId)
+            return True
+        except Exception as e:
+            logger.error(f"SQLiteConnection.update failed: {e}")
+            return False
+
+    def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
+        """按条件删除，语义同 `ESConnection.delete`（索引名支持通配符）；返回删除的条数。"""
+        try:
+            conn = self._conn()
+            with self._write_lock, conn:
+                targets = self._select_for_write(conn, condition, indexName, knowledgebaseId, _delete_match)
+                for idx_name, rids in targets.items():
+                    self._delete_rids(conn, rids)
+                    self._bump_version(conn, idx_name)
+            deleted = sum(len(r) for r in targets.values())
+            logger.info(f"SQLite delete index={indexName} kb_id={knowledgebaseId} condition={condition} deleted={deleted}")
+            # 使该索引/知识库下的检索结果缓存失效
+            retrieval_generations.bump(index_name=indexName, kb_id=knowledgebaseId)
+            for idx_name in targets:
+                if idx_name != indexName:
+                    retrieval_generations.bump(index_name=idx_name, kb_id=knowledgebaseId)
+            return deleted
+        except Exception as e:
+            logger.error(f"Failed to delete documents from SQLite: {str(e)}")
+            return 0
+
+    """
+    SQL
+    """
+
+    def sql(self, sql: str, fetch_size: int, format: str):
+        logger.warning("SQLiteConnection.sql: text-to-sql retrieval is not supported by the SQLite doc store")
+        return None
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+from core.config import settings
+
+
+def _heuristic(text: str) -> int:
+    # tiktoken 不可用时的近似：中文 1 字 1 token，英文 4 字符 1 token
+    if not text:
+        return 0
+    zh = sum(1 for c in text if ord(c) > 127)
+    return zh + (len(text) - zh) // 4
+
+
+class TokenCounter:
+    """
+    进程级 token 计数服务：
+    - 编码器按模型名解析一次后缓存（未知模型/DashScope 退回 cl100k_base），tiktoken 不可用时退回字符近似
+    - 短文本计数结果按 (编码, 文本) LRU 缓存，重复出现的检索片段/历史消息无需重新编码
+    - count_many 批量编码（tiktoken 多线程 encode_ordinary_batch）
+    - incremental() 返回增量计数器，追加文本时只重算衔接处
+    统一按普通文本编码（encode_ordinary），文本中出现 <|endoftext|> 等特殊标记时不会报错。
+    """
+
+    _CACHE_MAX_TEXT = 8192
+
+    def __init__(self, cache_size: int = 8192) -> None:
+        self._lock = threading.Lock()
+        self._encoders: Dict[Optional[str], Any] = {}
+        self._cache: "OrderedDict[tuple[str, str], int]" = OrderedDict()
+        self._cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def default_model() -> Optional[str]:
+        # 仅 OpenAI 模型有官方 tiktoken 映射；DashScope 等以 cl100k_base 近似
+        if getattr(settings, "SM_LLM_TYPE", "openai") == "openai":
+            return getattr(settings, "OPENAI_MODEL_NAME", None)
+        return None
+
+    def encoder(self, model: Optional[str] = None):
+        """返回缓存的 tiktoken 编码器；tiktoken 不可用时返回 None。"""
+        model = model if model is not None else self.default_model()
+        if model in self._encoders:
+            return self._encoders[model]
+        enc = None
+        try:
+            import tiktoken  # type: ignore
+            try:
+                enc = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                enc = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            enc = None
+        with self._lock:
+            self._encoders[model] = enc
+        return enc
+
+    def _cache_get(self, key):
+        with self._lock:
+            v = self._cache.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def _cache_put(self, key, value: int) -> None:
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def count(self, text: str, model: Optional[str] = None) -> int:
+        text = text or ""
+        if not text:
+            return 0
+        enc = self.encoder(model)
+        if enc is None:
+            return _heuristic(text)
+        cacheable = len(text) <= self._CACHE_MAX_TEXT
+        if cacheable:
+            hit = self._cache_get((enc.name, text))
+            if hit is not None:
+                return hit
+        try:
+            n = len(enc.encode_ordinary(text))
+        except Exception:
+            return _heuristic(text)
+        if cacheable:
+            self._cache_put((enc.name, text), n)
+        return n
+
+    def count_many(self, texts: Sequence[str], model: Optional[str] = None) -> List[int]:
+        """批量计数，返回与输入一一对应的 token 数；未命中缓存的文本一次性批量编码。"""
+        texts = [t or "" for t in texts]
+        enc = self.encoder(model)
+        if enc is None:
+            return [_heuristic(t) for t in texts]
+        out: List[Optional[int]] = [None] * len(texts)
+        todo: List[int] = []
+        for i, t in enumerate(texts):
+            if not t:
+                out[i] = 0
+            elif len(t) <= self._CACHE_MAX_TEXT:
+                out[i] = self._cache_get((enc.name, t))
+            if out[i] is None:
+                todo.append(i)
+        if todo:
+            try:
+                encoded = enc.encode_ordinary_batch([texts[i] for i in todo])
+                counts = [len(e) for e in encoded]
+            except Exception:
+                counts = [_heuristic(texts[i]) for i in todo]
+            for i, n in zip(todo, counts):
+                out[i] = n
+                if len(texts[i]) <= self._CACHE_MAX_TEXT:
+                    self._cache_put((enc.name, texts[i]), n)
+        return [int(n or 0) for n in out]
+
+    def incremental(self, sep: str = "", model: Optional[str] = None) -> "IncrementalTokenCounter":
+        return IncrementalTokenCounter(self, sep=sep, model=model)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "encoders": sorted(str(k) for k in self._encoders),
+                "cacheEntries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": (self.hits / total) if total else 0.0,
+            }
+
+
+class IncrementalTokenCounter:
+    """
+    追加式计数：维护 sep.join(pieces) 的 token 数。每次追加只重新编码“上一片段 + sep + 新片段”，
+    用以修正衔接处的 BPE 合并；片段边界落在预分词边界（如换行分隔）时结果与整体编码一致。
+    """
+
+    def __init__(self, counter: TokenCounter, *, sep: str = "", model: Optional[str] = None) -> None:
+        self._counter = counter
+        self._sep = sep
+        self._model = model
+        self.reset()
+
+    def reset(self) -> None:
+        self.total = 0
+        self._tail = ""
+        self._tail_tokens = 0
+
+    def preview(self, text: str) -> int:
+        """追加 text 之后的总 token 数（不改变状态）。"""
+        if not self._tail:
+            return self.total + self._counter.count(text, self._model)
+        joined = self._counter.count(self._tail + self._sep + text, self._model)
+        return self.total - self._tail_tokens + joined
+
+    def append(self, text: str) -> int:
+        if not self._tail:
+            n = self._counter.count(text, self._model)
+            self.total += n
+            self._tail, self._tail_tokens = text, n
+            return self.total
+        joined = self._counter.count(self._tail + self._sep + text, self._model)
+        added = joined - self._tail_tokens
+        self.total += added
+        self._tail, self._tail_tokens = self._sep + text, added
+        return self.total
+
+
+token_counter = TokenCounter()
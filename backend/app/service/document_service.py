@@ -5,7 +5,8 @@ from models.document import Document
 from models.knowledgebase import KnowledgeBase
 from schemas.document import DocumentUpdate, DocumentCreate
 from exceptions.base import ResourceNotFoundException, PermissionDeniedException, APIException
-from service.core.rag.utils.es_conn import ESConnection
+from service.core.rag.utils.doc_store import get_doc_store_conn
+from service.core.rag.retrieval.result_cache import retrieval_generations
 from core.config import settings
 import os
 from utils.get_logger import logger
@@ -122,7 +123,7 @@ def delete_document(db: Session, doc_id: int, user_id: int, kb_id: int) -> Docum
     # 3) 从向量数据库中删除相关数据
     logger.info(f"Start ES deletion phase for doc_id={doc_to_delete.id}, kb_id={kb_id}")
     try:
-        es = ESConnection()
+        es = get_doc_store_conn()
         # 仅收敛到指定前缀的索引/别名，避免误删和性能问题
         es_prefix = settings.ES_DEFAULT_INDEX.split('_')[0]  # 如 scholarmind
         candidates: Set[str] = set([settings.ES_DEFAULT_INDEX, "default"])  # 兼容早期
@@ -173,6 +174,8 @@ def delete_document(db: Session, doc_id: int, user_id: int, kb_id: int) -> Docum
                 continue
     except Exception as e:
         logger.error(f"An error occurred during ES deletion for doc_id={doc_to_delete.id}. Error: {e}")
+    # 无论 ES 删除是否全部成功，均使该知识库的检索结果缓存失效
+    retrieval_generations.bump(kb_id=kb_id)
 
     # 4) 返回被删除的文档对象
     db.delete(doc_to_delete)
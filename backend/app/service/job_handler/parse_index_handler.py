@@ -8,6 +8,8 @@ from service.core.ingestion.chunker import RecursiveCharacterChunker
 from core.config import settings
 from service.core.ingestion.embedder import SimpleAPIEmbedder
 from service.core.ingestion.indexer import ESIndexer
+from service.core.rag.retrieval.result_cache import retrieval_generations
+from service.core.rag.retrieval.session_index import session_index_tier
 from service.core.ingestion.metadata_extractor import DefaultMetadataExtractor
 from service import document_service
 
@@ -78,12 +80,26 @@ class ParseIndexHandler(BaseJobHandler):
                     if doc.doi:
                         md.setdefault("doi", doc.doi)
                 
+                prev_gens = None
+                if session_index and session_index_tier.enabled():
+                    prev_gens, _ = retrieval_generations.current(index_name=session_index, kb_id=kb_id)
                 try:
-                    indexer.index(records=records, kb_id=kb_id, document_id=doc_id, session_index=session_index)
+                    indexed = indexer.index(records=records, kb_id=kb_id, document_id=doc_id, session_index=session_index)
                 except Exception as e:
                     log.error(f"ParseIndex: index failed doc_id={doc_id}: {e}")
                     raise
-                result.details.append({"doc_id": doc_id, "status": "ok", "chunks": len(records)})
+                # 会话索引已驻留内存时直接追加新 chunk，避免下次检索整体重新拉取
+                if prev_gens is not None and indexed:
+                    try:
+                        session_index_tier.add_records(session_index, kb_id, indexed, prev_generations=prev_gens)
+                    except Exception as e:
+                        log.warning(f"ParseIndex: session index tier update failed doc_id={doc_id}: {e}")
+                detail = {"doc_id": doc_id, "status": "ok", "chunks": len(records)}
+                if embedder.last_cache_stats:
+                    detail["embeddingCache"] = embedder.last_cache_stats
+                if embedder.last_failed_indices:
+                    detail["embeddingFailed"] = len(embedder.last_failed_indices)
+                result.details.append(detail)
                 result.succeeded += 1
             except Exception as e:
                 result.details.append({"doc_id": doc_id, "status": "failed", "error": str(e)})
@@ -1,5 +1,7 @@
-from typing import Optional
+from typing import List, Optional
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
+from models.message import Message
 from models.session import Session as SessionModel
 
 
@@ -44,9 +46,31 @@ class SessionService:
         s.defaults_json = defaults_json
         self.db.commit()
 
-    def update_rolling_summary(self, *, session_id: str, rolling_summary: Optional[str]) -> None:
+    def update_rolling_summary(self, *, session_id: str, rolling_summary: Optional[str], watermark: Optional[str] = None) -> None:
+        """写回滚动摘要；watermark 非空时同时推进水位（已并入摘要的最后一条消息 ID）。"""
         s = self.get_session_by_id(session_id=session_id)
         if not s:
             return
         s.rolling_summary = rolling_summary
-        self.db.commit()
\ No newline at end of file
+        if watermark is not None:
+            s.rolling_summary_watermark = watermark
+        self.db.commit()
+
+    def list_messages_after_watermark(self, *, session_id: str, watermark: Optional[str], limit: int) -> List[Message]:
+        """按时间正序返回水位之后最早的 limit 条消息；水位为空或已失效时视为从头开始。
+        积压超过 limit 条时调用方推进水位后再次读取，保证每条消息都按顺序被处理到。"""
+        q = self.db.query(Message).filter(Message.session_id == session_id)
+        wm = None
+        if watermark:
+            wm = (
+                self.db.query(Message)
+                .filter(Message.session_id == session_id, Message.message_id == watermark)
+                .first()
+            )
+        if wm is not None:
+            # (create_time, message_id) 作为全序，避免同一时间戳的消息被跳过或重复
+            q = q.filter(or_(
+                Message.create_time > wm.create_time,
+                and_(Message.create_time == wm.create_time, Message.message_id > wm.message_id),
+            ))
+        return q.order_by(Message.create_time.asc(), Message.message_id.asc()).limit(max(1, int(limit))).all()
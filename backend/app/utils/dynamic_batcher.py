@@ -0,0 +1,173 @@
+from __future__ import annotations
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class DynamicBatcher:
+    """
+    动态批处理（线程安全）：把并发到达的小请求合并成大批次交给 batch_fn 一次处理。
+    - 后台线程收集请求，累计条目数达到 max_batch_size，或最早请求已等待 max_wait_ms 时触发一次处理
+    - batch_fn(items) 必须返回与 items 等长、一一对应的结果；抛出异常时本批所有请求收到同一异常
+    - 单个请求的条目数超过 max_batch_size 时不拆分，独立成批（由 batch_fn 自行分块）
+    - max_in_flight > 1 时批次交给线程池执行，最多 max_in_flight 个批次同时在途，单个慢批次不阻塞后续请求；
+      所有槽位占满时新请求继续排队累积，空出槽位后合成下一批。默认 1：串行执行（如本地模型推理）
+    - 记录请求数/批次数/条目数/处理耗时/排队等待，供 stats() 输出吞吐指标
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        *,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 10.0,
+        name: str = "batcher",
+        max_in_flight: int = 1,
+    ) -> None:
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.name = name
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        # (items, future, enqueued_at)
+        self._pending: List[Tuple[List[Any], Future, float]] = []
+        self._pending_items = 0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.requests = 0
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.max_seen_batch = 0
+        self._started_at = time.time()
+
+    def submit(self, items: Sequence[Any]) -> Future:
+        fut: Future = Future()
+        items = list(items)
+        if not items:
+            fut.set_result([])
+            return fut
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._pending.append((items, fut, time.time()))
+            self._pending_items += len(items)
+            self.requests += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True, name=f"{self.name}-batcher")
+                self._thread.start()
+            self._cond.notify()
+        return fut
+
+    def run(self, items: Sequence[Any], timeout: Optional[float] = None) -> List[Any]:
+        """同步提交并等待结果。"""
+        return self.submit(items).result(timeout=timeout)
+
+    def _take_batch(self) -> List[Tuple[List[Any], Future, float]]:
+        # 调用方持有 self._cond
+        while True:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return []
+            deadline = self._pending[0][2] + self.max_wait_ms / 1000.0
+            while self._pending_items < self.max_batch_size and not self._closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            taken: List[Tuple[List[Any], Future, float]] = []
+            n = 0
+            while self._pending and (not taken or n + len(self._pending[0][0]) <= self.max_batch_size):
+                req = self._pending.pop(0)
+                n += len(req[0])
+                taken.append(req)
+            self._pending_items -= n
+            if taken:
+                return taken
+
+    def _loop(self) -> None:
+        while True:
+            # 先占槽位再取批：槽位占满期间请求继续累积，空出后合成更大的批次
+            self._slots.acquire()
+            with self._cond:
+                taken = self._take_batch()
+                if taken:
+                    self.in_flight += 1
+            if not taken:
+                self._slots.release()
+                return
+            if self.max_in_flight == 1:
+                self._process(taken)
+            else:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix=f"{self.name}-batch")
+                self._executor.submit(self._process, taken)
+
+    def _process(self, taken: List[Tuple[List[Any], Future, float]]) -> None:
+        try:
+            self._process_batch(taken)
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def _process_batch(self, taken: List[Tuple[List[Any], Future, float]]) -> None:
+        flat: List[Any] = [x for items, _, _ in taken for x in items]
+        t0 = time.time()
+        try:
+            results = list(self.batch_fn(flat))
+            if len(results) != len(flat):
+                raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(flat)} items")
+            error = None
+        except Exception as e:
+            results, error = [], e
+        t1 = time.time()
+        with self._cond:
+            self.batches += 1
+            self.items += len(flat)
+            self.busy_seconds += t1 - t0
+            self.wait_seconds += sum(t0 - enq for _, _, enq in taken)
+            self.max_seen_batch = max(self.max_seen_batch, len(flat))
+            if error is not None:
+                self.errors += 1
+        pos = 0
+        for items, fut, _ in taken:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(results[pos:pos + len(items)])
+            pos += len(items)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            elapsed = max(time.time() - self._started_at, 1e-9)
+            return {
+                "queued": self._pending_items,
+                "inFlight": self.in_flight,
+                "maxInFlight": self.max_in_flight,
+                "requests": self.requests,
+                "batches": self.batches,
+                "items": self.items,
+                "errors": self.errors,
+                "avgBatchSize": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "maxBatchSize": self.max_seen_batch,
+                "avgWaitMs": round(self.wait_seconds * 1000 / self.requests, 2) if self.requests else 0.0,
+                "busyItemsPerSec": round(self.items / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+                "itemsPerSec": round(self.items / elapsed, 2),
+                "utilization": round(self.busy_seconds / elapsed, 4),
+            }
@@ -0,0 +1,54 @@
+from __future__ import annotations
+import threading
+import time
+
+from core.config import settings
+from utils.get_logger import log
+
+# 缓存类用途的 Redis 连接：短超时、失败后冷却一段时间再重连，
+# 保证 Redis 不可用时调用方能立刻退回进程内实现，不拖慢主链路。
+_RETRY_COOLDOWN_SECONDS = 30.0
+
+_lock = threading.Lock()
+_client = None
+_last_failure = 0.0
+
+
+def get_redis():
+    """返回共享的 redis.Redis 客户端；不可用时返回 None。"""
+    global _client, _last_failure
+    if _client is not None:
+        return _client
+    if time.time() - _last_failure < _RETRY_COOLDOWN_SECONDS:
+        return None
+    with _lock:
+        if _client is not None:
+            return _client
+        try:
+            import redis
+            client = redis.Redis(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                socket_connect_timeout=0.2,
+                socket_timeout=0.2,
+            )
+            client.ping()
+            _client = client
+        except Exception as e:
+            _last_failure = time.time()
+            try:
+                log.warning(f"Redis unavailable for cache tier ({settings.REDIS_HOST}:{settings.REDIS_PORT}): {e}")
+            except Exception:
+                pass
+            return None
+    return _client
+
+
+def mark_redis_failed() -> None:
+    """调用方遇到连接错误时调用：丢弃当前客户端并进入冷却期。"""
+    global _client, _last_failure
+    with _lock:
+        _client = None
+        _last_failure = time.time()
+
@@ -0,0 +1,74 @@
+from __future__ import annotations
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "value", "error", "dups", "owner")
+
+    def __init__(self) -> None:
+        self.owner = threading.get_ident()
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+        self.dups = 0
+
+
+class SingleFlight:
+    """
+    同键并发调用合并（线程安全）：
+    - 同一时刻相同 key 只有一个调用真正执行（leader），其余调用等待并共享其结果或异常
+    - leader 返回后立即移除 in-flight 记录，之后的调用重新执行（结果缓存由调用方自行决定）
+    - leader 在 fn 内以相同 key 重入会等待自身而永久阻塞，因此直接抛出 RuntimeError
+    - 记录 calls/shared/errors，便于观测合并效果
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.shared = 0
+        self.errors = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """执行或加入 key 对应的调用，返回 (结果, 是否为共享结果)。"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.owner == threading.get_ident():
+                raise RuntimeError(f"{self.name}: re-entrant call for in-flight key {key!r}")
+            if call is not None:
+                call.dups += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.value, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "inFlight": len(self._calls),
+                "calls": self.calls,
+                "shared": self.shared,
+                "errors": self.errors,
+            }
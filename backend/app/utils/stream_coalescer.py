@@ -0,0 +1,78 @@
+import asyncio
+from typing import AsyncIterator
+
+_END = object()
+
+
+async def coalesce_text_stream(source: AsyncIterator[str], *, max_bytes: int, max_delay_ms: float) -> AsyncIterator[str]:
+    """
+    合并细碎的流式文本片段（如逐字输出的中文 delta），减少 SSE 帧数与写入次数。
+
+    缓冲区满足任一条件即输出一次：
+    - 累计 UTF-8 字节数达到 max_bytes
+    - 缓冲区中最早的片段已等待 max_delay_ms（即使上游暂时没有新片段，也按时输出，首字延迟最多增加 max_delay_ms）
+    两个阈值均 <= 0 时原样透传。关闭本生成器会同时关闭 source（取消上游请求）。
+    """
+    if max_bytes <= 0 and max_delay_ms <= 0:
+        try:
+            async for part in source:
+                yield part
+        finally:
+            await source.aclose()
+        return
+
+    # 独立任务拉取上游，主循环才能在等待新片段时按时间阈值输出
+    q: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for part in source:
+                await q.put(part)
+            await q.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await q.put(e)
+
+    loop = asyncio.get_running_loop()
+    task = asyncio.create_task(pump())
+    buf: list[str] = []
+    size = 0
+    deadline = 0.0
+    try:
+        while True:
+            if buf and max_delay_ms > 0:
+                try:
+                    item = await asyncio.wait_for(q.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    yield "".join(buf)
+                    buf, size = [], 0
+                    continue
+            else:
+                item = await q.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if not buf:
+                deadline = loop.time() + max_delay_ms / 1000.0
+            buf.append(item)
+            size += len(item.encode("utf-8"))
+            if max_bytes > 0 and size >= max_bytes:
+                yield "".join(buf)
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf)
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            # 只吞掉 pump 自身被取消产生的 CancelledError；当前任务正被取消（如 /ask 中途取消）时继续上抛
+            current = asyncio.current_task()
+            if not task.cancelled() or (current is not None and current.cancelling()):
+                raise
+        except Exception:
+            pass
+        finally:
+            await source.aclose()